@@ -2,6 +2,9 @@ import numpy as np
 import time
 import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+from typing import Any, Dict
 
 # Import pyrs modules
 from pyrs.core import MonoSetting  # type: ignore
@@ -11,20 +14,272 @@ from pyrs.core.instrument_geometry import DENEXDetectorShift
 from pyrs.peaks import FitEngineFactory as PeakFitEngineFactory  # type: ignore
 from pyrs.core.nexus_conversion import NeXusConvertingApp
 from pyrs.core.powder_pattern import ReductionApp
+from pyrs.core.reduce_hb2b_pyrs import HistogramBinningPlan, PyHB2BReduction, ResidualStressInstrument
+from pyrs.core.reduction_manager import HB2BReductionManager
+from pyrs.core import mask_util
+from pyrs.utilities.convertdatatypes import to_int
 
 # Import scipy libraries for minimization
 from scipy.optimize import least_squares
 from scipy.optimize import brute
 
+# State of a worker process evaluating residuals, set by _init_calibration_worker
+_worker_state: Dict[str, Any] = dict()
+
+
+def _init_calibration_worker(calibrator):
+    """Initialize a worker process with its own copy of the calibration, including its workspace"""
+    _worker_state['calibrator'] = calibrator
+
+
+def _calibration_residual_worker(function_name, x, args, calibration):
+    """Evaluate a residual function of the calibration of the worker
+
+    :param str function_name: name of the residual (cost) function of FitCalibration
+    :param numpy.ndarray x: parameters to evaluate the residual at
+    :param tuple args: other arguments of the residual function
+    :param numpy.ndarray calibration: current calibration, which the parameters are set to
+    :return: residual
+    """
+    calibrator = _worker_state['calibrator']
+    calibrator.set_calibration_array(calibration)
+
+    return getattr(calibrator, function_name)(np.asarray(x, dtype=np.float64).ravel(), *args)
+
+
+class ResidualWorkers:
+    """
+    Evaluate a residual function of FitCalibration at several points with a pool of worker processes
+
+    Each worker process holds its own copy of the calibration.  The points are the finite difference
+    stencil of the Jacobian for least squares or the grid points for brute force.
+    """
+
+    def __init__(self, executor, function_name, calibration, args, bounds=(-np.inf, np.inf)):
+        """
+        Initialization
+
+        Parameters
+        ----------
+        executor : concurrent.futures.ProcessPoolExecutor
+            pool of the worker processes initialized by _init_calibration_worker
+        function_name : str
+            name of the residual function
+        calibration : numpy.ndarray
+            current calibration
+        args : tuple
+            other arguments of the residual function
+        bounds : tuple
+            lower and upper bounds of the parameters
+
+        """
+        self._executor = executor
+        self._function_name = function_name
+        self._calibration = np.array(calibration)
+        self._args = args
+        self._bounds = bounds
+
+    def map(self, function, points):
+        """Evaluate the residual at the points for brute
+
+        Parameters
+        ----------
+        function : callable
+            the residual function (with arguments) wrapped by brute, which is evaluated by the workers instead
+        points : iterable
+            parameters of each point
+
+        Returns
+        -------
+        list
+            residual of each point
+        """
+        return list(self._executor.map(_calibration_residual_worker, repeat(self._function_name), points,
+                                       repeat(self._args), repeat(self._calibration)))
+
+    def jacobian(self, x, *args):
+        """Jacobian of the residual by 3-point finite differences for least squares
+
+        The steps are the same as scipy's default for the 3-point scheme.  One-sided differences are used for
+        the parameters whose central difference would go out of bounds.
+
+        Parameters
+        ----------
+        x : numpy.ndarray
+            parameters
+        args : tuple
+            other arguments of the residual function
+
+        Returns
+        -------
+        numpy.ndarray
+            Jacobian of shape (number of residuals) x (number of parameters)
+        """
+        x = np.asarray(x, dtype=np.float64)
+        lower, upper = (np.broadcast_to(np.asarray(bound, dtype=np.float64), x.shape) for bound in self._bounds)
+
+        steps = np.finfo(np.float64).eps ** (1. / 3.) * np.where(x >= 0, 1., -1.) * np.maximum(1., np.abs(x))
+        steps = (x + steps) - x
+        central = (x - np.abs(steps) >= lower) & (x + np.abs(steps) <= upper)
+        # one-sided steps go away from the closest bound
+        steps = np.where(central | (x + 2 * np.abs(steps) <= upper), np.abs(steps), -np.abs(steps))
+
+        points = [x]
+        for index in range(x.size):
+            first, second = x.copy(), x.copy()
+            if central[index]:
+                first[index] -= steps[index]
+                second[index] += steps[index]
+            else:
+                first[index] += steps[index]
+                second[index] += 2 * steps[index]
+            points.extend((first, second))
+        if np.all(central):
+            points = points[1:]
+
+        residuals = list(self._executor.map(_calibration_residual_worker, repeat(self._function_name), points,
+                                            repeat(args), repeat(self._calibration)))
+        if np.all(central):
+            residuals.insert(0, None)
+
+        jacobian = np.empty((np.asarray(residuals[1]).size, x.size))
+        for index in range(x.size):
+            first, second = residuals[2 * index + 1], residuals[2 * index + 2]
+            if central[index]:
+                jacobian[:, index] = (second - first) / (2. * steps[index])
+            else:
+                jacobian[:, index] = (-3. * residuals[0] + 4. * first - second) / (2. * steps[index])
+
+        return jacobian
+
+
+class CalibrationPixels:
+    """
+    Counts and raw positions of the pixels of a powder sub run near its expected reflection
+
+    The pixels are selected once.  For each calibration, only their 2theta and eta are calculated
+    to histogram the reflection in each eta slice.
+    """
+
+    def __init__(self, pixel_ids, counts, vanadium, detector_position, reflection, two_theta_bins, eta_slices,
+                 boundary):
+        """
+        Initialization
+
+        Parameters
+        ----------
+        pixel_ids : numpy.ndarray
+            IDs of the pixels
+        counts : numpy.ndarray
+            counts of the pixels
+        vanadium : numpy.ndarray or None
+            vanadium counts of the pixels
+        detector_position : tuple
+            detector 2theta (in PyRS convention) and L2
+        reflection : int
+            index of the reflection of the powder
+        two_theta_bins : tuple
+            origin and width of the 2theta bins
+        eta_slices : tuple
+            centers and width of the eta slices
+        boundary : numpy.ndarray
+            flags of the pixels at the boundary of the selection
+
+        """
+        self.pixel_ids = pixel_ids
+        self.reflection = reflection
+        self._counts = counts
+        self._variances = HistogramBinningPlan._pixel_variances(counts)
+        self._vanadium = vanadium
+        if vanadium is None:
+            self._van_variances = None
+        else:
+            self._van_variances = HistogramBinningPlan._pixel_variances(vanadium)
+        self._two_theta, self._l2 = detector_position
+        self._bin_origin, self._bin_width = two_theta_bins
+        self._eta_step = eta_slices[1]
+        self._num_slices = len(eta_slices[0])
+        self._boundary = boundary
+
+        # row of each eta slice by the index of its center in eta steps: -1 for no slice
+        eta_steps = np.rint(np.asarray(eta_slices[0]) / self._eta_step).astype(int)
+        self._eta_step_min = eta_steps.min()
+        self._eta_rows = np.full(eta_steps.max() - self._eta_step_min + 1, -1, dtype=int)
+        self._eta_rows[eta_steps - self._eta_step_min] = np.arange(eta_steps.size)
+
+    def histogram(self, instrument, calibration, min_2theta, max_2theta):
+        """Histogram the pixels in each eta slice
+
+        Parameters
+        ----------
+        instrument : ResidualStressInstrument
+            instrument to calculate the pixels' 2theta and eta
+        calibration : DENEXDetectorShift or None
+            detector shift
+        min_2theta : float
+            min 2theta of the histogram
+        max_2theta : float
+            max 2theta of the histogram
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray, numpy.ndarray or None
+            2theta (1D), intensities (2D) and uncertainties (2D) of each eta slice.  None if the selected
+            pixels do not cover the 2theta range with the calibration
+
+        """
+        two_theta, eta = instrument.calculate_pixels_angles(self.pixel_ids, self._two_theta, self._l2, calibration)
+
+        # any pixel at the boundary of the selection in range means that other pixels may be in range too
+        if np.any((two_theta[self._boundary] >= min_2theta) & (two_theta[self._boundary] <= max_2theta)):
+            return None
+
+        # bins on the grid of the full 2theta range
+        first_bin = int(np.floor((min_2theta - self._bin_origin) / self._bin_width))
+        num_bins = int(np.ceil((max_2theta - self._bin_origin) / self._bin_width)) - first_bin
+        bin_edges = self._bin_origin + np.arange(first_bin, first_bin + num_bins + 1) * self._bin_width
+        bin_index = np.floor((two_theta - self._bin_origin) / self._bin_width).astype(int) - first_bin
+
+        # eta slice of the nearest center
+        eta_index = np.rint(eta / self._eta_step).astype(int) - self._eta_step_min
+        in_slices = (eta_index >= 0) & (eta_index < self._eta_rows.size)
+        eta_row = np.full(eta.shape, -1)
+        eta_row[in_slices] = self._eta_rows[eta_index[in_slices]]
+
+        valid = (bin_index >= 0) & (bin_index < num_bins) & (eta_row >= 0)
+        index = eta_row[valid] * num_bins + bin_index[valid]
+        shape = self._num_slices, num_bins
+
+        def bin_sum(weights):
+            return np.bincount(index, weights=weights[valid], minlength=shape[0] * shape[1]).reshape(shape)
+
+        data_hist = bin_sum(self._counts)
+        data_var = np.sqrt(bin_sum(self._variances))
+        if self._vanadium is None:
+            van_hist = van_var = [None] * shape[0]
+        else:
+            van_hist = bin_sum(self._vanadium)
+            van_var = np.sqrt(bin_sum(self._van_variances))
+        for row in range(shape[0]):
+            data_hist[row], data_var[row] = PyHB2BReduction.normalize_histogram(data_hist[row], data_var[row],
+                                                                                van_hist[row], van_var[row])
+
+        return 0.5 * (bin_edges[1:] + bin_edges[:-1]), data_hist, data_var
+
 
 class FitCalibration:
     """
     Calibrate by grid searching algorithm using Brute Force or Monte Carlo random walk
     """
 
+    # half width of the 2theta window to fit a reflection
+    PEAK_WINDOW = 3.
+    # margin (in 2theta) of the pixels selected around the fit window for the fast reduction
+    FAST_REDUCTION_MARGIN = 2.
+
     def __init__(self, _inst=None, nexus_file=None, mask_file=None, vanadium=None,
                  eta_slice=3, bins=512, reduction_engine=None, pow_lines=None,
-                 max_nfev=None, method='trf'):
+                 max_nfev=None, method='trf', fast_reduction=False, n_workers=None):
 
         """
         Initialization
@@ -41,6 +296,12 @@ class FitCalibration:
             list of dspace for reflections in the field of view during the experiment
         single_material : bool
             Flag if powder data are from a single material
+        fast_reduction : bool
+            Flag to histogram only the pixels near the expected reflections and to fit them with the
+            numpy engine instead of reducing and fitting the full detector for each calibration
+        n_workers : int or None
+            number of worker processes to evaluate the residuals for the Jacobian or the brute force grid
+            in parallel.  None or 1 to evaluate them in this process
 
         """
 
@@ -51,6 +312,12 @@ class FitCalibration:
 
         self._keep_subrun_list = None
 
+        # pixels selected for the fast reduction: [sub run] = CalibrationPixels or None
+        self._fast_reduction = fast_reduction
+        self._calibration_pixels = dict()
+        self._instrument = None
+        self._vanadium_counts = None
+
         if nexus_file is not None:
             self._reduce_diffraction_data(nexus_file)
         else:
@@ -70,6 +337,15 @@ class FitCalibration:
         self.fitted_ws = None
         self._max_nfev = max_nfev
         self._ref_method = method
+        self._n_workers = n_workers
+
+        # checkpoint of the refinement, written after each stage and every interval residual evaluations
+        self._checkpoint_file = None
+        self._checkpoint_interval = None
+        # refinement stages completed: list of (name, calibration, calibration error, number of residual evaluations)
+        self._stages = list()
+        # checkpoint last written or loaded: (file name, residual settings, residual cache, number of residuals)
+        self._written_checkpoint = None
 
         self._ref_powders = np.array(['Ni', 'Fe', 'Mo'])
         self._ref_powders_sy = np.array([62, 12, -13])
@@ -100,6 +376,19 @@ class FitCalibration:
     def calibration_error_array(self):
         return self._caliberr
 
+    @property
+    def calibration_history(self):
+        # parameters of each residual evaluation (one column per iteration)
+        return np.array(self._calibration).T
+
+    @property
+    def completed_stages(self):
+        return [stage[0] for stage in self._stages]
+
+    @property
+    def stage_results(self):
+        return [(np.copy(stage[1]), np.copy(stage[2])) for stage in self._stages]
+
     @property
     def residual_sum(self):
         return self._residual_sum[-1]
@@ -117,6 +406,20 @@ class FitCalibration:
     def set_max_nfev(self, nfev):
         self._max_nfev = nfev
 
+    def set_n_workers(self, n_workers):
+        self._n_workers = n_workers
+
+    def __getstate__(self):
+        # reduction and fitted data (with Mantid workspaces) are rebuilt by each residual evaluation
+        state = self.__dict__.copy()
+        for name in ('reducer', '_fitting_ws'):
+            state.pop(name, None)
+        state['fitted_ws'] = None
+        # only the main process writes the checkpoint
+        state['_checkpoint_file'] = None
+
+        return state
+
     def set_inst_shifts_wl(self, params):
         self._hidra_ws.set_detector_shift(DENEXDetectorShift(params[0], params[1], params[2],
                                                              params[3], params[4], params[5], params[6]))
@@ -127,12 +430,21 @@ class FitCalibration:
 
     def set_keep_subrun_list(self, keep_list):
         self._keep_subrun_list = keep_list
+        self._residual_cache = dict()
 
     def set_tthbins(self, tth_bins):
         self.bins = tth_bins
+        self._calibration_pixels = dict()
+        self._residual_cache = dict()
 
     def set_etabins(self, eta_bins):
         self.eta_slices = eta_bins
+        self._calibration_pixels = dict()
+        self._residual_cache = dict()
+
+    def set_fast_reduction(self, fast_reduction):
+        self._fast_reduction = fast_reduction
+        self._residual_cache = dict()
 
     def _reduce_diffraction_data(self, nexus_file, mask_file=None, calibration=None):
         converter = NeXusConvertingApp(nexus_file, mask_file)
@@ -211,11 +523,16 @@ class FitCalibration:
         self._calib[7] = float(self.monosetting)
         self._calib_start[7] = float(self.monosetting)
 
-        self._calibration = self._calib.reshape(-1, 1)
+        self._calibration = [np.copy(self._calib)]
         self._residual_sum = []
         self._residual_rmse = []
+        # residuals memoised by the parameter vector: [tuple(x)] = residual
+        self._residual_cache = dict()
 
     def fit_peaks(self):
+        if self._fast_reduction:
+            return self._fit_peaks_fast()
+
         self.reduce_data()
         self._fitting_ws = HidraWorkspace()
         self._fitting_ws.set_sub_runs(range(1, len(self._hidra_ws.reduction_masks) + 1))
@@ -241,7 +558,8 @@ class FitCalibration:
                 _ws = []
                 for peak in peaks:
                     # print(sub_run, peak, peaks)
-                    fits = _fit_engine.fit_multiple_peaks(["peak_tags"], [peak - 3], [peak + 3])
+                    fits = _fit_engine.fit_multiple_peaks(["peak_tags"], [peak - self.PEAK_WINDOW],
+                                                          [peak + self.PEAK_WINDOW])
 
                     _ws.append(fits.fitted)
                     center_errors = np.concatenate((center_errors,
@@ -252,6 +570,141 @@ class FitCalibration:
 
         return center_errors
 
+    def _fit_peaks_fast(self):
+        """Fit the expected reflection of each powder sub run from the pixels selected near it
+
+        Returns
+        -------
+        numpy.ndarray
+            differences between the fitted and the expected peak centers of each eta slice
+
+        """
+        calibration = self._hidra_ws.get_detector_shift()
+
+        center_errors = np.array([])
+        self.fitted_ws = [None] * self.sub_runs.size
+
+        for i_run, sub_run in enumerate(self.sub_runs):
+            if not self._keep_subrun_list[i_run]:
+                continue
+
+            if sub_run not in self._calibration_pixels:
+                self._calibration_pixels[sub_run] = self._select_calibration_pixels(sub_run)
+            pixels = self._calibration_pixels[sub_run]
+            if pixels is None:
+                # no reflection in the detector
+                continue
+
+            peak = self.get_diff_peaks(sub_run - 1)[pixels.reflection]
+            diffraction_data = pixels.histogram(self._instrument, calibration, peak - self.PEAK_WINDOW,
+                                                peak + self.PEAK_WINDOW)
+            if diffraction_data is None:
+                # the reflection moved out of the selected pixels: select again around it
+                pixels = self._calibration_pixels[sub_run] = self._select_calibration_pixels(sub_run)
+                if pixels is None:
+                    continue
+                peak = self.get_diff_peaks(sub_run - 1)[pixels.reflection]
+                diffraction_data = pixels.histogram(self._instrument, calibration, peak - self.PEAK_WINDOW,
+                                                    peak + self.PEAK_WINDOW)
+            tth, int_vec, error_vec = diffraction_data
+
+            fitting_ws = HidraWorkspace()
+            fitting_ws.set_sub_runs(range(1, int_vec.shape[0] + 1))
+            fitting_ws.set_reduced_diffraction_data_block(fitting_ws.get_sub_runs(), None, tth, int_vec, error_vec)
+
+            fit_engine = PeakFitEngineFactory.getInstance(fitting_ws, 'PseudoVoigt', 'Linear',
+                                                          wavelength=self._calib[7], out_of_plane_angle=None,
+                                                          engine_name='numpy', peak_at_maximum=True)
+            fits = fit_engine.fit_multiple_peaks(["peak_tags"], [peak - self.PEAK_WINDOW], [peak + self.PEAK_WINDOW])
+
+            self.fitted_ws[i_run] = [fits.fitted]
+            center_errors = np.concatenate((center_errors,
+                                            fits.peakcollections[0].get_effective_params()[0]['Center'] - peak))
+
+        return center_errors
+
+    def _select_calibration_pixels(self, sub_run):
+        """Select the pixels of a sub run near its expected reflection with the current calibration
+
+        The reflection is the first one in the 2theta range of the detector.  The pixels are selected
+        within the fit window and a margin, such that the reflection can move with the calibration.
+
+        Parameters
+        ----------
+        sub_run : int
+            sub run number
+
+        Returns
+        -------
+        CalibrationPixels or None
+            None if there is no reflection in the 2theta range of the detector
+
+        """
+        calibration = self._hidra_ws.get_detector_shift()
+        detector_position = -self._hidra_ws.get_detector_2theta(sub_run), self._hidra_ws.get_l2(sub_run)
+
+        # geometry of all the pixels
+        if self._instrument is None:
+            self._instrument = ResidualStressInstrument(self._hidra_ws.get_instrument_setup())
+        self._instrument.build_instrument(detector_position[0], detector_position[1], calibration)
+        two_theta = self._instrument.get_pixels_2theta(1)
+        eta = self._instrument.get_eta_values(1)
+
+        # Pixels used by the reduction: not masked, finite counts and with vanadium counts
+        counts = self._hidra_ws.get_detector_counts(sub_run).astype(np.float64)
+        valid = np.isfinite(counts)
+        mask_vec = self._hidra_ws.get_detector_mask(True)
+        if isinstance(self.mask_file, str):
+            mask_vec = mask_util.load_pyrs_mask(self.mask_file)[0]
+        elif self.mask_file is not None:
+            mask_vec = self.mask_file
+        if mask_vec is not None:
+            valid &= mask_vec == 1
+        vanadium = self._get_vanadium_counts()
+        if vanadium is not None:
+            valid &= vanadium >= 0.9
+
+        # 2theta bins of the eta slices
+        eta_step = abs(self.eta_slices)
+        eta_centers = HB2BReductionManager().generate_eta_roi_vector(eta_step, -8.2, 8.2)
+        in_slices = valid & (eta >= eta_centers.min() - eta_step / 2.) & (eta <= eta_centers.max() + eta_step / 2.)
+        if not np.any(in_slices):
+            return None
+        min_2theta, max_2theta = two_theta[in_slices].min(), two_theta[in_slices].max()
+        bin_width = (max_2theta - min_2theta) / self.bins
+
+        # first reflection in the 2theta range
+        peaks = self.get_diff_peaks(sub_run - 1)
+        reflections = np.flatnonzero((peaks > (min_2theta + 1)) * (peaks < (max_2theta - 1)))
+        if reflections.size == 0:
+            return None
+
+        distance = np.abs(two_theta - peaks[reflections[0]])
+        selected = valid & (distance <= self.PEAK_WINDOW + self.FAST_REDUCTION_MARGIN)
+        boundary = distance[selected] > self.PEAK_WINDOW + self.FAST_REDUCTION_MARGIN / 2.
+        pixel_ids = np.flatnonzero(selected)
+
+        return CalibrationPixels(pixel_ids, counts[pixel_ids], None if vanadium is None else vanadium[pixel_ids],
+                                 detector_position, reflections[0], (min_2theta - bin_width, bin_width),
+                                 (eta_centers, eta_step), boundary)
+
+    def _get_vanadium_counts(self):
+        """Vanadium counts, which are loaded at the first call
+
+        Returns
+        -------
+        numpy.ndarray or None
+            None if there is no vanadium
+
+        """
+        if self.vanadium is None:
+            return None
+
+        if self._vanadium_counts is None:
+            self._vanadium_counts = HB2BReductionManager().load_vanadium(self.vanadium)[0]
+
+        return self._vanadium_counts
+
     def get_alignment_residual(self, x):
         """ Cost function for peaks alignment to determine wavelength
         :param x: list/array of detector shift/rotation and neutron wavelength values
@@ -261,34 +714,76 @@ class FitCalibration:
         :return:
         """
 
-        self._calibration = np.concatenate((self._calibration, x.reshape(-1, 1)), axis=1)
+        self._calibration.append(np.array(x, dtype=np.float64))
 
         self.set_inst_shifts_wl(x)
         # self._hidra_ws.set_wavelength(x[7], False)
         # self._hidra_ws.set_detector_shift(DENEXDetectorShift(x[0], x[1], x[2], x[3], x[4], x[5], x[6]))
 
-        residual = self.fit_peaks()
+        # identical parameters (e.g. starting points of repeated stages) are not fitted again
+        key = tuple(float(value) for value in x)
+        if key not in self._residual_cache:
+            self._residual_cache[key] = self.fit_peaks()
+        residual = np.copy(self._residual_cache[key])
 
         print("")
-        print('Iteration      {}'.format(self._calibration.shape[1]))
+        print('Iteration      {}'.format(len(self._calibration)))
         print('RMSE         = {}'.format(np.sqrt((residual**2).sum() / residual.shape[0])))
         print('Residual Sum = {}'.format(np.sum(residual)))
 
         self._residual_sum.append(residual.sum())
         self._residual_rmse.append(np.sqrt((residual**2).sum() / residual.shape[0]))
 
+        if self._checkpoint_interval is not None and len(self._residual_sum) % self._checkpoint_interval == 0:
+            # the stages only change with complete_stage: only the new residuals are written within a stage
+            if self._written_checkpoint is not None and self._written_checkpoint[0] == self._checkpoint_file:
+                self._write_residuals(self._checkpoint_file)
+            else:
+                self.write_checkpoint()
+
         return residual
 
     def FitDetector(self, fun, x0, jac='3-point', bounds=[],
                     i_index=2, Brute=False):
 
+        if self._n_workers is None or to_int('Number of workers', self._n_workers, min_value=1) == 1:
+            return self._fit_detector(fun, x0, bounds, i_index, Brute)
+
+        if getattr(fun, '__self__', None) is not self:
+            raise RuntimeError('Residual function {} is not a method of the calibration'.format(fun))
+
+        # each worker process holds a copy of the calibration
+        with ProcessPoolExecutor(max_workers=self._n_workers, initializer=_init_calibration_worker,
+                                 initargs=(self,)) as executor:
+            if Brute or self._ref_method == 'lm':
+                workers = ResidualWorkers(executor, fun.__name__, self._calib, (Brute, i_index))
+            else:
+                workers = ResidualWorkers(executor, fun.__name__, self._calib, (Brute, i_index), bounds)
+            return self._fit_detector(fun, x0, bounds, i_index, Brute, workers)
+
+    def _fit_detector(self, fun, x0, bounds, i_index, Brute, workers=None):
+        """Refine the calibration parameters by brute force or least squares
+
+        Parameters
+        ----------
+        workers : ResidualWorkers or None
+            workers to evaluate the brute force grid or the Jacobian.  None to evaluate them in this process
+
+        Returns
+        -------
+        list
+            parameters, their uncertainties and status
+        """
         if Brute:
             BOUNDS = []
             lL = bounds[1]
             uL = bounds[0]
             for i_b in range(len(uL)):
                 BOUNDS.append([lL[i_b], uL[i_b]])
-            out1 = brute(fun, ranges=BOUNDS, args=(Brute, i_index), Ns=11)
+            if workers is None:
+                out1 = brute(fun, ranges=BOUNDS, args=(Brute, i_index), Ns=11)
+            else:
+                out1 = brute(fun, ranges=BOUNDS, args=(Brute, i_index), Ns=11, workers=workers.map)
             return [out1, np.array([0]), 1]
 
         else:
@@ -298,11 +793,12 @@ class FitCalibration:
             if len(x0) != len(bounds[1]):
                 raise RuntimeError('User must specify bounds of equal length')
 
+            jac = '3-point' if workers is None else workers.jacobian
             if self._ref_method == 'lm':
-                out = least_squares(fun, x0, jac='3-point', method=self._ref_method,
+                out = least_squares(fun, x0, jac=jac, method=self._ref_method,
                                     max_nfev=self._max_nfev, args=(Brute, i_index))
             else:
-                out = least_squares(fun, x0, jac='3-point', bounds=bounds, method=self._ref_method,
+                out = least_squares(fun, x0, jac=jac, bounds=bounds, method=self._ref_method,
                                     max_nfev=self._max_nfev, args=(Brute, i_index))
 
             J = out.jac
@@ -854,7 +1350,7 @@ class FitCalibration:
         if refine_step is not None:
             print_string += '\nrefined using {}\n'.format(refine_step)
 
-        print_string += 'Iterations     {}\n'.format(self._calibration.shape[1])
+        print_string += 'Iterations     {}\n'.format(len(self._calibration))
         print_string += 'RMSE         = {}\n'.format(self._residual_rmse[-1])
         print_string += 'Residual Sum = {}\n'.format(self._residual_sum[-1])
 
@@ -868,3 +1364,178 @@ class FitCalibration:
             print(print_string)
 
         return
+
+    def set_checkpoint(self, file_name, interval=None):
+        """Set the checkpoint file written after each refinement stage
+
+        Parameters
+        ----------
+        file_name : str or None
+            output JSON checkpoint file name.  None to stop writing checkpoints
+        interval : int or None
+            number of residual evaluations between checkpoints within a stage.  None to write them
+            only after each stage
+
+        Returns
+        -------
+        None
+        """
+        if interval is not None:
+            interval = to_int('Checkpoint interval', interval, min_value=1)
+
+        self._checkpoint_file = file_name
+        self._checkpoint_interval = interval
+
+    def complete_stage(self, name):
+        """Record the calibration refined by a stage and write the checkpoint
+
+        Parameters
+        ----------
+        name : str
+            name of the refinement stage (method)
+
+        Returns
+        -------
+        None
+        """
+        self._stages.append((name, np.copy(self._calib), np.copy(self._caliberr), len(self._residual_sum)))
+        self.write_checkpoint()
+
+    def reset_stages(self):
+        """Forget the completed refinement stages so that a recipe starts from its first stage"""
+        self._stages = list()
+        self._written_checkpoint = None
+
+    def _residual_settings(self):
+        # reduction settings that the memoised residuals depend on
+        keep_list = None if self._keep_subrun_list is None else [bool(keep) for keep in self._keep_subrun_list]
+        return {'bins': self.bins, 'eta_slices': self.eta_slices, 'fast_reduction': bool(self._fast_reduction),
+                'keep_sub_runs': keep_list}
+
+    def write_checkpoint(self, file_name=None):
+        """Write the state of the refinement to a JSON checkpoint file
+
+        The calibration, the completed stages and the iteration history until the last completed stage are
+        written to the JSON file.  The memoised residuals are written to the file_name.residuals JSON lines file,
+        to which only the residuals evaluated since the last checkpoint are appended.  The refinement can be
+        resumed from both files with load_checkpoint
+
+        Parameters
+        ----------
+        file_name: str or None
+            output JSON file name.  If None, write to the file set by set_checkpoint (if any)
+
+        Returns
+        -------
+        None
+        """
+        if file_name is None:
+            file_name = self._checkpoint_file
+            if file_name is None:
+                return
+
+        # the iterations of an interrupted stage are repeated on resume
+        num_evaluations = self._stages[-1][3] if self._stages else 0
+        checkpoint = {'calibration': self._calib.tolist(),
+                      'calibration_error': self._caliberr.tolist(),
+                      'calibration_start': self._calib_start.tolist(),
+                      'status': int(self._calibstatus),
+                      'stages': [{'method': name, 'calibration': calib.tolist(), 'calibration_error': error.tolist(),
+                                  'evaluations': evaluations}
+                                 for name, calib, error, evaluations in self._stages],
+                      'history': [calib.tolist() for calib in self._calibration[:num_evaluations + 1]],
+                      'residual_sum': [float(value) for value in self._residual_sum[:num_evaluations]],
+                      'residual_rmse': [float(value) for value in self._residual_rmse[:num_evaluations]],
+                      'refinement_summary': self.refinement_summary}
+
+        # write to a temporary file first so that a job dying while writing leaves the previous checkpoint
+        temp_name = '{}.tmp'.format(file_name)
+        with open(temp_name, 'w') as outfile:
+            json.dump(checkpoint, outfile)
+        os.replace(temp_name, file_name)
+
+        self._write_residuals(file_name)
+
+    def _write_residuals(self, file_name):
+        # the first line are the reduction settings and each following line a memoised [parameters, residual]
+        residual_name = '{}.residuals'.format(file_name)
+        settings = self._residual_settings()
+
+        written = self._written_checkpoint
+        if written is not None and written[:2] == (file_name, settings) and written[2] is self._residual_cache:
+            with open(residual_name, 'a') as outfile:
+                for key, residual in islice(self._residual_cache.items(), written[3], None):
+                    outfile.write(json.dumps([list(key), residual.tolist()]) + '\n')
+        else:
+            # written for another checkpoint or other residuals: start again
+            temp_name = '{}.tmp'.format(residual_name)
+            with open(temp_name, 'w') as outfile:
+                outfile.write(json.dumps(settings) + '\n')
+                for key, residual in self._residual_cache.items():
+                    outfile.write(json.dumps([list(key), residual.tolist()]) + '\n')
+            os.replace(temp_name, residual_name)
+
+        self._written_checkpoint = (file_name, settings, self._residual_cache, len(self._residual_cache))
+
+    def load_checkpoint(self, file_name):
+        """Resume the refinement from a JSON checkpoint file
+
+        The calibration and its iteration history are restored to the ones after the last completed stage.
+        Memoised residuals are restored if the reduction settings are the same, such that repeating an
+        interrupted stage does not evaluate its earlier iterations again
+
+        Parameters
+        ----------
+        file_name : str
+            JSON checkpoint file written by write_checkpoint, next to its file_name.residuals file
+
+        Returns
+        -------
+        list
+            names of the completed stages
+        """
+        with open(file_name) as fIN:
+            checkpoint = json.load(fIN)
+
+        self._calib = np.array(checkpoint['calibration'], dtype=np.float64)
+        self._caliberr = np.array(checkpoint['calibration_error'], dtype=np.float64)
+        self._calib_start = np.array(checkpoint['calibration_start'], dtype=np.float64)
+        self._calibstatus = checkpoint['status']
+        self._stages = [(stage['method'], np.array(stage['calibration'], dtype=np.float64),
+                         np.array(stage['calibration_error'], dtype=np.float64), stage['evaluations'])
+                        for stage in checkpoint['stages']]
+        self._calibration = [np.array(calib, dtype=np.float64) for calib in checkpoint['history']]
+        self._residual_sum = checkpoint['residual_sum']
+        self._residual_rmse = checkpoint['residual_rmse']
+        self.refinement_summary = checkpoint['refinement_summary']
+
+        self._read_residuals(file_name)
+
+        return self.completed_stages
+
+    def _read_residuals(self, file_name):
+        # memoised residuals written by _write_residuals, if the reduction settings are the same
+        self._residual_cache = dict()
+        self._written_checkpoint = None
+        residual_name = '{}.residuals'.format(file_name)
+        if not os.path.exists(residual_name):
+            return
+
+        with open(residual_name) as fIN:
+            settings = json.loads(fIN.readline())
+            if settings != self._residual_settings():
+                print('Reduction settings differ from the checkpoint {}: residuals are evaluated again'
+                      ''.format(file_name))
+                return
+
+            for line in fIN:
+                try:
+                    key, residual = json.loads(line)
+                except ValueError:
+                    # the last line of a job dying while appending: the file is written again from the start
+                    break
+                self._residual_cache[tuple(key)] = np.array(residual)
+            else:
+                self._written_checkpoint = (file_name, settings, self._residual_cache, len(self._residual_cache))
+
+        return self.completed_stages
@@ -9,20 +9,26 @@ from mantid.kernel import Int64FilteredTimeSeriesProperty, StringTimeSeriesPrope
 from mantid.simpleapi import mtd, DeleteWorkspace, LoadEventNexus, LoadMask, RemoveLogs
 from mantid.simpleapi import CopyLogs, CreateSampleWorkspace
 
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import os
+import time
+from typing import NamedTuple, Optional
 from pyrs.core import workspaces
 from pyrs.core.instrument_geometry import DENEXDetectorGeometry, HidraSetup
 from pyrs.core import MonoSetting  # type: ignore
 from pyrs.dataobjects import HidraConstants  # type: ignore
 from pyrs.projectfile import HidraProjectFile, HidraProjectFileMode  # type: ignore
 from pyrs.utilities import checkdatatypes
+from pyrs.utilities.convertdatatypes import to_int
 
 SUBRUN_LOGNAME = 'scan_index'
 NUM_PIXEL_1D = 1024
 HIDRA_PIXEL_NUMBER = NUM_PIXEL_1D * NUM_PIXEL_1D
 PIXEL_SIZE = 0.3 / NUM_PIXEL_1D
 ARM_LENGTH = 0.985
+# default upper limit of the memory (in bytes) for the neutron events read from NeXus file at once
+DEFAULT_EVENT_MEMORY = 256 * 1024 ** 2
 
 DEFAULT_KEEP_LOGS = ['experiment_identifier', 'run_number', 'run_title', 'file_notes', 'start_time', 'end_time',
                      'SampleId', 'SampleName', 'SampleDescription', 'StrainDirection', 'hklPhase', 'Wavelength',
@@ -278,6 +284,21 @@ class Splitter:
                 self.propertyFilters.append(time_filter)
 
 
+class ConversionReport(NamedTuple):
+    """Outcome of converting one NeXus file in a batch"""
+    nexus_file: str
+    project_file: str
+    skipped: bool  # project file is newer than NeXus file
+    duration: float  # seconds
+    num_events: int
+    error: Optional[str] = None
+
+    @property
+    def event_rate(self) -> float:
+        """Number of events converted per second"""
+        return self.num_events / self.duration if self.duration > 0. else 0.
+
+
 class NeXusConvertingApp:
     """
     Convert NeXus file to Hidra project file
@@ -287,8 +308,13 @@ class NeXusConvertingApp:
     :type mask_file_name: str, optional
     :param extra_logs: list of string with no default logs to keep in project file
     :type extra_logs: list, optional
+    :param event_memory: maximum memory in bytes for the events read from NeXus file at once
+    :type event_memory: int, optional
+    :param mask_array: mask already loaded (1 to keep, 0 to mask) instead of mask file
+    :type mask_array: numpy.ndarray, optional
     """
-    def __init__(self, nexus_file_name=None, mask_file_name=None, extra_logs=list(), live_wsp=None):
+    def __init__(self, nexus_file_name=None, mask_file_name=None, extra_logs=list(), live_wsp=None,
+                 event_memory=DEFAULT_EVENT_MEMORY, mask_array=None):
         """Initialization
 
         Parameters
@@ -301,10 +327,19 @@ class NeXusConvertingApp:
             Name of masking file
         extra_logs : list, tuple
             list of string with no default logs to keep in project file
+        event_memory : int, None
+            maximum memory in bytes for the events read from NeXus file at once. The events are histogrammed
+            in chunks within this limit. None to read all the events at once
+        mask_array : numpy.ndarray, None
+            mask already loaded (1 to keep, 0 to mask), e.g., shared among runs. Ignored if mask_file_name is given
         """
         # configure logging for this class
         self._log = Logger(__name__)
 
+        if event_memory is not None:
+            event_memory = to_int('Event memory', event_memory, min_value=1)
+        self._event_memory = event_memory
+
         if nexus_file_name is not None:
             # validate NeXus file exists
             checkdatatypes.check_file_name(nexus_file_name, True, False, False, 'NeXus file')
@@ -340,6 +375,12 @@ class NeXusConvertingApp:
         self.mask_array = None  # TODO to promote direct access
         if mask_file_name:
             self.__load_mask(mask_file_name)
+        elif mask_array is not None:
+            checkdatatypes.check_numpy_arrays('Mask array', [mask_array], 1, False)
+            if mask_array.shape[0] != HIDRA_PIXEL_NUMBER:
+                raise RuntimeError('Mask array has {} pixels but detector has {} pixels'
+                                   ''.format(mask_array.shape[0], HIDRA_PIXEL_NUMBER))
+            self.mask_array = mask_array
 
         # create the hidra workspace
         self._hidra_workspace = workspaces.HidraWorkspace(self._nexus_name)
@@ -498,9 +539,81 @@ class NeXusConvertingApp:
 
         return event_id_array, subrun_eventindex_array
 
+    def histogram_events_nxs(self):
+        """Histogram the events of each sub run by reading ``event_id`` from NeXus file in chunks
+
+        The events are read from the sub run's first event to its last one in chunks bounded by the event memory
+        such that the whole ``event_id`` array is never loaded
+
+        Returns
+        -------
+        list, list
+            sub runs and their counts on each detector pixel
+        """
+        with h5py.File(self._nexus_name, 'r') as nexus_h5:
+            bank1_events = nexus_h5['entry']['bank1_events']
+            # Check number of neutron events.  Raise exception if there is no neutron event
+            if bank1_events['total_counts'][()][0] < 0.1:
+                # no counts
+                raise RuntimeError('Run {} has no count.  Proper reduction requires the run to have count'
+                                   ''.format(self._nexus_name))
+
+            # detector id for the events
+            event_id_dataset = bank1_events['event_id']
+            num_events = event_id_dataset.shape[0]
+            chunk_size = max(1, self._event_memory // event_id_dataset.dtype.itemsize)
+
+            if self._splitter:
+                # get event index array: same size as pulse times
+                event_index_array = bank1_events['event_index'][()]
+                # get pulse times
+                pulse_time_array = convert_pulses_to_datetime64(bank1_events['event_time_zero'])
+
+                subrun_eventindex_array = self._generate_subrun_event_indices(pulse_time_array, event_index_array,
+                                                                              num_events)
+                # reduce memory foot print
+                del pulse_time_array, event_index_array
+
+                subruns = self._splitter.subruns.tolist()
+                event_ranges = zip(subrun_eventindex_array[::2].tolist(), subrun_eventindex_array[1::2].tolist())
+            else:  # or histogram everything
+                subruns = [1]
+                event_ranges = [(0, num_events)]
+
+            hist_list = list()
+            for start_event_index, stop_event_index in event_ranges:
+                # count the occurrence of each event ID (aka detector ID) as counts on each detector pixel
+                hist = np.zeros(HIDRA_PIXEL_NUMBER, dtype=np.int64)
+                stop_event_index = min(stop_event_index, num_events)
+                for chunk_start in range(start_event_index, stop_event_index, chunk_size):
+                    chunk_stop = min(chunk_start + chunk_size, stop_event_index)
+                    chunk_hist = np.bincount(event_id_dataset[chunk_start:chunk_stop], minlength=HIDRA_PIXEL_NUMBER)
+                    if chunk_hist.size > hist.size:
+                        # event IDs out of the detector
+                        chunk_hist[:hist.size] += hist
+                        hist = chunk_hist
+                    else:
+                        hist[:chunk_hist.size] += chunk_hist
+                hist_list.append(hist)
+
+        return subruns, hist_list
+
     def split_events_sub_runs(self):
         '''Filter the data by ``scan_index`` and set counts array in the hidra_workspace'''
 
+        if self._live_wsp is None and self._event_memory is not None:
+            subruns, hist_list = self.histogram_events_nxs()
+            for subrun, hist in zip(subruns, hist_list):
+                # mask (set to zero) the pixels that are not wanted
+                if self.mask_array is not None:
+                    assert hist.shape == self.mask_array.shape
+                    hist *= self.mask_array
+
+                # set it in the workspace
+                self._hidra_workspace.set_raw_counts(int(subrun), hist)
+
+            return np.array(subruns)
+
         if self._live_wsp is not None:
             event_id_array, subrun_eventindex_array = self.get_events_time_wsp()
         else:
@@ -695,3 +808,372 @@ class NeXusConvertingApp:
         hydra_file.write_instrument_geometry(HidraSetup(self._hidra_workspace.get_instrument_setup()))
         # save experimental data/detector counts
         self._hidra_workspace.save_experimental_data(hydra_file)
+
+
+def _read_das_log(das_logs, log_name):
+    """Read a sample log from the ``DASlogs`` of a NeXus file
+
+    Returns
+    -------
+    numpy.ndarray, numpy.ndarray, str
+        absolute times, values and units of the log
+    """
+    time_dataset = das_logs[log_name]['time']
+    start_time = time_dataset.attrs['start']
+    if isinstance(start_time, bytes):
+        start_time = start_time.decode()
+    # through nanoseconds as numpy truncates things to integers during the conversion
+    times = np.datetime64(start_time) + time_dataset[()] * 1.e9 * np.timedelta64(1, 'ns')
+
+    value_dataset = das_logs[log_name]['value']
+    units = value_dataset.attrs.get('units', '')
+    if isinstance(units, bytes):
+        units = units.decode()
+
+    return times, value_dataset[()], units
+
+
+def _time_average_log(times, values, start_time, stop_time):
+    """Time average of a log, which keeps its value until the next change, between start and stop time
+
+    Non-numeric logs take the value at the start time
+    """
+    if values.dtype.kind not in 'iuf' or stop_time <= start_time:
+        return values[max(np.searchsorted(times, start_time, side='right') - 1, 0)]
+
+    # times of the changes within the time range
+    knots = np.concatenate([[start_time], times[(times > start_time) & (times < stop_time)], [stop_time]])
+    indexes = np.maximum(np.searchsorted(times, knots[:-1], side='right') - 1, 0)
+    weights = np.diff(knots) / np.timedelta64(1, 'ns')
+
+    return np.sum(values[indexes] * weights) / np.sum(weights)
+
+
+class IncrementalNeXusConverter:
+    """Convert a NeXus file of a run in progress to Hidra project file incrementally
+
+    Each call to :py:meth:`update` only histograms the events recorded since the previous call into the sub runs
+    they belong to, and rewrites the counts of these sub runs and the (per sub run) sample logs in the project file.
+    Sub runs are defined by the ``scan_index`` log, read with the other logs from ``DASlogs`` of the NeXus file.
+    Sample logs are averaged over the sub run's time so far.  Unlike :py:class:`NeXusConvertingApp`, the start time
+    of the first sub run is not corrected with the motor setpoints.
+
+    A complete NeXus file can be replayed in time slices by calling :py:meth:`update` with increasing stop times.
+    """
+
+    def __init__(self, nexus_file_name, project_file_name, mask_array=None, extra_logs=list(),
+                 event_memory=DEFAULT_EVENT_MEMORY):
+        """Initialization
+
+        Parameters
+        ----------
+        nexus_file_name : str
+            Name of NeXus file being written
+        project_file_name : str
+            Name of the project file to write (and overwrite at the first update)
+        mask_array : numpy.ndarray, None
+            mask (1 to keep, 0 to mask) applied to the counts
+        extra_logs : list, tuple
+            list of string with no default logs to keep in project file
+        event_memory : int
+            maximum memory in bytes for the events read from NeXus file at once
+        """
+        self._log = Logger(__name__)
+
+        checkdatatypes.check_file_name(nexus_file_name, True, False, False, 'NeXus file')
+        checkdatatypes.check_file_name(project_file_name, False, True, False, 'Hidra project file')
+        if mask_array is not None:
+            checkdatatypes.check_numpy_arrays('Mask array', [mask_array], 1, False)
+        self._nexus_name = nexus_file_name
+        self._project_name = project_file_name
+        self._mask_array = mask_array
+        self._event_memory = to_int('Event memory', event_memory, min_value=1)
+
+        self._logs_to_keep = set(extra_logs) | set(DEFAULT_KEEP_LOGS) | set(SWEEPING_LOGS)
+
+        # progress: the first pulse not processed and the number of events processed
+        self._next_pulse = 0
+        self._next_event = 0
+        self._first_pulse_time = None
+        self._last_pulse_time = None
+
+        # [sub run] = counts on each detector pixel
+        self._counts = dict()
+
+        self._project_created = False
+
+    @property
+    def last_pulse_time(self):
+        """Time of the last pulse processed.  None before any update"""
+        return self._last_pulse_time
+
+    @property
+    def sub_runs(self):
+        """Sub runs with events so far"""
+        return sorted(self._counts.keys())
+
+    def get_raw_counts(self, sub_run):
+        """Counts on each detector pixel (before masking) of a sub run so far"""
+        return self._counts[sub_run]
+
+    def update(self, stop_time=None):
+        """Process the events recorded since the last update and write the updated sub runs to project file
+
+        Parameters
+        ----------
+        stop_time : numpy.datetime64, str, None
+            only process the pulses before this time, e.g., to replay a complete NeXus file. None for all
+
+        Returns
+        -------
+        list
+            sub runs updated
+        """
+        with h5py.File(self._nexus_name, 'r') as nexus_h5:
+            bank1_events = nexus_h5['entry']['bank1_events']
+            pulse_time_array = convert_pulses_to_datetime64(bank1_events['event_time_zero'])
+            event_index_array = bank1_events['event_index'][()]
+            event_id_dataset = bank1_events['event_id']
+            num_events = event_id_dataset.shape[0]
+
+            das_logs = nexus_h5['entry']['DASlogs']
+            logs = {log_name: _read_das_log(das_logs, log_name) for log_name in das_logs
+                    if log_name in self._logs_to_keep}
+
+            # pulses to process: the last pulse processed is included again as its events might be incomplete
+            num_pulses = min(pulse_time_array.size, event_index_array.size)
+            if stop_time is not None:
+                num_pulses = min(num_pulses, np.searchsorted(pulse_time_array, np.datetime64(stop_time)))
+            first_pulse = max(self._next_pulse - 1, 0)
+            if num_pulses <= first_pulse:
+                return list()
+
+            # event range of each pulse excluding the events processed
+            event_stops = np.append(event_index_array[first_pulse + 1:num_pulses],
+                                    event_index_array[num_pulses] if num_pulses < event_index_array.size
+                                    else num_events)
+            event_stops = np.minimum(event_stops, num_events)
+            event_starts = np.minimum(np.maximum(event_index_array[first_pulse:num_pulses], self._next_event),
+                                      event_stops)
+
+            # sub run of each pulse, 0 for events outside of sub runs
+            pulse_times = pulse_time_array[first_pulse:num_pulses]
+            if SUBRUN_LOGNAME in logs:
+                scan_times, scan_values, _ = logs[SUBRUN_LOGNAME]
+                scan_indexes = np.searchsorted(scan_times, pulse_times, side='right') - 1
+                pulse_sub_runs = np.where(scan_indexes >= 0, scan_values[np.maximum(scan_indexes, 0)], 0)
+            else:
+                pulse_sub_runs = np.ones(pulse_times.size, dtype=int)
+
+            # histogram the events of consecutive pulses in the same sub run
+            updated_sub_runs = set()
+            segment_starts = np.concatenate([[0], np.where(np.diff(pulse_sub_runs) != 0)[0] + 1])
+            segment_stops = np.append(segment_starts[1:], pulse_sub_runs.size)
+            chunk_size = max(1, self._event_memory // event_id_dataset.dtype.itemsize)
+            for segment_start, segment_stop in zip(segment_starts, segment_stops):
+                sub_run = int(pulse_sub_runs[segment_start])
+                start_event_index = int(event_starts[segment_start])
+                stop_event_index = int(event_stops[segment_stop - 1])
+                if sub_run <= 0 or stop_event_index <= start_event_index:
+                    continue
+                hist = self._counts.setdefault(sub_run, np.zeros(HIDRA_PIXEL_NUMBER, dtype=np.int64))
+                for chunk_start in range(start_event_index, stop_event_index, chunk_size):
+                    chunk_stop = min(chunk_start + chunk_size, stop_event_index)
+                    hist += np.bincount(event_id_dataset[chunk_start:chunk_stop], minlength=HIDRA_PIXEL_NUMBER)
+                updated_sub_runs.add(sub_run)
+
+        self._next_pulse = num_pulses
+        self._next_event = max(self._next_event, int(event_stops[-1]))
+        if self._first_pulse_time is None:
+            self._first_pulse_time = pulse_time_array[0]
+        self._last_pulse_time = pulse_time_array[num_pulses - 1]
+
+        if len(updated_sub_runs) > 0:
+            self._write_project_file(sorted(updated_sub_runs), logs)
+
+        return sorted(updated_sub_runs)
+
+    def _sub_run_time_ranges(self, logs):
+        """Start and stop times of each sub run with events, stop time being clipped to the last pulse processed
+
+        Returns
+        -------
+        dict
+            [sub run] = (start time, stop time)
+        """
+        if SUBRUN_LOGNAME not in logs:
+            return {1: (self._first_pulse_time, self._last_pulse_time)}
+
+        scan_times, scan_values, _ = logs[SUBRUN_LOGNAME]
+        time_ranges = dict()
+        for index, sub_run in enumerate(scan_values.tolist()):
+            if sub_run not in self._counts or sub_run in time_ranges:
+                continue
+            stop_time = scan_times[index + 1] if index + 1 < scan_times.size else self._last_pulse_time
+            time_ranges[sub_run] = scan_times[index], min(stop_time, self._last_pulse_time)
+
+        return time_ranges
+
+    def _write_project_file(self, updated_sub_runs, logs):
+        """Write the counts of the updated sub runs and all the sample logs to project file"""
+        if self._project_created:
+            project_file = HidraProjectFile(self._project_name, HidraProjectFileMode.READWRITE)
+        else:
+            project_file = HidraProjectFile(self._project_name, HidraProjectFileMode.OVERWRITE)
+            instrument = DENEXDetectorGeometry(NUM_PIXEL_1D, NUM_PIXEL_1D, PIXEL_SIZE, PIXEL_SIZE, ARM_LENGTH, False)
+            project_file.write_instrument_geometry(HidraSetup(instrument))
+            if self._mask_array is not None:
+                project_file.write_mask_detector_array(HidraConstants.DEFAULT_MASK, self._mask_array)
+            self._project_created = True
+
+        try:
+            # counts
+            for sub_run in updated_sub_runs:
+                counts = self._counts[sub_run]
+                if self._mask_array is not None:
+                    counts = counts * self._mask_array
+                project_file.append_raw_counts(sub_run, counts, overwrite=True)
+
+            # sample logs averaged over each sub run so far
+            sub_runs = self.sub_runs
+            time_ranges = self._sub_run_time_ranges(logs)
+            project_file.append_experiment_log(HidraConstants.SUB_RUNS, np.array(sub_runs), overwrite=True)
+            durations = np.array([(time_ranges[sub_run][1] - time_ranges[sub_run][0]) / np.timedelta64(1, 's')
+                                  for sub_run in sub_runs])
+            project_file.append_experiment_log(HidraConstants.SUB_RUN_DURATION, durations, units='second',
+                                               overwrite=True)
+            for log_name, (times, values, units) in logs.items():
+                if log_name == SUBRUN_LOGNAME:
+                    continue
+                log_values = np.array([_time_average_log(times, values, *time_ranges[sub_run])
+                                       for sub_run in sub_runs])
+                project_file.append_experiment_log(log_name, log_values, units=units, overwrite=True)
+
+            # nominal wavelength
+            try:
+                if 'MonoSetting' in logs:
+                    monosetting = MonoSetting.getFromIndex(logs['MonoSetting'][1][0])
+                elif 'mrot' in logs:
+                    monosetting = MonoSetting.getFromRotation(logs['mrot'][1][0])
+                else:
+                    monosetting = None
+            except (IndexError, ValueError) as error:
+                self._log.warning('Unable to determine wavelength: {}'.format(error))
+                monosetting = None
+            if monosetting is not None:
+                project_file.write_wavelength(float(monosetting))
+        finally:
+            project_file.close()
+
+
+def _convert_nexus_file(nexus_file, project_file, mask_array, extra_logs, event_memory):
+    """Convert one NeXus file to Hidra project file: the task of batch conversion
+
+    Returns
+    -------
+    float, int
+        conversion time in seconds and number of events
+    """
+    start_time = time.time()
+
+    with h5py.File(nexus_file, 'r') as nexus_h5:
+        num_events = nexus_h5['entry']['bank1_events']['event_id'].shape[0]
+
+    converter = NeXusConvertingApp(nexus_file, extra_logs=extra_logs, event_memory=event_memory,
+                                   mask_array=mask_array)
+    converter.convert()
+    converter.save(project_file)
+    del converter
+
+    return time.time() - start_time, num_events
+
+
+def convert_nexus_files(runs, output_dir, mask_file_name=None, extra_logs=list(), n_workers=None,
+                        event_memory=DEFAULT_EVENT_MEMORY, overwrite=False):
+    """Convert NeXus files of several runs to Hidra project files with a pool of worker processes
+
+    The mask is loaded once and shared among all the runs.  A run is skipped if its project file,
+    named after the NeXus file, is newer than the NeXus file.
+
+    Parameters
+    ----------
+    runs : list
+        run numbers (int) or NeXus file names (str)
+    output_dir : str
+        directory to write the project files to
+    mask_file_name : str, None
+        Mantid XML mask applied to all the runs
+    extra_logs : list, tuple
+        list of string with no default logs to keep in project file
+    n_workers : int, None
+        number of worker processes. None or 1 to convert the runs one after another in this process
+    event_memory : int, None
+        maximum memory in bytes for the events read from NeXus file at once by each conversion
+    overwrite : bool
+        convert the runs even if their project files are up to date
+
+    Returns
+    -------
+    list
+        ConversionReport for each run in the order of runs
+    """
+    log = Logger(__name__)
+    checkdatatypes.check_file_name(output_dir, True, True, True, 'Project file directory')
+
+    # locate the files
+    file_pairs = list()  # (NeXus file, project file)
+    for run in runs:
+        if isinstance(run, str):
+            nexus_file = run
+        else:
+            from pyrs.utilities.file_util import get_nexus_file  # only required by run numbers
+            nexus_file = get_nexus_file(to_int('Run number', run, min_value=1))
+        checkdatatypes.check_file_name(nexus_file, True, False, False, 'NeXus file')
+        project_file = os.path.join(output_dir, os.path.basename(nexus_file).split('.')[0] + '.h5')
+        file_pairs.append((nexus_file, project_file))
+
+    # skip the runs already converted
+    to_convert = [(nexus_file, project_file) for nexus_file, project_file in file_pairs
+                  if overwrite or not os.path.exists(project_file)
+                  or os.path.getmtime(project_file) < os.path.getmtime(nexus_file)]
+
+    # load the mask once with the first run to convert
+    mask_array = None
+    if mask_file_name is not None and len(to_convert) > 0:
+        mask_array = NeXusConvertingApp(to_convert[0][0], mask_file_name, event_memory=event_memory).mask_array
+
+    results = dict()  # [NeXus file] = (duration, number of events, error)
+    tasks = [(nexus_file, project_file, mask_array, list(extra_logs), event_memory)
+             for nexus_file, project_file in to_convert]
+    if n_workers is not None and to_int('Number of workers', n_workers, min_value=1) > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(_convert_nexus_file, *task) for task in tasks]
+            for task, future in zip(tasks, futures):
+                try:
+                    results[task[0]] = future.result() + (None,)
+                except Exception as e:  # report and carry on with the other runs
+                    results[task[0]] = 0., 0, str(e)
+    else:
+        for task in tasks:
+            try:
+                results[task[0]] = _convert_nexus_file(*task) + (None,)
+            except Exception as e:  # report and carry on with the other runs
+                results[task[0]] = 0., 0, str(e)
+
+    reports = list()
+    for nexus_file, project_file in file_pairs:
+        if nexus_file in results:
+            report = ConversionReport(nexus_file, project_file, False, *results[nexus_file])
+        else:
+            report = ConversionReport(nexus_file, project_file, True, 0., 0)
+        reports.append(report)
+
+        if report.skipped:
+            log.information('{} is up to date'.format(project_file))
+        elif report.error is not None:
+            log.error('Failed to convert {}: {}'.format(nexus_file, report.error))
+        else:
+            log.notice('Converted {} to {}: {} events in {:.1f} seconds ({:.3g} events/second)'
+                       ''.format(nexus_file, project_file, report.num_events, report.duration, report.event_rate))
+
+    return reports
@@ -40,6 +40,7 @@ class PeakShape(Enum):
 
 
 class BackgroundFunction(Enum):
+    FLAT = 'Flat'
     LINEAR = 'Linear'  # so far, one and only supported
     QUADRATIC = 'Quadratic'  # so far, one and only supported
 
@@ -63,7 +64,8 @@ class BackgroundFunction(Enum):
     @property
     def native_parameters(self):
         # Native background parameters in Mantid naming convention
-        NATIVE_BACKGROUND_PARAMETERS = {'Linear': ['A0', 'A1'],
+        NATIVE_BACKGROUND_PARAMETERS = {'Flat': ['A0'],
+                                        'Linear': ['A0', 'A1'],
                                         'Quadratic': ['A0', 'A1', 'A2']}
 
         return NATIVE_BACKGROUND_PARAMETERS[self.value][:]
@@ -201,7 +203,6 @@ class Gaussian(PeakParametersConverter):
         eff_value_array['FWHM'] = fwhm_array[:]  # FWHM
         eff_value_array['Mixing'] = 1.   # no mixing for Gaussian
         eff_value_array['A0'] = param_value_array['A0']  # A0
-        eff_value_array['A1'] = param_value_array['A1']  # A1
         eff_value_array['Intensity'] = intensity_array[:]  # intensity
 
         # Calculate error propagation
@@ -218,15 +219,22 @@ class Gaussian(PeakParametersConverter):
         eff_error_array['FWHM'] = fwhm_error_array[:]  # FWHM
         eff_error_array['Mixing'] = 0.  # no uncertainty in mixing for Gaussian
         eff_error_array['A0'] = param_error_array['A0']  # A0
-        eff_error_array['A1'] = param_error_array['A1']  # A1
         eff_error_array['Intensity'] = intensity_error_array[:]  # intensity
 
+        try:
+            eff_value_array['A1'] = param_value_array['A1']  # A1
+            eff_error_array['A1'] = param_error_array['A1']  # A1
+        except ValueError:
+            # flat background
+            eff_value_array['A1'] = np.zeros_like(param_value_array['A0'])  # A1
+            eff_error_array['A1'] = np.zeros_like(param_value_array['A0']) + 0.01  # A1
+
         try:
             eff_value_array['A2'] = param_value_array['A2']  # A2
             eff_error_array['A2'] = param_error_array['A2']  # A2
         except ValueError:
-            eff_value_array['A2'] = np.zeros_like(param_value_array['A1'])  # A2
-            eff_error_array['A2'] = np.zeros_like(param_value_array['A1']) + 0.01  # A2
+            eff_value_array['A2'] = np.zeros_like(param_value_array['A0'])  # A2
+            eff_error_array['A2'] = np.zeros_like(param_value_array['A0']) + 0.01  # A2
 
         return eff_value_array, eff_error_array
 
@@ -381,7 +389,6 @@ class PseudoVoigt(PeakParametersConverter):
         eff_value_array['FWHM'] = param_value_array['FWHM']  # FWHM
         eff_value_array['Mixing'] = param_value_array['Mixing']  # no mixing for Gaussian
         eff_value_array['A0'] = param_value_array['A0']  # A0
-        eff_value_array['A1'] = param_value_array['A1']  # A1
         eff_value_array['Intensity'] = param_value_array['Intensity']  # intensity
 
         # Calculate error propagation: effective parameter value
@@ -398,15 +405,22 @@ class PseudoVoigt(PeakParametersConverter):
         eff_error_array['FWHM'] = param_error_array['FWHM']  # FWHM
         eff_error_array['Mixing'] = param_error_array['Mixing']  # no mixing for Gaussian
         eff_error_array['A0'] = param_error_array['A0']  # A0
-        eff_error_array['A1'] = param_error_array['A1']  # A1
         eff_error_array['Intensity'] = param_error_array['Intensity']  # intensity
 
+        try:
+            eff_value_array['A1'] = param_value_array['A1']  # A1
+            eff_error_array['A1'] = param_error_array['A1']  # A1
+        except ValueError:
+            # flat background
+            eff_value_array['A1'] = np.zeros_like(param_value_array['A0'])  # A1
+            eff_error_array['A1'] = np.zeros_like(param_value_array['A0']) + 0.01  # A1
+
         try:
             eff_value_array['A2'] = param_value_array['A2']  # A2
             eff_error_array['A2'] = param_error_array['A2']  # A2
         except ValueError:
-            eff_value_array['A2'] = np.zeros_like(param_value_array['A1'])  # A2
-            eff_error_array['A2'] = np.zeros_like(param_value_array['A1']) + 0.01  # A2
+            eff_value_array['A2'] = np.zeros_like(param_value_array['A0'])  # A2
+            eff_error_array['A2'] = np.zeros_like(param_value_array['A0']) + 0.01  # A2
 
         return eff_value_array, eff_error_array
 
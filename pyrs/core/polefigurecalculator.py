@@ -1,8 +1,16 @@
 # This module is to calculate Pole Figure
 from pyrs.utilities import checkdatatypes
-from pyrs.utilities.convertdatatypes import to_float, to_int
+from pyrs.utilities.convertdatatypes import to_int
 import numpy as np
-from typing import Tuple
+from typing import Any, Tuple, Union
+
+
+def _to_float_array(name: str, values: Any) -> np.ndarray:
+    # convert the value(s) to a float array or give a better exception
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError) as e:
+        raise TypeError('Variable "{}"'.format(name)) from e
 
 
 class PoleFigureCalculator:
@@ -65,32 +73,20 @@ class PoleFigureCalculator:
             # calculator by each detector
             peak_info_dict = self._peak_info_dict[peak_id]
 
-            # construct the output
-            num_pts = len(peak_info_dict['chi'])
-            pole_figure_array = np.ndarray(shape=(num_pts, 3), dtype='float')
-
-            for index in range(num_pts):
-                # check fitting result
-                intensity_i = peak_info_dict['intensity'][index]
+            # rotate Q from instrument coordinate to sample coordinate for all the points at once
+            theta = 0.5 * _to_float_array('center', peak_info_dict['center'])
+            omega = _to_float_array('omega', peak_info_dict['omega'])
+            omega = np.where(omega < 0., omega + 90., omega)
 
-                # rotate Q from instrument coordinate to sample coordinate
-                theta_i = 0.5 * peak_info_dict['center'][index]
-                omega_i = peak_info_dict['omega'][index]
-                if omega_i < 0.:
-                    omega_i += 90.
+            alpha, beta = self.rotate_project_q(theta, omega, peak_info_dict['chi'], peak_info_dict['phi'],
+                                                peak_info_dict['eta'])
 
-                chi_i = peak_info_dict['chi'][index]
-                phi_i = peak_info_dict['phi'][index]
-                eta_i = peak_info_dict['eta'][index]
-                alpha, beta = self.rotate_project_q(theta_i, omega_i, chi_i, phi_i, eta_i)
+            # construct the output: alpha, beta, intensity
+            pole_figure_array = np.empty(shape=(theta.size, 3), dtype='float')
+            pole_figure_array[:, 0] = alpha
+            pole_figure_array[:, 1] = beta
+            pole_figure_array[:, 2] = peak_info_dict['intensity']
 
-                pole_figure_array[index, 0] = alpha
-                pole_figure_array[index, 1] = beta
-                pole_figure_array[index, 2] = intensity_i
-                # END-FOR
-            # END-FOR
-
-            # convert
             self._pole_figure_dict[peak_id] = pole_figure_array
 
     def get_polefigure_array(self, peak_id):
@@ -175,23 +171,26 @@ class PoleFigureCalculator:
 
         return alpha, beta
 
-    def rotate_project_q(self, theta: float, omega: float, chi: float, phi: float, eta: float) -> Tuple[float, float]:
+    def rotate_project_q(self, theta: Union[float, np.ndarray], omega: Union[float, np.ndarray],
+                         chi: Union[float, np.ndarray], phi: Union[float, np.ndarray],
+                         eta: Union[float, np.ndarray]) -> Tuple[Any, Any]:
         """
         Projection of angular dependent data onto pole sphere. Analytical solution taken from
         Chapter 8.3 in Bob He Two-Dimensional X-ray Diffraction
 
+        All the angles can be arrays (of the same shape) to project many points at once
         _______________________
         :param two_theta:
         :param omega:
         :param chi:
         :param phi:
-        :return: 2-tuple as the projection (alpha, beta)
+        :return: 2-tuple as the projection (alpha, beta): floats or arrays
         """
-        theta = to_float('theta', theta)
-        omega = to_float('Omega', omega)
-        chi = to_float('chi', chi)
-        phi = to_float('phi', phi)
-        eta = to_float('eta', eta)
+        theta = _to_float_array('theta', theta)
+        omega = _to_float_array('Omega', omega)
+        chi = _to_float_array('chi', chi)
+        phi = _to_float_array('phi', phi)
+        eta = _to_float_array('eta', eta)
 
         sp = np.sin(np.deg2rad(phi))
         sw = np.sin(np.deg2rad(omega))
@@ -212,8 +211,10 @@ class PoleFigureCalculator:
         alpha = np.rad2deg(np.arccos(h_length))
         beta = np.rad2deg(np.arccos(h1 / h_length))
 
-        if h2 < 0:
-            beta = -1 * beta
+        beta = np.where(h2 < 0, -1 * beta, beta)
+
+        if beta.ndim == 0:
+            return float(90 - alpha), float(beta)
 
         return 90 - alpha, beta
 
@@ -277,24 +278,14 @@ def export_to_mtex(pole_figure_array_dict: dict, peak_id_list: list, file_name:
     if '.jul' not in file_name:
         file_name = '{}.jul'.format(file_name.replace('.jul', ''))
 
-    # initialize output string: MTEX HEAD
-    mtex = 'NRSF2\n'
-    mtex += 'alpha beta intensity\n'
+    with open(file_name, 'w') as p_file:
+        # MTEX HEAD
+        p_file.write('NRSF2\n')
+        p_file.write('alpha beta intensity\n')
 
-    # user optional header
-    mtex += '{0}\n'.format(header)
-
-    # writing data
-    for pf_key in peak_id_list:
-
-        pole_figure_array = pole_figure_array_dict[pf_key]
-        for i_pt in range(pole_figure_array.shape[0]):
-            mtex += '{0:5.5f}\t{1:5.5f}\t{2:5.5f}\n' \
-                    ''.format(pole_figure_array[i_pt, 0], pole_figure_array[i_pt, 1], pole_figure_array[i_pt, 2])
-        # END-FOR (i_pt)
-    # END-FOR
+        # user optional header
+        p_file.write('{0}\n'.format(header))
 
-    # write file
-    p_file = open(file_name, 'w')
-    p_file.write(mtex)
-    p_file.close()
+        # writing data: alpha\tbeta\tintensity
+        for pf_key in peak_id_list:
+            np.savetxt(p_file, pole_figure_array_dict[pf_key][:, :3], fmt='%5.5f', delimiter='\t')
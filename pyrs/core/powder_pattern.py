@@ -66,7 +66,7 @@ class ReductionApp:
 
         """
 
-        return self._hydra_ws._raw_counts[sub_run]
+        return self._hydra_ws.get_detector_counts(sub_run)
 
     def get_sub_runs(self):
         return self._reduction_manager.get_sub_runs(self._session)
@@ -103,7 +103,7 @@ class ReductionApp:
 
     def reduce_data(self, sub_runs, instrument_file, calibration_file, mask, mask_id=None,
                     van_file=None, num_bins=1000, eta_step=None, eta_min=-8.2, eta_max=8.2,
-                    min_2theta=None, max_2theta=None, delta_2theta=None):
+                    min_2theta=None, max_2theta=None, delta_2theta=None, n_workers=None):
         """Reduce data from HidraWorkspace
 
         Parameters
@@ -134,6 +134,8 @@ class ReductionApp:
             max 2theta
         delta_2theta : float or None
             2theta increment in the reduced diffraction data
+        n_workers : int or None
+            number of worker processes to reduce sub runs in parallel. None or 1 to reduce serially
 
         Returns
         -------
@@ -192,7 +194,8 @@ class ReductionApp:
                                                         van_duration=van_duration,
                                                         eta_step=eta_step,
                                                         eta_min=eta_min,
-                                                        eta_max=eta_max)
+                                                        eta_max=eta_max,
+                                                        n_workers=n_workers)
 
     def plot_reduced_data(self, sub_run_number=None):
 
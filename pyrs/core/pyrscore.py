@@ -168,7 +168,8 @@ class PyRsCore:
 
         return vec_alpha, vec_beta, vec_intensity
 
-    def load_hidra_project(self, hidra_h5_name, project_name, load_detector_counts=True, load_diffraction=False):
+    def load_hidra_project(self, hidra_h5_name, project_name, load_detector_counts=True, load_diffraction=False,
+                           lazy=False):
         """
 
         Parameters
@@ -179,6 +180,8 @@ class PyRsCore:
             name of the reduction project specified by user to trace
         load_detector_counts
         load_diffraction
+        lazy
+            load detector counts and diffraction data of a sub run when it is requested
 
         Returns
         -------
@@ -192,7 +195,8 @@ class PyRsCore:
         ws = self._reduction_service.load_hidra_project(project_file_name=hidra_h5_name,
                                                         load_calibrated_instrument=False,
                                                         load_detectors_counts=load_detector_counts,
-                                                        load_reduced_diffraction=load_diffraction)
+                                                        load_reduced_diffraction=load_diffraction,
+                                                        lazy=lazy)
 
         return ws
 
@@ -1,36 +1,186 @@
 # This is a prototype reduction engine for HB2B living independently from Mantid
+import hashlib
+import os
 import numpy as np
-import uncertainties.unumpy as unp
+from scipy.sparse import csr_matrix
 from pyrs.core import instrument_geometry
 from pyrs.utilities import checkdatatypes
-from pyrs.utilities.convertdatatypes import to_float
+from pyrs.utilities.convertdatatypes import to_float, to_int
+from pyrs.utilities.error_propagation import propagate_errors
 from typing import Optional
 
 
+class InstrumentGeometryCache:
+    """
+    Least-recently-used cache of built instrument geometries, i.e., pixels' positions, 2theta and eta
+
+    A geometry is identified by the detector 2theta, L2, the calibration (DENEXDetectorShift) values and
+    the detector setup (size, pixel dimension and default arm length).  The total size of the cached
+    arrays is capped by max_memory.  Optionally geometries are also stored in a directory such that
+    repeated reductions with the same instrument configuration can skip building the geometry.
+    """
+
+    # default cap on the memory of the cached arrays in bytes
+    DEFAULT_MAX_MEMORY = 512 * 1024 ** 2
+
+    def __init__(self, max_memory=DEFAULT_MAX_MEMORY, cache_dir=None):
+        """
+        initialization
+        :param int max_memory: maximum number of bytes of the cached arrays
+        :param str cache_dir: directory to store the geometries on disk.  None for memory only
+        """
+        self._max_memory = to_int('Maximum memory of geometry cache', max_memory, min_value=0)
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            checkdatatypes.check_file_name(cache_dir, True, True, True, 'Geometry cache directory')
+        self._cache_dir = cache_dir
+
+        self._geometries = dict()  # [key] = (pixel matrix, 2theta matrix, eta matrix) in LRU order
+        self._memory = 0
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def make_key(instrument_setup, two_theta, l2, instrument_calibration):
+        """Key of a geometry
+
+        :param DENEXDetectorGeometry instrument_setup: instrument geometry setup
+        :param float two_theta: 2theta position of the detector arm
+        :param float l2: distance of detector from the center of rotation
+        :param DENEXDetectorShift instrument_calibration: DENEXDetectorShift or None (no calibration)
+        :return: tuple
+        """
+        if instrument_calibration is None:
+            calibration_values = None
+        else:
+            calibration_values = tuple(float(value) for value in
+                                       (instrument_calibration.center_shift_x, instrument_calibration.center_shift_y,
+                                        instrument_calibration.center_shift_z, instrument_calibration.rotation_x,
+                                        instrument_calibration.rotation_y, instrument_calibration.rotation_z,
+                                        instrument_calibration.two_theta_0))
+
+        return (instrument_setup.detector_size, instrument_setup.pixel_dimension, float(instrument_setup.arm_length),
+                float(two_theta), float(l2), calibration_values)
+
+    @property
+    def hits(self):
+        """Number of geometries found in cache (memory or disk)"""
+        return self._hits
+
+    @property
+    def misses(self):
+        """Number of geometries not found in cache"""
+        return self._misses
+
+    @property
+    def memory(self):
+        """Total number of bytes of the cached arrays"""
+        return self._memory
+
+    def __len__(self):
+        return len(self._geometries)
+
+    def __contains__(self, key):
+        return key in self._geometries
+
+    def clear(self):
+        """Remove all the geometries from memory and reset the counters"""
+        self._geometries.clear()
+        self._memory = 0
+        self._hits = 0
+        self._misses = 0
+
+    def _file_name(self, key):
+        return os.path.join(self._cache_dir, 'geometry_{}.npz'.format(hashlib.sha1(repr(key).encode()).hexdigest()))
+
+    def get(self, key):
+        """Get a geometry
+
+        :param tuple key: geometry key from make_key
+        :return: tuple (pixel matrix, 2theta matrix, eta matrix) or None if not cached
+        """
+        if key in self._geometries:
+            # move to the most recently used
+            geometry = self._geometries.pop(key)
+            self._geometries[key] = geometry
+            self._hits += 1
+            return geometry
+
+        if self._cache_dir is not None and os.path.exists(self._file_name(key)):
+            with np.load(self._file_name(key)) as geometry_file:
+                geometry = geometry_file['pixels'], geometry_file['two_theta'], geometry_file['eta']
+            self._add(key, geometry)
+            self._hits += 1
+            return self._geometries[key]
+
+        self._misses += 1
+        return None
+
+    def put(self, key, pixel_matrix, two_theta_matrix, eta_matrix):
+        """Add a geometry.  The arrays are set to read-only as they are shared among instruments
+
+        :param tuple key: geometry key from make_key
+        :param numpy.ndarray pixel_matrix: pixels' positions
+        :param numpy.ndarray two_theta_matrix: pixels' 2theta
+        :param numpy.ndarray eta_matrix: pixels' eta
+        :return:
+        """
+        geometry = pixel_matrix, two_theta_matrix, eta_matrix
+        self._add(key, geometry)
+
+        if self._cache_dir is not None and not os.path.exists(self._file_name(key)):
+            # write to a temporary file and rename it such that a partially written file is never read
+            temp_name = self._file_name(key) + '.{}.tmp'.format(os.getpid())
+            with open(temp_name, 'wb') as geometry_file:
+                np.savez(geometry_file, pixels=pixel_matrix, two_theta=two_theta_matrix, eta=eta_matrix)
+            os.replace(temp_name, self._file_name(key))
+
+    def _add(self, key, geometry):
+        for array in geometry:
+            array.flags.writeable = False
+        if key in self._geometries:
+            self._memory -= sum(array.nbytes for array in self._geometries.pop(key))
+        self._geometries[key] = geometry
+        self._memory += sum(array.nbytes for array in geometry)
+
+        # discard the least recently used geometries but the new one
+        while self._memory > self._max_memory and len(self._geometries) > 1:
+            oldest_key = next(iter(self._geometries))
+            self._memory -= sum(array.nbytes for array in self._geometries.pop(oldest_key))
+
+
 class ResidualStressInstrument:
     """
     This is a class to define HB2B instrument geometry and related calculation
     """
 
-    def __init__(self, instrument_setup):
+    def __init__(self, instrument_setup, geometry_cache=None):
         """
         initialization
         :param instrument_setup: DENEXDetectorGeometry
+        :param geometry_cache: InstrumentGeometryCache to share built geometries or None
         """
         # check input
         checkdatatypes.check_type('Instrument setup', instrument_setup,
                                   instrument_geometry.DENEXDetectorGeometry)
+        if geometry_cache is not None:
+            checkdatatypes.check_type('Geometry cache', geometry_cache, InstrumentGeometryCache)
 
         # Instrument geometry parameters
         self._instrument_geom_params = instrument_setup
+        self._geometry_cache = geometry_cache
 
         # Pixels' positions without calibration. It is kept stable upon calibration values (shifts) and arm (000 plane)
-        self._raw_pixel_matrix = self._set_uncalibrated_pixels()  # never been used for external client: len(shape) = 3
+        # It is set up at the first time the instrument is built
+        self._raw_pixel_matrix = None  # never been used for external client: len(shape) = 3
 
         self._pixel_matrix = None  # used by external after build_instrument: matrix for pixel positions
         self._pixel_2theta_matrix = None  # matrix for pixel's 2theta value
         self._pixel_eta_matrix = None  # matrix for pixel's eta value
 
+        # arrays reused by each build of the instrument if the geometries are not cached: [name] = numpy.ndarray
+        self._buffers = dict()
+
         self._wave_length = None
 
         return
@@ -43,14 +193,27 @@ class ResidualStressInstrument:
         :param rotation_matrix:
         :return:
         """
-        rotate_det = np.zeros(detector_matrix.shape, dtype='float')
+        return np.matmul(detector_matrix, np.asarray(rotation_matrix).T)
 
-        for i in range(3):
-            for j in range(3):
-                temp_det = rotation_matrix[i, j] * detector_matrix[:, :, j]
-                rotate_det[:, :, i] += temp_det[:, :]
+    def _get_buffer(self, name, shape):
+        """Get an output array for building the instrument
 
-        return rotate_det
+        The arrays are reused among builds unless they are shared with a geometry cache.
+        Therefore building the instrument again overwrites the previously returned arrays.
+
+        :param str name: name of the array
+        :param tuple shape: shape of the array
+        :return: numpy.ndarray
+        """
+        if self._geometry_cache is not None:
+            return np.empty(shape, dtype='float')
+
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, dtype='float')
+            self._buffers[name] = buffer
+
+        return buffer
 
     def _set_uncalibrated_pixels(self):
         """
@@ -68,26 +231,20 @@ class ResidualStressInstrument:
         pixel_size_x, pixel_size_y = self._instrument_geom_params.pixel_dimension
         # arm_length = self._instrument_geom_params.arm_length
 
-        # instrument is a N x M matrix, each element has
-        pixel_matrix = np.ndarray(shape=(num_rows, num_columns, 3), dtype='float')
+        # Instrument is set up as a M x N matrix, i.e., transposed from rows x columns to match instrument pixel ID
+        # arrangement.  This is the only pixel positions to be transposed in the instrument setup.
+        pixel_matrix = np.empty(shape=(num_columns, num_rows, 3), dtype='float')
 
         # set Y as different from each row
         start_y_pos = -(num_rows * 0.5 - 0.5) * pixel_size_y
         start_x_pos = (num_columns * 0.5 - 0.5) * pixel_size_x
 
-        for row_index in range(num_rows):
-            pixel_matrix[row_index, :, 1] = start_y_pos + float(row_index) * pixel_size_y
+        pixel_matrix[:, :, 1] = start_y_pos + np.arange(num_rows, dtype='float') * pixel_size_y
         # set X as different from each column
-        for col_index in range(num_columns):
-            pixel_matrix[:, col_index, 0] = start_x_pos - float(col_index) * pixel_size_x
+        pixel_matrix[:, :, 0] = (start_x_pos - np.arange(num_columns, dtype='float') * pixel_size_x).reshape((-1, 1))
         # set Z: zero at origin
         pixel_matrix[:, :, 2] = 0.
 
-        # Transpose is required to match instrument pixel ID arrangement:
-        # This is the only pixel positions to be transposed in the instrument setup
-        # Causing Error?  FIXME -
-        pixel_matrix = pixel_matrix.transpose((1, 0, 2))
-
         return pixel_matrix
 
     def build_instrument(self, two_theta: float, l2: Optional[float] = None, instrument_calibration=None):
@@ -96,6 +253,8 @@ class ResidualStressInstrument:
         step 1: rotate instrument according to the calibration
         step 2: rotate instrument about 2theta
 
+        Both rotations and the shifts are composed to a single affine transform applied to all the pixels at once
+
         :param float two_theta: 2theta position of the detector arm
         :param float l2: distance of detector from the center of rotation
         :param DENEXDetectorShift instrument_calibration: DENEXDetectorShift or None (no calibration)
@@ -112,8 +271,48 @@ class ResidualStressInstrument:
         # print('[DB...L101] Build instrument: 2theta = {}, arm = {} (diff to default = {})'
         #       ''.format(two_theta, l2, l2 - self._instrument_geom_params.arm_length))
 
-        # make a copy from raw (constant position)
-        self._pixel_matrix = self._raw_pixel_matrix.copy()
+        # Look for the geometry in cache
+        if self._geometry_cache is not None:
+            geometry_key = self._geometry_cache.make_key(self._instrument_geom_params, two_theta, l2,
+                                                         instrument_calibration)
+            geometry = self._geometry_cache.get(geometry_key)
+            if geometry is not None:
+                self._pixel_matrix, self._pixel_2theta_matrix, self._pixel_eta_matrix = geometry
+                return self._pixel_matrix
+
+        # raw (constant) position
+        if self._raw_pixel_matrix is None:
+            self._raw_pixel_matrix = self._set_uncalibrated_pixels()
+
+        rotation_matrix, offset = self._get_transform(two_theta, l2, instrument_calibration)
+
+        self._pixel_matrix = self._get_buffer('pixels', self._raw_pixel_matrix.shape)
+        np.matmul(self._raw_pixel_matrix, rotation_matrix.T, out=self._pixel_matrix)
+        self._pixel_matrix += offset
+
+        # get 2theta and eta
+        self._calculate_pixel_2theta()
+        self._calculate_pixel_eta()
+
+        if self._geometry_cache is not None:
+            self._geometry_cache.put(geometry_key, self._pixel_matrix, self._pixel_2theta_matrix,
+                                     self._pixel_eta_matrix)
+
+        return self._pixel_matrix
+
+    def _get_transform(self, two_theta, l2, instrument_calibration):
+        """Affine transform from the raw pixel positions to the pixel positions at the detector position
+
+        :param float two_theta: 2theta position of the detector arm
+        :param float l2: distance of detector from the center of rotation
+        :param DENEXDetectorShift instrument_calibration: DENEXDetectorShift or None (no calibration)
+        :return: rotation matrix (3 x 3) and offset (3), such that position = rotation * raw position + offset
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        # pixel position = rotation * raw position + offset
+        rotation_matrix = np.identity(3)
+        # push to +Z at length of detector arm
+        offset = np.array([0., 0., l2])
 
         # Check and set instrument calibration
         if instrument_calibration is not None:
@@ -121,37 +320,62 @@ class ResidualStressInstrument:
             checkdatatypes.check_type('Instrument calibration', instrument_calibration,
                                       instrument_geometry.DENEXDetectorShift)
 
-            # shift center
-            self._pixel_matrix[:, :, 0] += instrument_calibration.center_shift_x
-            self._pixel_matrix[:, :, 1] += instrument_calibration.center_shift_y
-
             # rotation around instrument center
             # get rotation matrix at origin (for flip, spin and vertical): all data from calibration value
             rot_x_flip = instrument_calibration.rotation_x * np.pi / 180.
             rot_y_flip = instrument_calibration.rotation_y * np.pi / 180.
             rot_z_spin = instrument_calibration.rotation_z * np.pi / 180.
-            calib_matrix = self.generate_rotation_matrix(rot_x_flip, rot_y_flip, rot_z_spin)
-            # print ('[DB...BAT] Calibration rotation matrix:\n{}'.format(calib_matrix))
-            # and rotate at origin
-            self._pixel_matrix = self._rotate_detector(self._pixel_matrix, calib_matrix)
+            rotation_matrix = np.asarray(self.generate_rotation_matrix(rot_x_flip, rot_y_flip, rot_z_spin))
+
+            # shift center before rotation and shift arm length (Z) after rotation
+            offset = rotation_matrix @ np.array([instrument_calibration.center_shift_x,
+                                                 instrument_calibration.center_shift_y, 0.])
+            offset[2] += l2 + instrument_calibration.center_shift_z
 
             # shift two_theta by offset
             two_theta += instrument_calibration.two_theta_0
-
-        # END-IF-ELSE
-
-        # push to +Z at length of detector arm
-        arm_l2 = l2
-        if instrument_calibration is not None:
-            # Apply the shift on Z (arm length)
-            arm_l2 += instrument_calibration.center_shift_z
         # END-IF
-        self._pixel_matrix[:, :, 2] += arm_l2
 
         # rotate detector (2theta) if it is not zero
-        self.rotate_detector_2theta(two_theta)
+        if abs(two_theta) > 1.E-7:
+            two_theta_rot_matrix = np.asarray(self._cal_rotation_matrix_y(np.deg2rad(two_theta)))
+            rotation_matrix = two_theta_rot_matrix @ rotation_matrix
+            offset = two_theta_rot_matrix @ offset
 
-        return self._pixel_matrix
+        return rotation_matrix, offset
+
+    def calculate_pixels_angles(self, pixel_ids, two_theta: float, l2: Optional[float] = None,
+                                instrument_calibration=None):
+        """Calculate 2theta and eta of a subset of pixels without building the instrument
+
+        The built instrument (pixel matrix, 2theta and eta) is not changed
+
+        :param numpy.ndarray pixel_ids: IDs of the pixels
+        :param float two_theta: 2theta position of the detector arm
+        :param float l2: distance of detector from the center of rotation
+        :param DENEXDetectorShift instrument_calibration: DENEXDetectorShift or None (no calibration)
+        :return: 2theta (1D) and eta (1D) of the pixels in degree
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        two_theta = to_float('2theta', two_theta)
+        if l2 is None:
+            l2 = self._instrument_geom_params.arm_length
+        else:
+            l2 = to_float('L2', l2, 1E-2)
+
+        if self._raw_pixel_matrix is None:
+            self._raw_pixel_matrix = self._set_uncalibrated_pixels()
+
+        rotation_matrix, offset = self._get_transform(two_theta, l2, instrument_calibration)
+        pixel_array = self._raw_pixel_matrix.reshape((-1, 3))[pixel_ids] @ rotation_matrix.T + offset
+
+        # same as _calculate_pixel_2theta and _calculate_pixel_eta
+        pos_x, pos_y, pos_z = pixel_array[:, 0], pixel_array[:, 1], pixel_array[:, 2]
+        two_theta_array = np.arccos(pos_z / np.sqrt(pos_x * pos_x + pos_y * pos_y + pos_z * pos_z)) * 180 / np.pi
+        eta_array = 180. - np.arctan2(pos_y, pos_x) * 180 / np.pi
+        eta_array[eta_array > 180.] -= 360
+
+        return two_theta_array, eta_array
 
     def rotate_detector_2theta(self, det_2theta):
         """Rotate detector, i.e., change 2theta value of the detector
@@ -184,30 +408,21 @@ class ResidualStressInstrument:
         # define
         # k_in_vec = [0, 0, 1]
 
-        det_pos_array = self._pixel_matrix.copy()
+        # N x M x 3 matrix or (N x M) x 3 array
+        pos_x, pos_y, pos_z = self._pixel_matrix[..., 0], self._pixel_matrix[..., 1], self._pixel_matrix[..., 2]
 
-        if len(self._pixel_matrix[:].shape) == 3:
-            # N x M x 3 array
-            # convert detector position matrix to 2theta
+        # 2theta = arccos(z / |r|) in degree
+        twotheta_matrix = self._get_buffer('2theta', self._pixel_matrix.shape[:-1])
+        np.multiply(pos_x, pos_x, out=twotheta_matrix)
+        twotheta_matrix += pos_y * pos_y
+        twotheta_matrix += pos_z * pos_z
+        np.sqrt(twotheta_matrix, out=twotheta_matrix)
+        np.divide(pos_z, twotheta_matrix, out=twotheta_matrix)
+        np.arccos(twotheta_matrix, out=twotheta_matrix)
+        twotheta_matrix *= 180
+        twotheta_matrix /= np.pi
 
-            # normalize the detector position 2D array
-            det_pos_norm_matrix = np.sqrt(self._pixel_matrix[:][:, :, 0] ** 2 +
-                                          self._pixel_matrix[:][:, :, 1] ** 2 +
-                                          self._pixel_matrix[:][:, :, 2] ** 2)
-            twotheta_matrix = np.arccos(det_pos_array[:, :, 2] / det_pos_norm_matrix) * 180 / np.pi
-            return_value = twotheta_matrix
-        else:
-            # (N x M) x 3 array
-            # convert detector positions array to 2theta array
-            # normalize the detector position 2D array
-            des_pos_array = self._pixel_matrix
-            det_pos_norm_array = np.sqrt(des_pos_array[:, 0] ** 2 +
-                                         des_pos_array[:, 1] ** 2 + des_pos_array[:, 2] ** 2)
-            twotheta_array = np.arccos(det_pos_array[:, 2] / det_pos_norm_array) * 180 / np.pi
-            return_value = twotheta_array
-        # END-IF-ELSE
-
-        self._pixel_2theta_matrix = return_value
+        self._pixel_2theta_matrix = twotheta_matrix
 
         return
 
@@ -220,34 +435,16 @@ class ResidualStressInstrument:
         if self._pixel_matrix is None:
             raise RuntimeError('Instrument has not been built yet. Pixel matrix is missing')
 
-        # define
-
-        det_pos_array = self._pixel_matrix.copy()
-
-        if len(self._pixel_matrix[:].shape) == 3:
-            # N x M x 3 array
-            # convert detector position matrix to 2theta
-
-            eta_matrix = 180. - np.arctan2(det_pos_array[:, :, 1], det_pos_array[:, :, 0]) * 180 / np.pi
-            eta_temp = eta_matrix.reshape(-1)
-            index = np.where(eta_temp > 180.)[0]
-            eta_temp[index] -= 360
-            eta_matrix = eta_temp.reshape(eta_matrix.shape)
-
-            return_value = eta_matrix
-        else:
-            # (N x M) x 3 array
-            # convert detector positions array to 2theta array
-            # normalize the detector position 2D array
-
-            eta_array = 180. - np.arctan2(det_pos_array[:, 1], det_pos_array[:, 0]) * 180 / np.pi
-            index = np.where(eta_array > 180.)[0]
-            eta_array[index] -= 360
-
-            return_value = eta_array
-        # END-IF-ELSE
+        # N x M x 3 matrix or (N x M) x 3 array
+        # eta = 180 - arctan2(y, x) in degree and in range (-180, 180]
+        eta_matrix = self._get_buffer('eta', self._pixel_matrix.shape[:-1])
+        np.arctan2(self._pixel_matrix[..., 1], self._pixel_matrix[..., 0], out=eta_matrix)
+        eta_matrix *= 180
+        eta_matrix /= np.pi
+        np.subtract(180., eta_matrix, out=eta_matrix)
+        np.subtract(eta_matrix, 360, out=eta_matrix, where=eta_matrix > 180.)
 
-        self._pixel_eta_matrix = return_value
+        self._pixel_eta_matrix = eta_matrix
 
         return
 
@@ -406,16 +603,271 @@ class ResidualStressInstrument:
         self._wave_length = w_l
 
 
+class HistogramBinningPlan:
+    """Pre-computed assignment of detector pixels to 2theta bins
+
+    The pixel to bin assignment only depends on the pixels' 2theta values (i.e., instrument geometry),
+    the detector mask and the 2theta bin boundaries.  It is stored as a sparse (CSR) matrix of shape
+    (number of bins) x (number of pixels) such that histogramming a sub run is a single sparse matrix product.
+    The bin of each pixel is also kept to histogram sparse counts, i.e., only the pixels with counts.
+    """
+
+    def __init__(self, pixel_2theta_array, two_theta_bins, mask_array=None):
+        """Build the binning plan
+
+        :param numpy.ndarray pixel_2theta_array: 2theta (1D) array for each pixel
+        :param numpy.ndarray two_theta_bins: 2theta bin boundaries
+        :param mask_array: mask: 1 to keep, 0 to mask (exclude)
+        :type mask_array: numpy.ndarray, optional
+        """
+        checkdatatypes.check_numpy_arrays('2theta array', [two_theta_bins], 1, False)
+        checkdatatypes.check_numpy_arrays('Pixel 2theta array', [pixel_2theta_array], 1, False)
+
+        num_pixels = pixel_2theta_array.shape[0]
+        num_bins = two_theta_bins.shape[0] - 1
+
+        # Pixels to keep
+        if mask_array is None:
+            pixel_ids = np.arange(num_pixels)
+        else:
+            checkdatatypes.check_numpy_arrays('Pixel 2theta array and mask array',
+                                              [pixel_2theta_array, mask_array], 1, True)
+            pixel_ids = np.where(mask_array == 1)[0]
+        pixel_2theta = pixel_2theta_array[pixel_ids]
+
+        # Same convention as numpy.histogram: all bins are half open except the last one
+        bin_index = np.searchsorted(two_theta_bins, pixel_2theta, side='right') - 1
+        bin_index[pixel_2theta == two_theta_bins[-1]] = num_bins - 1
+        in_range = (bin_index >= 0) & (bin_index < num_bins)
+
+        self._bin_edges = two_theta_bins.copy()
+        self._num_pixels = num_pixels
+        self._num_bins = num_bins
+        # bin of each pixel: -1 for masked pixels and pixels out of the 2theta range
+        self._pixel_bins = np.full(num_pixels, -1, dtype=np.int64)
+        self._pixel_bins[pixel_ids[in_range]] = bin_index[in_range]
+        # vanadium, number of its valid pixels, histogram and variances of the last sparse histogramming
+        self._sparse_vanadium = None
+        self._matrix = csr_matrix((np.ones(np.count_nonzero(in_range)),
+                                   (bin_index[in_range], pixel_ids[in_range])),
+                                  shape=(num_bins, num_pixels))
+
+    @property
+    def bin_edges(self):
+        """2theta bin boundaries
+
+        :return: numpy.ndarray
+        """
+        return self._bin_edges
+
+    @property
+    def matrix(self):
+        """Sparse (number of bins) x (number of pixels) matrix mapping pixel counts to 2theta bins
+
+        :return: scipy.sparse.csr_matrix
+        """
+        return self._matrix
+
+    def histogram(self, pixel_count_array, is_point_data=True, vanadium_counts=None):
+        """Histogram the counts of all the pixels
+
+        Pixels with NaN or infinite counts, or with vanadium counts less than 0.9, are excluded
+        in the same way as PyHB2BReduction.histogram_by_numpy
+
+        :param numpy.ndarray pixel_count_array: count array (1D) for each pixel
+        :param bool is_point_data: Output shall be point data; otherwise, histogram data
+        :param None or numpy.ndarray vanadium_counts: Vanadium counts for normalization and efficiency calibration.
+            It is allowed to be None
+        :return: bins, data_hist, data_var
+        :rtype: numpy.ndarray
+        """
+        checkdatatypes.check_numpy_arrays('Pixel counts array', [pixel_count_array], 1, False)
+
+        bins, data_hist, data_var = self.histogram_block(pixel_count_array.reshape((1, -1)), is_point_data,
+                                                         vanadium_counts)
+
+        return bins, data_hist[0], data_var[0]
+
+    def histogram_block(self, counts_block, is_point_data=True, vanadium_counts=None):
+        """Histogram the counts of several sub runs at once
+
+        :param numpy.ndarray counts_block: counts (2D) of shape (number of sub runs) x (number of pixels)
+        :param bool is_point_data: Output shall be point data; otherwise, histogram data
+        :param None or numpy.ndarray vanadium_counts: Vanadium counts for normalization and efficiency calibration.
+            It is allowed to be None
+        :return: bins (1D), data_hist (2D), data_var (2D)
+        :rtype: numpy.ndarray
+        """
+        checkdatatypes.check_numpy_arrays('Pixel counts block', [counts_block], 2, False)
+        if counts_block.shape[1] != self._num_pixels:
+            raise RuntimeError('Counts array has {} pixels but binning plan is built for {} pixels'
+                               ''.format(counts_block.shape[1], self._num_pixels))
+
+        counts_array = counts_block.astype('float64')
+
+        # Exclude NaN and infinity pixels and pixels without vanadium counts
+        excluded_pixels = ~np.isfinite(counts_array)
+        if vanadium_counts is not None:
+            checkdatatypes.check_numpy_arrays('Vanadium counts', [vanadium_counts], 1, False)
+            if vanadium_counts.shape[0] != self._num_pixels:
+                raise RuntimeError('Vanadium has {} pixels but binning plan is built for {} pixels'
+                                   ''.format(vanadium_counts.shape[0], self._num_pixels))
+            excluded_pixels |= vanadium_counts < 0.9
+        counts_array[excluded_pixels] = 0.
+
+        # Histogram counts and variances of all the sub runs in one pass
+        data_hist = self._matrix.dot(counts_array.T).T
+        data_var = np.sqrt(self._matrix.dot(self._pixel_variances(counts_array, excluded_pixels).T).T)
+
+        if vanadium_counts is None:
+            data_hist, data_var = PyHB2BReduction.normalize_histogram(data_hist, data_var, None, None)
+        else:
+            # vanadium is only different among sub runs if the sub runs have different invalid pixels
+            if np.all(excluded_pixels == excluded_pixels[0]):
+                excluded_pixels = excluded_pixels[:1]
+            van_array = np.repeat(vanadium_counts.reshape((1, -1)).astype('float64'), excluded_pixels.shape[0],
+                                  axis=0)
+            van_array[excluded_pixels] = 0.
+            van_hist = self._matrix.dot(van_array.T).T
+            van_var = np.sqrt(self._matrix.dot(self._pixel_variances(van_array, excluded_pixels).T).T)
+
+            for index in range(data_hist.shape[0]):
+                van_index = min(index, van_hist.shape[0] - 1)
+                data_hist[index], data_var[index] = PyHB2BReduction.normalize_histogram(
+                    data_hist[index], data_var[index], van_hist[van_index].copy(), van_var[van_index].copy())
+
+        if is_point_data:
+            bins = 0.5 * (self._bin_edges[1:] + self._bin_edges[:-1])
+        else:
+            bins = self._bin_edges.copy()
+
+        return bins, data_hist, data_var
+
+    def histogram_sparse(self, sparse_counts, is_point_data=True, vanadium_counts=None):
+        """Histogram the counts of the pixels with counts
+
+        The pixels without counts only contribute to the variances (as 1 per pixel), which are counted per bin
+        once for the vanadium.  Thus the cost is proportional to the number of pixels with counts.
+        The result is the same as histogram of the counts of all the pixels.
+
+        :param SparseCounts sparse_counts: counts of the pixels with counts
+        :param bool is_point_data: Output shall be point data; otherwise, histogram data
+        :param None or numpy.ndarray vanadium_counts: Vanadium counts for normalization and efficiency calibration.
+            It is allowed to be None
+        :return: bins, data_hist, data_var
+        :rtype: numpy.ndarray
+        """
+        if sparse_counts.num_pixels != self._num_pixels:
+            raise RuntimeError('Counts array has {} pixels but binning plan is built for {} pixels'
+                               ''.format(sparse_counts.num_pixels, self._num_pixels))
+
+        pixel_count, van_hist, van_var = self._get_sparse_vanadium(vanadium_counts)
+
+        # Pixels with counts in the 2theta range and with vanadium counts
+        pixel_ids = sparse_counts.pixel_ids
+        counts_array = sparse_counts.counts.astype('float64')
+        pixel_bins = self._pixel_bins[pixel_ids]
+        valid_pixels = pixel_bins >= 0
+        if vanadium_counts is not None:
+            valid_pixels &= vanadium_counts[pixel_ids] >= 0.9
+        finite_pixels = valid_pixels & np.isfinite(counts_array)
+        finite_bins = pixel_bins[finite_pixels]
+        counts_array = counts_array[finite_pixels]
+
+        # Pixels with counts replace the unit variances of pixels without counts.  NaN and infinity are excluded.
+        data_hist = np.bincount(finite_bins, weights=counts_array, minlength=self._num_bins)
+        data_var = (pixel_count - np.bincount(pixel_bins[valid_pixels], minlength=self._num_bins)
+                    + np.bincount(finite_bins, weights=self._pixel_variances(counts_array),
+                                  minlength=self._num_bins))
+        data_var = np.sqrt(data_var)
+
+        if vanadium_counts is not None:
+            van_hist = van_hist.copy()
+            van_var = van_var.copy()
+            # vanadium of the pixels excluded for NaN or infinity counts
+            excluded_pixels = pixel_ids[valid_pixels & ~finite_pixels]
+            if excluded_pixels.size > 0:
+                excluded_bins = self._pixel_bins[excluded_pixels]
+                excluded_van = vanadium_counts[excluded_pixels].astype('float64')
+                van_hist -= np.bincount(excluded_bins, weights=excluded_van, minlength=self._num_bins)
+                van_var -= np.bincount(excluded_bins, weights=self._pixel_variances(excluded_van),
+                                       minlength=self._num_bins)
+            van_var = np.sqrt(van_var)
+
+        data_hist, data_var = PyHB2BReduction.normalize_histogram(data_hist, data_var, van_hist, van_var)
+
+        if is_point_data:
+            bins = 0.5 * (self._bin_edges[1:] + self._bin_edges[:-1])
+        else:
+            bins = self._bin_edges.copy()
+
+        return bins, data_hist, data_var
+
+    def _get_sparse_vanadium(self, vanadium_counts):
+        """Number of pixels, vanadium histogram and vanadium variances (squared) per bin for sparse histogramming
+
+        The pixels with vanadium counts less than 0.9 are excluded.  The result is kept for the next sub runs.
+
+        :param None or numpy.ndarray vanadium_counts: Vanadium counts
+        :return: numpy.ndarray, numpy.ndarray or None, numpy.ndarray or None
+        """
+        if self._sparse_vanadium is not None and self._sparse_vanadium[0] is vanadium_counts:
+            return self._sparse_vanadium[1:]
+
+        if vanadium_counts is None:
+            valid_bins = self._pixel_bins[self._pixel_bins >= 0]
+            van_hist = van_var = None
+        else:
+            checkdatatypes.check_numpy_arrays('Vanadium counts', [vanadium_counts], 1, False)
+            if vanadium_counts.shape[0] != self._num_pixels:
+                raise RuntimeError('Vanadium has {} pixels but binning plan is built for {} pixels'
+                                   ''.format(vanadium_counts.shape[0], self._num_pixels))
+            valid_pixels = (self._pixel_bins >= 0) & (vanadium_counts >= 0.9)
+            valid_bins = self._pixel_bins[valid_pixels]
+            van_array = vanadium_counts[valid_pixels].astype('float64')
+            van_hist = np.bincount(valid_bins, weights=van_array, minlength=self._num_bins)
+            van_var = np.bincount(valid_bins, weights=self._pixel_variances(van_array),
+                                  minlength=self._num_bins)
+        pixel_count = np.bincount(valid_bins, minlength=self._num_bins)
+
+        self._sparse_vanadium = vanadium_counts, pixel_count, van_hist, van_var
+
+        return pixel_count, van_hist, van_var
+
+    @staticmethod
+    def _pixel_variances(counts_array, excluded_pixels=None):
+        """Pixels' variances (as squared uncertainties) used for histogramming
+
+        The uncertainty of a pixel without counts is 1 while the excluded pixels do not contribute
+
+        :param numpy.ndarray counts_array: pixels' counts
+        :param excluded_pixels: flags of pixels excluded from histogramming
+        :type excluded_pixels: numpy.ndarray, optional
+        :return: numpy.ndarray
+        """
+        var_array = np.sqrt(counts_array)
+        var_array[var_array == 0.0] = 1.
+        var_array = var_array ** 2
+        if excluded_pixels is not None:
+            var_array[excluded_pixels] = 0.
+
+        return var_array
+
+
 class PyHB2BReduction:
     """ A class to reduce HB2B data in pure Python and numpy
     """
 
-    def __init__(self, instrument, wave_length=None):
+    # maximum number of binning plans kept for the current instrument geometry
+    MAX_BINNING_PLANS = 32
+
+    def __init__(self, instrument, wave_length=None, geometry_cache=None):
         """
         initialize the instrument
         :param instrument
+        :param geometry_cache: InstrumentGeometryCache to share built geometries or None
         """
-        self._instrument = ResidualStressInstrument(instrument)
+        self._instrument = ResidualStressInstrument(instrument, geometry_cache)
 
         if wave_length is not None:
             self._instrument.set_wavelength(wave_length)
@@ -428,6 +880,9 @@ class PyHB2BReduction:
         # supposed to be 2 tuple for vector of 2theta and vector of intensity
         self._reduced_diffraction_data = None
 
+        # binning plans for the current instrument geometry: [(2theta bins, mask)] = HistogramBinningPlan
+        self._binning_plans = dict()
+
         return
 
     @property
@@ -450,6 +905,7 @@ class PyHB2BReduction:
 
         self._instrument.build_instrument(self._detector_2theta, self._detector_l2,
                                           instrument_calibration=calibration)
+        self._binning_plans.clear()
 
         return
 
@@ -477,6 +933,7 @@ class PyHB2BReduction:
 
         self._instrument.build_instrument(two_theta=(two_theta + two_theta_shift), l2=arm_length,
                                           instrument_calibration=calibration)
+        self._binning_plans.clear()
 
         return
 
@@ -540,6 +997,31 @@ class PyHB2BReduction:
         """
         return self._instrument.get_eta_values(dimension=1)
 
+    def get_binning_plan(self, two_theta_bins, mask_array):
+        """Get the binning plan for the current instrument geometry, mask and 2theta bins
+
+        The plan is built at the first request and then reused until the instrument is rebuilt
+
+        :param numpy.ndarray two_theta_bins: 2theta bin boundaries
+        :param numpy.ndarray mask_array: mask: 1 to keep, 0 to mask (exclude).  None for no mask
+        :return: HistogramBinningPlan
+        """
+        checkdatatypes.check_numpy_arrays('2theta array', [two_theta_bins], 1, False)
+
+        if mask_array is None:
+            plan_key = two_theta_bins.tobytes(), None
+        else:
+            plan_key = two_theta_bins.tobytes(), np.packbits(mask_array == 1).tobytes()
+
+        if plan_key not in self._binning_plans:
+            if len(self._binning_plans) >= self.MAX_BINNING_PLANS:
+                # discard the oldest plan
+                self._binning_plans.pop(next(iter(self._binning_plans)))
+            self._binning_plans[plan_key] = HistogramBinningPlan(self._instrument.get_pixels_2theta(1),
+                                                                 two_theta_bins, mask_array)
+
+        return self._binning_plans[plan_key]
+
     def reduce_to_2theta_histogram(self, two_theta_bins, mask_array,
                                    is_point_data=True, vanadium_counts_array=None):
         """Reduce the previously added detector raw counts to 2theta histogram (i.e., diffraction pattern)
@@ -553,9 +1035,6 @@ class PyHB2BReduction:
         :rtype: numpy.ndarray
         """
 
-        # Get two-theta-histogram vector
-        checkdatatypes.check_numpy_arrays('2theta array', [two_theta_bins], 1, False)
-
         # Get the data (each pixel's 2theta and counts): the 2theta value is the absolute diffraction angle
         # that disregards the real 2theta value in the instrument coordinate system
         pixel_2theta_array = self._instrument.get_pixels_2theta(1)
@@ -563,39 +1042,16 @@ class PyHB2BReduction:
                                           [pixel_2theta_array, self._detector_counts], 1,
                                           check_same_shape=True)  # optional check
 
-        # Convert vector counts array's dtype to float
-        counts_array = self._detector_counts.astype('float64')
-
-        # print('[INFO] PyRS.Instrument: pixels 2theta range: ({}, {}) vs 2theta histogram range: ({}, {})'
-        #       ''.format(pixel_2theta_array.min(), pixel_2theta_array.max(), two_theta_bins.min(),
-        #                 two_theta_bins.max()))
-
-        # Apply mask: act on local variable vec_counts and thus won't affect raw data
-        if mask_array is not None:
-            # mask detector counts, assuming detector mask and counts are in same order of pixel
-            checkdatatypes.check_numpy_arrays('Counts vector and mask vector',
-                                              [counts_array, mask_array], 1, True)
-            # exclude mask from histogramming
-            counts_array = counts_array[np.where(mask_array == 1)]
-            pixel_2theta_array = pixel_2theta_array[np.where(mask_array == 1)]
-            if vanadium_counts_array is not None:
-                vanadium_counts_array = vanadium_counts_array[np.where(mask_array == 1)]
-        else:
-            # no mask: do nothing
-            pass
-        # END-IF-ELSE
+        # Binning plan: pixels' 2theta bins with mask applied, which is reused among sub runs
+        binning_plan = self.get_binning_plan(two_theta_bins, mask_array)
 
         # Histogram:
         # NOTE: input 2theta_range may not be accurate because 2theta max may not be on the full 2-theta tick
         # TODO - If use vanadium for normalization, then (1) flag to normalize by pixel count and (2) efficiency
         #        are not required anymore but both of them will be replaced by integrated vanadium counts
-
-        # use numpy.histogram
-        two_theta_bins, intensity_vector, variances_vector = self.histogram_by_numpy(pixel_2theta_array,
-                                                                                     counts_array,
-                                                                                     two_theta_bins,
-                                                                                     is_point_data,
-                                                                                     vanadium_counts_array)
+        two_theta_bins, intensity_vector, variances_vector = binning_plan.histogram(self._detector_counts,
+                                                                                    is_point_data,
+                                                                                    vanadium_counts_array)
 
         # Record
         self._reduced_diffraction_data = two_theta_bins, intensity_vector, variances_vector
@@ -673,9 +1129,6 @@ class PyHB2BReduction:
         data_var, var_edges = np.histogram(pixel_2theta_array, bins=two_theta_bins, weights=pixel_var_array ** 2)
         data_var = np.sqrt(data_var)
 
-        # get indexs in histograms that do not have neutron counts
-        zero_count_mask = data_hist == 0.0
-
         # Optionally to normalize by number of pixels (sampling points) in the 2theta bin
         if vanadium_counts is not None:
             # Normalize by vanadium including efficiency calibration
@@ -692,35 +1145,57 @@ class PyHB2BReduction:
             van_hist, be_temp = np.histogram(pixel_2theta_array, bins=two_theta_bins, weights=vanadium_counts)
             van_var, van_var_temp = np.histogram(pixel_2theta_array, bins=two_theta_bins, weights=vanadium_var ** 2)
             van_var = np.sqrt(van_var)
+        else:
+            van_hist = van_var = None
+        # END-IF-ELSE
 
+        data_hist, data_var = PyHB2BReduction.normalize_histogram(data_hist, data_var, van_hist, van_var)
+
+        # convert to point data as an option.  Use the center of the 2theta bin as new theta
+        if is_point_data:
+            # calculate bin centers
+            bins = 0.5 * (bin_edges[1:] + bin_edges[:-1])
+        else:
+            # return bin edges
+            bins = bin_edges
+
+        return bins, data_hist, data_var
+
+    @staticmethod
+    def normalize_histogram(data_hist, data_var, van_hist, van_var):
+        """Normalize the histogrammed counts by vanadium and set up the bins without any neutron counts
+
+        :param numpy.ndarray data_hist: histogram of counts
+        :param numpy.ndarray data_var: histogram of counts' uncertainties
+        :param None or numpy.ndarray van_hist: histogram of vanadium counts.  None for no normalization
+        :param None or numpy.ndarray van_var: histogram of vanadium counts' uncertainties
+        :return: data_hist, data_var
+        :rtype: numpy.ndarray
+        """
+        # get indexs in histograms that do not have neutron counts
+        zero_count_mask = data_hist == 0.0
+
+        if van_hist is not None:
             # set indexs in histograms with no counts to 1
             data_hist[zero_count_mask] = 1.0
             van_hist[zero_count_mask] = 1.0
             data_var[zero_count_mask] = 1.0
             van_var[zero_count_mask] = 1.0
 
-            # setup uncertainties arrays
-            data_array = unp.uarray(data_hist, data_var)
-            van_array = unp.uarray(van_hist, van_var)
+            # normalize data: data * van_max / van, where van_max is the same variable as van at its maximum
+            max_index = np.argmax(van_hist)
+            van_max, van_max_var = van_hist[max_index], van_var[max_index]
+            correlation = (np.arange(van_hist.size) == max_index).astype(float)
+            data_var = propagate_errors([van_max / van_hist, data_hist / van_hist,
+                                         -data_hist * van_max / van_hist**2],
+                                        [data_var, van_max_var, van_var], {(1, 2): correlation})
+            data_hist = data_hist * (van_max / van_hist)
 
-            # normalize data
-            normalized_data = data_array * (van_array.max() / van_array)
-            data_hist = unp.nominal_values(normalized_data)
-            data_var = unp.std_devs(normalized_data)
-
-        # END-IF-ELSE
+        # END-IF
 
         # set indexs in histograms that do not have any neutron counts to 0 with var = 1
         data_hist[zero_count_mask] = 0.
         data_var[zero_count_mask] = 1.
 
-        # convert to point data as an option.  Use the center of the 2theta bin as new theta
-        if is_point_data:
-            # calculate bin centers
-            bins = 0.5 * (bin_edges[1:] + bin_edges[:-1])
-        else:
-            # return bin edges
-            bins = bin_edges
-
-        return bins, data_hist, data_var
+        return data_hist, data_var
 # END-CLASS
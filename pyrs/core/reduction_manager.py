@@ -1,6 +1,8 @@
 # Reduction engine including slicing
 import os
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from pyrs.core import workspaces
 from pyrs.core import instrument_geometry
 from pyrs.core import mask_util
@@ -10,7 +12,61 @@ from pyrs.dataobjects import HidraConstants  # type: ignore
 from pyrs.projectfile import HidraProjectFile, HidraProjectFileMode  # type: ignore
 from pyrs.utilities import checkdatatypes
 from pyrs.utilities.convertdatatypes import to_float, to_int
-from typing import Optional
+from typing import Any, Dict, Optional
+
+
+# State of a worker process of the parallel reduction, set by _init_reduction_worker
+_worker_state: Dict[str, Any] = dict()
+
+
+def _init_reduction_worker(counts_name, counts_shape, counts_dtype, instrument_setup, geometry_calibration,
+                           mask_vec, vanadium_counts, two_theta_range, num_bins, delta_2theta, eta_step):
+    """Initialize a worker process of the parallel reduction
+
+    Raw counts of all the sub runs are attached from shared memory instead of being pickled to each task
+    """
+    counts_memory = shared_memory.SharedMemory(name=counts_name)
+    _worker_state['counts_memory'] = counts_memory  # keep the shared memory open during worker's life
+    _worker_state['counts'] = np.ndarray(counts_shape, dtype=counts_dtype, buffer=counts_memory.buf)
+    _worker_state['instrument_setup'] = instrument_setup
+    _worker_state['geometry_calibration'] = geometry_calibration
+    _worker_state['mask_vec'] = mask_vec
+    _worker_state['vanadium_counts'] = vanadium_counts
+    _worker_state['two_theta_range'] = two_theta_range
+    _worker_state['num_bins'] = num_bins
+    _worker_state['delta_2theta'] = delta_2theta
+    _worker_state['eta_step'] = eta_step
+    _worker_state['engines'] = dict()
+
+
+def _reduce_rows_worker(two_theta, l2, rows, eta_cent):
+    """Reduce the counts (rows of the shared counts) of sub runs measured at the same detector position
+
+    :param float two_theta: detector 2theta in DAS convention
+    :param float l2: detector L2 or None
+    :param list rows: rows of the shared counts
+    :param eta_cent: center of the eta slice for texture reduction.  None for no eta slicing
+    :return: 2theta bins, histogram of counts, variances of counts
+    """
+    counts_block = _worker_state['counts'][rows]
+
+    # reduction engine is reused among the tasks of the same detector position
+    engines = _worker_state['engines']
+    if (two_theta, l2) not in engines:
+        engines[two_theta, l2] = HB2BReductionManager.build_reduction_engine(_worker_state['instrument_setup'],
+                                                                             two_theta, l2, counts_block[0],
+                                                                             _worker_state['geometry_calibration'])
+    reduction_engine = engines[two_theta, l2]
+
+    mask_vec = _worker_state['mask_vec']
+    if eta_cent is not None:
+        mask_vec = HB2BReductionManager.generate_eta_mask(reduction_engine.get_eta_value(), eta_cent,
+                                                          _worker_state['eta_step'], mask_vec)
+
+    return HB2BReductionManager.histogram_counts_block(reduction_engine, counts_block, mask_vec,
+                                                       _worker_state['two_theta_range'], _worker_state['num_bins'],
+                                                       _worker_state['delta_2theta'],
+                                                       _worker_state['vanadium_counts'])
 
 
 class HB2BReductionManager:
@@ -22,6 +78,9 @@ class HB2BReductionManager:
     3. It shall provide an API to calibration optimization
     """
 
+    # maximum number of sub runs' counts stacked for histogramming at once
+    MAX_BATCH_SUB_RUNS = 16
+
     def __init__(self):
         """ initialization
         """
@@ -31,6 +90,8 @@ class HB2BReductionManager:
 
         # Reduction engine
         self._last_reduction_engine = None
+        # Instrument geometries shared among reduction engines
+        self._geometry_cache = reduce_hb2b_pyrs.InstrumentGeometryCache()
 
         # Vanadium
         self._van_ws = None
@@ -42,6 +103,14 @@ class HB2BReductionManager:
         self._loaded_mask_files = list()
         self._loaded_mask_dict = dict()
 
+    @property
+    def geometry_cache(self):
+        """Cache of the instrument geometries (pixels' 2theta and eta) built by the reduction engines
+
+        :return: InstrumentGeometryCache
+        """
+        return self._geometry_cache
+
     def get_reduced_diffraction_data(self, session_name, sub_run=None, mask_id=None):
         """ Get the reduce data
 
@@ -152,13 +221,15 @@ class HB2BReductionManager:
         self._session_dict[session_name] = self._curr_workspace
 
     def load_hidra_project(self, project_file_name, load_calibrated_instrument, load_detectors_counts,
-                           load_reduced_diffraction):
+                           load_reduced_diffraction, lazy=False):
         """ Load hidra project file
 
         :param str project_file_name: filename for the Hidra project file
         :param bool load_calibrated_instrument:
         :param bool load_detectors_counts: Flag to load detector counts
         :param bool load_reduced_diffraction: Flag to reduced diffraction data
+        :param bool lazy: Flag to load detector counts and reduced diffraction data of a sub run on demand.
+            The project file is kept open by the workspace
         :return: HidraWorkspace instance
         """
         # check inputs
@@ -182,10 +253,12 @@ class HB2BReductionManager:
         # Load
         self._curr_workspace.load_hidra_project(project_h5_file,
                                                 load_raw_counts=load_detectors_counts,
-                                                load_reduced_diffraction=load_reduced_diffraction)
+                                                load_reduced_diffraction=load_reduced_diffraction,
+                                                lazy=lazy)
 
-        # Close
-        project_h5_file.close()
+        # Close unless the data is loaded on demand
+        if not lazy:
+            project_h5_file.close()
         return self._curr_workspace
 
     def load_mask_file(self, mask_file_name):
@@ -262,7 +335,7 @@ class HB2BReductionManager:
     def reduce_diffraction_data(self, session_name, apply_calibrated_geometry, num_bins, sub_run_list,
                                 mask, mask_id, vanadium_counts=None, van_duration=None, normalize_by_duration=True,
                                 eta_step=None, eta_min=None, eta_max=None, min_2theta=None, max_2theta=None,
-                                delta_2theta=None):
+                                delta_2theta=None, n_workers=None):
         """Reduce ALL sub runs in a workspace from detector counts to diffraction data
 
         :param session_name: Name for the reduction session
@@ -293,6 +366,9 @@ class HB2BReductionManager:
         :type max_2theta: float, optional
         :param delta_2theta: 2theta increment in the reduced diffraction data
         :type delta_2theta: float, optional
+        :param n_workers: number of worker processes to reduce sub runs (and eta slices) in parallel.
+            None or 1 to reduce in the current process.  The result does not depend on the number of workers
+        :type n_workers: int, optional
         :return: None
         """
 
@@ -341,6 +417,25 @@ class HB2BReductionManager:
         # Reset workspace's 2theta matrix and intensities
         workspace.reset_diffraction_data()
 
+        if n_workers is not None and to_int('Number of workers', n_workers, min_value=1) > 1:
+            self.reduce_sub_runs_parallel(workspace, sub_run_list, det_pos_shift, (mask_id, mask_vec),
+                                          n_workers, min_2theta=min_2theta, max_2theta=max_2theta,
+                                          num_bins=num_bins, vanadium_counts=vanadium_counts,
+                                          delta_2theta=delta_2theta, eta_step=eta_step, eta_min=eta_min,
+                                          eta_max=eta_max)
+            return
+
+        if eta_step is None:
+            # reduce all the sub runs in batches of sub runs sharing the same detector position
+            self.reduce_sub_runs_diffraction(workspace, sub_run_list, det_pos_shift,
+                                             mask_vec_tuple=(mask_id, mask_vec),
+                                             min_2theta=min_2theta,
+                                             max_2theta=max_2theta,
+                                             num_bins=num_bins,
+                                             delta_2theta=delta_2theta,
+                                             vanadium_counts=vanadium_counts)
+            return
+
         for sub_run in sub_run_list:
             # get the duration
             if normalize_by_duration:
@@ -350,31 +445,19 @@ class HB2BReductionManager:
                 # not normalized
                 duration_i = 1.
 
-            if eta_step is None:
-                # reduce sub run
-                self.reduce_sub_run_diffraction(workspace, sub_run, det_pos_shift,
-                                                mask_vec_tuple=(mask_id, mask_vec),
-                                                min_2theta=min_2theta,
-                                                max_2theta=max_2theta,
-                                                num_bins=num_bins,
-                                                delta_2theta=delta_2theta,
-                                                sub_run_duration=duration_i,
-                                                vanadium_counts=vanadium_counts,
-                                                van_duration=van_duration)
-            else:
-                # reduce sub run texture
-                self.reduce_sub_run_texture(workspace, sub_run, det_pos_shift,
-                                            mask_vec_tuple=(mask_id, mask_vec),
-                                            min_2theta=min_2theta,
-                                            max_2theta=max_2theta,
-                                            num_bins=num_bins,
-                                            sub_run_duration=duration_i,
-                                            vanadium_counts=vanadium_counts,
-                                            van_duration=van_duration,
-                                            eta_step=eta_step,
-                                            eta_min=eta_min,
-                                            eta_max=eta_max,
-                                            delta_2theta=delta_2theta)
+            # reduce sub run texture
+            self.reduce_sub_run_texture(workspace, sub_run, det_pos_shift,
+                                        mask_vec_tuple=(mask_id, mask_vec),
+                                        min_2theta=min_2theta,
+                                        max_2theta=max_2theta,
+                                        num_bins=num_bins,
+                                        sub_run_duration=duration_i,
+                                        vanadium_counts=vanadium_counts,
+                                        van_duration=van_duration,
+                                        eta_step=eta_step,
+                                        eta_min=eta_min,
+                                        eta_max=eta_max,
+                                        delta_2theta=delta_2theta)
 
     def setup_reduction_engine(self, workspace, sub_run, geometry_calibration):
         """Setup reduction engine to reduce data (workspace or vector) to 2-theta ~ I
@@ -410,7 +493,8 @@ class HB2BReductionManager:
             reduction_engine = self._last_reduction_engine
             reduction_engine.set_raw_counts(raw_count_vec)
         else:
-            reduction_engine = reduce_hb2b_pyrs.PyHB2BReduction(workspace.get_instrument_setup())
+            reduction_engine = reduce_hb2b_pyrs.PyHB2BReduction(workspace.get_instrument_setup(),
+                                                                geometry_cache=self._geometry_cache)
 
             # Set up reduction engine
             reduction_engine.set_experimental_data(mantid_two_theta, l2, raw_count_vec)
@@ -479,6 +563,231 @@ class HB2BReductionManager:
         workspace.set_reduced_diffraction_data(sub_run, mask_id, bin_centers, hist, variances)
         self._last_reduction_engine = reduction_engine
 
+    def reduce_sub_runs_diffraction(self, workspace, sub_runs, geometry_calibration,
+                                    mask_vec_tuple, min_2theta=None, max_2theta=None, num_bins=1000,
+                                    vanadium_counts=None, delta_2theta=None):
+        """Reduce several sub runs from detector counts to 2-theta ~ I in batches
+
+        Sub runs are grouped by detector position (2theta and L2).  For each group the instrument and
+        the pixels' binning are built once, and the counts of the sub runs are stacked into a
+        (number of sub runs) x (number of pixels) block and histogrammed at once.
+        The result is the same as calling reduce_sub_run_diffraction for each sub run.
+
+        :param HidraWorkspace workspace: workspace with detector counts and position
+        :param sub_runs: sub run numbers in workspace to reduce
+        :type sub_runs: list, numpy.ndarray
+        :param DENEXDetectorShift geometry_calibration: instrument geometry to calculate diffraction pattern
+        :param mask_vec_tuple: mask ID and 1D array for masking (1 to keep, 0 to mask out)
+        :type mask_vec_tuple: tuple, [str, numpy.ndarray]
+        :param min_2theta: min 2theta
+        :type min_2theta: float, optional
+        :param max_2theta: max 2theta
+        :type max_2theta: float, optional
+        :param int num_bins: number of bins
+        :param vanadium_counts: detector pixels' vanadium for efficiency and normalization.
+        :type vanadium_counts: numpy.ndarray, optional
+        :param delta_2theta: 2theta increment in the reduced diffraction data
+        :type delta_2theta: float, optional
+        :return: None
+        """
+        mask_id, mask_vec = mask_vec_tuple
+
+        # Group sub runs by detector position
+        sub_run_groups = dict()  # [(2theta, L2)] = list of sub runs
+        for sub_run in sub_runs:
+            detector_position = workspace.get_detector_2theta(sub_run), workspace.get_l2(sub_run)
+            sub_run_groups.setdefault(detector_position, list()).append(sub_run)
+
+        for (two_theta, l2), group_sub_runs in sub_run_groups.items():
+            reduction_engine = self.build_reduction_engine(workspace.get_instrument_setup(), two_theta, l2,
+                                                           workspace.get_detector_counts(group_sub_runs[0]),
+                                                           geometry_calibration, self._geometry_cache)
+
+            # Histogram in blocks of sub runs to limit the memory usage
+            for start_index in range(0, len(group_sub_runs), self.MAX_BATCH_SUB_RUNS):
+                batch_sub_runs = group_sub_runs[start_index:start_index + self.MAX_BATCH_SUB_RUNS]
+                if workspace.sparse_counts:
+                    counts_block = [workspace.get_sparse_detector_counts(sub_run) for sub_run in batch_sub_runs]
+                else:
+                    counts_block = workspace.get_detector_counts_block(batch_sub_runs)
+                bin_centers, hist, variances = self.histogram_counts_block(reduction_engine, counts_block,
+                                                                           mask_vec, (min_2theta, max_2theta),
+                                                                           num_bins, delta_2theta,
+                                                                           vanadium_counts)
+
+                # record
+                workspace.set_reduced_diffraction_data_block(batch_sub_runs, mask_id, bin_centers, hist, variances)
+
+            self._last_reduction_engine = reduction_engine
+
+    def reduce_sub_runs_parallel(self, workspace, sub_runs, geometry_calibration, mask_vec_tuple, n_workers,
+                                 min_2theta=None, max_2theta=None, num_bins=1000, vanadium_counts=None,
+                                 delta_2theta=None, eta_step=None, eta_min=None, eta_max=None):
+        """Reduce several sub runs, and optionally their eta slices, with a pool of worker processes
+
+        The raw counts are copied once to shared memory, which the workers read directly.  Each task
+        reduces a batch of sub runs at the same detector position (for one eta slice), in the same way
+        as the serial reduction such that the result is identical.
+
+        :param HidraWorkspace workspace: workspace with detector counts and position
+        :param sub_runs: sub run numbers in workspace to reduce
+        :type sub_runs: list, numpy.ndarray
+        :param DENEXDetectorShift geometry_calibration: instrument geometry to calculate diffraction pattern
+        :param mask_vec_tuple: mask ID and 1D array for masking (1 to keep, 0 to mask out)
+        :type mask_vec_tuple: tuple, [str, numpy.ndarray]
+        :param int n_workers: number of worker processes
+        :param min_2theta: min 2theta
+        :type min_2theta: float, optional
+        :param max_2theta: max 2theta
+        :type max_2theta: float, optional
+        :param int num_bins: number of bins
+        :param vanadium_counts: detector pixels' vanadium for efficiency and normalization.
+        :type vanadium_counts: numpy.ndarray, optional
+        :param delta_2theta: 2theta increment in the reduced diffraction data
+        :type delta_2theta: float, optional
+        :param eta_step: angular step size for out-of-plane reduction.  None for no texture reduction
+        :type eta_step: float, optional
+        :param eta_min: min angle for out-of-plane reduction
+        :type eta_min: float, optional
+        :param eta_max: max angle for out-of-plane reduction
+        :type eta_max: float, optional
+        :return: None
+        """
+        mask_id, mask_vec = mask_vec_tuple
+        sub_runs = list(sub_runs)
+
+        # eta slices
+        if eta_step is None:
+            eta_roi_vec = [None]
+        else:
+            eta_step = abs(eta_step)
+            eta_roi_vec = list(self.generate_eta_roi_vector(eta_step, eta_min, eta_max))
+
+        # Tasks: batches of sub runs (as rows of counts) at the same detector position for each eta slice
+        row_groups = dict()  # [(2theta, L2)] = list of rows
+        for row, sub_run in enumerate(sub_runs):
+            detector_position = workspace.get_detector_2theta(sub_run), workspace.get_l2(sub_run)
+            row_groups.setdefault(detector_position, list()).append(row)
+        tasks = list()
+        for (two_theta, l2), rows in row_groups.items():
+            for start_index in range(0, len(rows), self.MAX_BATCH_SUB_RUNS):
+                for eta_cent in eta_roi_vec:
+                    tasks.append((two_theta, l2, rows[start_index:start_index + self.MAX_BATCH_SUB_RUNS], eta_cent))
+
+        # Copy raw counts to shared memory
+        counts_list = [workspace.get_detector_counts(sub_run) for sub_run in sub_runs]
+        counts_shape = len(counts_list), counts_list[0].shape[0]
+        counts_dtype = np.result_type(*counts_list)
+        counts_memory = shared_memory.SharedMemory(create=True,
+                                                   size=max(1, counts_shape[0] * counts_shape[1]
+                                                            * counts_dtype.itemsize))
+        try:
+            shared_counts = np.ndarray(counts_shape, dtype=counts_dtype, buffer=counts_memory.buf)
+            for row, counts in enumerate(counts_list):
+                shared_counts[row] = counts
+            del shared_counts
+
+            init_args = (counts_memory.name, counts_shape, counts_dtype, workspace.get_instrument_setup(),
+                         geometry_calibration, mask_vec, vanadium_counts, (min_2theta, max_2theta), num_bins,
+                         delta_2theta, eta_step)
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_reduction_worker,
+                                     initargs=init_args) as executor:
+                futures = [executor.submit(_reduce_rows_worker, *task) for task in tasks]
+
+                # record in the order of tasks, which is the same order as serial reduction
+                for (_, _, rows, eta_cent), future in zip(tasks, futures):
+                    bin_centers, hist, variances = future.result()
+
+                    if eta_cent is None:
+                        reduced_mask_id = mask_id
+                    elif mask_id is None:
+                        reduced_mask_id = 'eta_{}'.format(eta_cent)
+                    else:
+                        reduced_mask_id = '{}_eta_{}'.format(mask_id, eta_cent)
+
+                    workspace.set_reduced_diffraction_data_block([sub_runs[row] for row in rows], reduced_mask_id,
+                                                                 bin_centers, hist, variances)
+        finally:
+            counts_memory.close()
+            counts_memory.unlink()
+
+    @staticmethod
+    def build_reduction_engine(instrument_setup, two_theta, l2, raw_count_vec, geometry_calibration,
+                               geometry_cache=None):
+        """Build the reduction engine for a detector position
+
+        :param DENEXDetectorGeometry instrument_setup: instrument geometry setup
+        :param float two_theta: detector 2theta in DAS convention
+        :param float l2: detector distance from center of rotation.  None for default
+        :param numpy.ndarray raw_count_vec: detector raw counts
+        :param DENEXDetectorShift geometry_calibration: instrument geometry calibration
+        :param InstrumentGeometryCache geometry_cache: cache of instrument geometries or None
+        :return: PyHB2BReduction
+        """
+        # Convert 2-theta from DAS convention to Mantid/PyRS convention
+        reduction_engine = reduce_hb2b_pyrs.PyHB2BReduction(instrument_setup, geometry_cache=geometry_cache)
+        reduction_engine.set_experimental_data(-two_theta, l2, raw_count_vec)
+        reduction_engine.build_instrument(geometry_calibration)
+
+        return reduction_engine
+
+    @staticmethod
+    def histogram_counts_block(reduction_engine, counts_block, mask_vec, two_theta_range, num_bins,
+                               delta_2theta, vanadium_counts):
+        """Histogram the counts of sub runs measured at the detector position of the reduction engine
+
+        :param PyHB2BReduction reduction_engine: reduction engine with instrument built
+        :param counts_block: counts of shape (number of sub runs) x (number of pixels) or sparse counts of sub runs
+        :type counts_block: numpy.ndarray, list[SparseCounts]
+        :param numpy.ndarray mask_vec: mask: 1 to keep, 0 to mask (exclude).  None for no mask
+        :param tuple two_theta_range: min and max 2theta (each could be None)
+        :param int num_bins: number of bins
+        :param delta_2theta: 2theta increment in the reduced diffraction data
+        :type delta_2theta: float, optional
+        :param vanadium_counts: detector pixels' vanadium for efficiency and normalization.
+        :type vanadium_counts: numpy.ndarray, optional
+        :return: 2theta bins (1D), histogram of counts (2D), variances of counts (2D)
+        """
+        min_2theta, max_2theta = two_theta_range
+
+        # Binning shared by all the sub runs
+        pixel_2theta_array = reduction_engine.instrument.get_pixels_2theta(1)
+        bin_boundaries_2theta = HB2BReductionManager.generate_2theta_histogram_vector(min_2theta, max_2theta,
+                                                                                      num_bins,
+                                                                                      pixel_2theta_array,
+                                                                                      mask_vec, delta_2theta)
+        binning_plan = reduction_engine.get_binning_plan(bin_boundaries_2theta, mask_vec)
+
+        if isinstance(counts_block, list):
+            # sparse counts: histogram pixels with counts of each sub run
+            histograms = [binning_plan.histogram_sparse(sparse_counts, is_point_data=True,
+                                                        vanadium_counts=vanadium_counts)
+                          for sparse_counts in counts_block]
+            bin_centers = histograms[0][0]
+            return bin_centers, np.array([hist[1] for hist in histograms]), np.array([hist[2] for hist in histograms])
+
+        return binning_plan.histogram_block(counts_block, is_point_data=True, vanadium_counts=vanadium_counts)
+
+    @staticmethod
+    def generate_eta_mask(eta_vec, eta_cent, eta_step, mask_vec):
+        """Generate the mask to isolate a narrow eta wedge
+
+        :param numpy.ndarray eta_vec: pixels' eta
+        :param float eta_cent: center of the eta wedge
+        :param float eta_step: width of the eta wedge
+        :param numpy.ndarray mask_vec: detector mask or None
+        :return: numpy.ndarray (1 to keep, 0 to mask out)
+        """
+        # here a value of zero means do not use
+        eta_mask = np.ones_like(eta_vec)
+        eta_mask[eta_vec > (eta_cent + eta_step / 2.)] = 0
+        eta_mask[eta_vec < (eta_cent - eta_step / 2.)] = 0
+
+        if mask_vec is not None:
+            eta_mask[mask_vec] = 0
+
+        return eta_mask
+
     def generate_eta_roi_vector(self, eta_step, eta_min, eta_max):
         """Generate vector of out-of-plane angle centers
 
@@ -578,14 +887,9 @@ class HB2BReductionManager:
         # Generate eta roi vector
         eta_roi_vec = self.generate_eta_roi_vector(eta_step, eta_min, eta_max)
 
-        for eta_cent in eta_roi_vec:            # define mask to isolate narrow eta wedge
-            # here a value of zero means do not use
-            eta_mask = np.ones_like(eta_vec)
-            eta_mask[eta_vec > (eta_cent + eta_step / 2.)] = 0
-            eta_mask[eta_vec < (eta_cent - eta_step / 2.)] = 0
-
-            if mask_vec is not None:
-                eta_mask[mask_vec] = 0
+        for eta_cent in eta_roi_vec:
+            # define mask to isolate narrow eta wedge
+            eta_mask = self.generate_eta_mask(eta_vec, eta_cent, eta_step, mask_vec)
 
             # Histogram data
             bin_centers, hist, variances = self.convert_counts_to_diffraction(reduction_engine,
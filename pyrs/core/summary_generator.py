@@ -1,8 +1,10 @@
 """
-This module generates reduction summary for user in plain text CSV file
+This module generates reduction summary for user in plain text CSV file or a columnar HDF5 table
 """
+from itertools import islice
+import h5py
+import numpy as np
 from pyrs.core.peak_profile_utility import EFFECTIVE_PEAK_PARAMETERS  # TODO get from the first peak collection
-# import numpy as np
 
 # Default summary titles shown in the CSV file. This is a list of tuples ot enforce order
 # things to be found in the output file with
@@ -46,13 +48,16 @@ class SummaryGenerator:
       effective peak parameters
 
     """
-    def __init__(self, filename, log_list=None, separator=','):
+    # number of rows of the body written at once
+    ROWS_PER_CHUNK = 1024
+
+    def __init__(self, filename=None, log_list=None, separator=','):
         """Initialization
 
         Parameters
         ----------
         filename: str
-            Name of the ``.csv`` file to write
+            Name of the ``.csv`` file to write, None if only HDF5 tables are written
         log_list: list
             Names of the logs to write out
         separator: str
@@ -66,11 +71,11 @@ class SummaryGenerator:
         else:
             self._sample_log_list = log_list
 
-        if not filename:
-            raise RuntimeError('Failed to supply output filename')
-        self._filename = str(filename)
-        if not self._filename.endswith('.csv'):
-            raise RuntimeError('Filename "{}" must end with ".csv"'.format(self._filename))
+        if filename is None:
+            self._filename = None
+        else:
+            self._filename = str(filename)
+            self._check_csv_filename()
 
         self.separator = separator
 
@@ -84,6 +89,12 @@ class SummaryGenerator:
         # logs that were requested and do exist
         self._present_logs = []
 
+    def _check_csv_filename(self):
+        if not self._filename:
+            raise RuntimeError('Failed to supply output filename')
+        if not self._filename.endswith('.csv'):
+            raise RuntimeError('Filename "{}" must end with ".csv"'.format(self._filename))
+
     def setHeaderInformation(self, headervalues):
         '''This sets up the supplied information for the header without actually writing it'''
 
@@ -103,11 +114,8 @@ class SummaryGenerator:
             relative tolerance of variance to treat a sample log as a constant value
             and bring into extended header
         """
-        # verify the same number of subruns everywhere
-        for peak_collection in peak_collections:
-            subruns = peak_collection.sub_runs
-            if not sample_logs.matching_subruns(subruns):
-                raise ValueError('Subruns from sample logs and peak {} do not match'.format(peak_collection.peak_tag))
+        self._check_csv_filename()
+        self._check_subruns(sample_logs, peak_collections)
 
         # determine what is constant and what is missing
         self._classify_logs(sample_logs, tolerance)
@@ -120,12 +128,60 @@ class SummaryGenerator:
             self._write_column_names(handle, peak_collections)
             self._write_data(handle, sample_logs, peak_collections)
 
+    def write_hdf5(self, filename, sample_logs, peak_collections, tolerance=1E-10, append=False):
+        """Export the same columns as the CSV file to a HDF5 table, see :py:func:`write_hdf5_table`
+
+        The values are written as numbers with NaN for the excluded sub runs. The header information
+        and the constant logs are the attributes of the rows.
+
+        Parameters
+        ----------
+        filename: str
+            Name of the HDF5 file to write
+        sample_logs: ~pyrs.dataobjects.SampleLogs
+        peak_collections: list
+            list of :py:obj:`~pyrs.peaks.PeakCollection`
+        tolerance : float
+            relative tolerance of variance to treat a sample log as a constant value
+            and bring into the attributes
+        append: bool
+            Add the rows to the table already in the file, for collecting many runs into one table
+        """
+        self._check_subruns(sample_logs, peak_collections)
+        self._classify_logs(sample_logs, tolerance)
+        self._set_header_information(sample_logs)
+
+        attributes = {logname: self._header_information[logname] for logname, _ in HEADER_MAPPING}
+        attributes['missing'] = ', '.join(self._missing_logs)
+        for name in self._constant_logs:
+            value = np.asarray(sample_logs[name])
+            attributes[name] = value.mean() if value.dtype.kind in 'biuf' else value[0]
+
+        num_subruns = len(sample_logs.subruns)
+        columns = [sample_logs.subruns.raw_copy()]
+        columns.extend(np.asarray(sample_logs[name]) for name in self._body_logs())
+        for peak_collection in peak_collections:
+            peak_columns, excluded = self._peak_arrays(peak_collection, num_subruns)
+            columns.extend(np.where(excluded, np.nan, column) for column in peak_columns)
+
+        write_hdf5_table(filename, dict(zip(self._column_names(peak_collections), columns)), attributes, append)
+
+    @staticmethod
+    def _check_subruns(sample_logs, peak_collections):
+        '''verify the same number of subruns everywhere'''
+        for peak_collection in peak_collections:
+            subruns = peak_collection.sub_runs
+            if not sample_logs.matching_subruns(subruns):
+                raise ValueError('Subruns from sample logs and peak {} do not match'.format(peak_collection.peak_tag))
+
     def _classify_logs(self, sample_logs, tolerance):
         self._constant_logs = [logname for logname in sample_logs.constant_logs(tolerance)
                                if logname in self._sample_log_list]
         self._constant_logs.sort()  # keep the order stable for python3 tests
 
         # loop through all of the requested logs and classify as present or missing
+        self._present_logs = []
+        self._missing_logs = []
         for logname in self._sample_log_list:
             if logname in sample_logs:
                 self._present_logs.append(logname)
@@ -133,6 +189,22 @@ class SummaryGenerator:
                 self._missing_logs.append(logname)
 
     def _write_header_information(self, handle, sample_logs):
+        self._set_header_information(sample_logs)
+
+        # write out the text
+        for logname, label in HEADER_MAPPING:
+            value = self._header_information[logname]
+            try:  # for python 3
+                value = value.decode()
+            except (UnicodeDecodeError, AttributeError):
+                pass
+            if value:
+                line = ' = '.join((label, str(value)))
+            else:
+                line = label
+            handle.write('# {}\n'.format(line))
+
+    def _set_header_information(self, sample_logs):
         '''Things that are supplied to SummaryGenerator.setHeaderInformation win out over what
         is found in the sample_logs'''
         # get the values that weren't specified from the logs
@@ -160,19 +232,6 @@ class SummaryGenerator:
                         experiment_identifier = self._header_information[logname]
                     self._header_information[logname] = experiment_identifier.split('-')[-1]
 
-        # write out the text
-        for logname, label in HEADER_MAPPING:
-            value = self._header_information[logname]
-            try:  # for python 3
-                value = value.decode()
-            except (UnicodeDecodeError, AttributeError):
-                pass
-            if value:
-                line = ' = '.join((label, str(value)))
-            else:
-                line = label
-            handle.write('# {}\n'.format(line))
-
     def _write_header_missing(self, handle):
         '''Add to the header a list of all missing logs'''
         if self._missing_logs:
@@ -196,9 +255,17 @@ class SummaryGenerator:
 
     def _write_column_names(self, handle, peak_collections):
         '''This writes the names of all of the columns'''
+        handle.write(self.separator.join(self._column_names(peak_collections)) + '\n')
+
+    def _body_logs(self):
+        '''The present logs that are not constant'''
+        return [name for name in self._present_logs
+                if name not in self._constant_logs]
+
+    def _column_names(self, peak_collections):
+        '''The names of all of the columns'''
         # the header line from the sample logs
-        column_names = [name for name in self._present_logs
-                        if name not in self._constant_logs]
+        column_names = self._body_logs()
 
         # the contribution from each peak
         for peak_collection in peak_collections:
@@ -218,48 +285,111 @@ class SummaryGenerator:
         # subrun number goes in the very front
         column_names.insert(0, 'sub-run')
 
-        handle.write(self.separator.join(column_names) + '\n')
+        return column_names
 
     def _write_data(self, handle, sample_logs, peak_collections):
-        '''Write out the actual data fields, ignoring what is constant'''
-        log_names = [name for name in self._present_logs
-                     if name not in self._constant_logs]
-
-        for subrun_index in range(len(sample_logs.subruns)):
-            line = []
-
-            # sub-run goes in first
-            line.append(str(sample_logs.subruns[subrun_index]))
-
-            # then sample logs
-            for name in log_names:
-                line.append(str(sample_logs[name][subrun_index]))  # get by index rather than subrun
-
-            for peak_collection in peak_collections:
-                if peak_collection.get_exclude_subrun(subrun_index) is False:
-                    fit_cost = peak_collection.fitting_costs
-                    dspacing_center, dspacing_center_error = peak_collection.get_dspacing_center()
-                    strain, strain_error = peak_collection.get_strain(units='microstrain')
-                    values, errors = peak_collection.get_effective_params()
-                    line.append(str(dspacing_center[subrun_index]))
-                    line.append(str(strain[subrun_index]))
-                    for value in values[subrun_index]:
-                        line.append(str(value))
-                    line.append(str(dspacing_center_error[subrun_index]))
-                    line.append(str(strain_error[subrun_index]))
-                    for value in errors[subrun_index]:
-                        line.append(str(value))
-                    line.append(str(fit_cost[subrun_index]))
-                else:
-                    values, errors = peak_collection.get_effective_params()
-                    line.append('-')
-                    line.append('-')
-                    for value in values[subrun_index]:
-                        line.append('-')
-                    line.append('-')
-                    line.append('-')
-                    for value in errors[subrun_index]:
-                        line.append('-')
-                    line.append('-')
-
-            handle.write(self.separator.join(line) + '\n')
+        '''Write out the actual data fields, ignoring what is constant
+
+        All the columns are converted to text at once, then the rows are written in chunks'''
+        # sub-run goes in first, then sample logs
+        columns = [_to_text(sample_logs.subruns.raw_copy())]
+        for name in self._body_logs():
+            columns.append(_to_text(sample_logs[name]))
+
+        for peak_collection in peak_collections:
+            columns.extend(self._peak_columns(peak_collection, len(sample_logs.subruns)))
+
+        rows = zip(*columns)
+        for _ in range(0, len(sample_logs.subruns), self.ROWS_PER_CHUNK):
+            chunk = islice(rows, self.ROWS_PER_CHUNK)
+            handle.write(''.join(self.separator.join(row) + '\n' for row in chunk))
+
+    @staticmethod
+    def _peak_columns(peak_collection, num_subruns):
+        '''Text columns of a peak with "-" for the excluded sub runs'''
+        columns, excluded = SummaryGenerator._peak_arrays(peak_collection, num_subruns)
+
+        return [np.where(excluded, '-', _to_text(column)) for column in columns]
+
+    @staticmethod
+    def _peak_arrays(peak_collection, num_subruns):
+        '''Columns of a peak and which sub runs are excluded'''
+        fit_cost = peak_collection.fitting_costs
+        dspacing_center, dspacing_center_error = peak_collection.get_dspacing_center()
+        strain, strain_error = peak_collection.get_strain(units='microstrain')
+        values, errors = peak_collection.get_effective_params()
+
+        columns = [dspacing_center, strain]
+        columns.extend(values[name] for name in values.dtype.names)
+        columns.extend([dspacing_center_error, strain_error])
+        columns.extend(errors[name] for name in errors.dtype.names)
+        columns.append(fit_cost)
+
+        # only the sub runs explicitly not excluded are written
+        excluded = np.array([peak_collection.get_exclude_subrun(subrun_index) is not False
+                             for subrun_index in range(num_subruns)], dtype=bool)
+
+        return [column[:num_subruns] for column in columns], excluded
+
+
+def _to_text(values):
+    '''Convert an array to the same text as ``str`` of each of its items'''
+    return np.asarray(values).astype(str)
+
+
+def write_hdf5_table(filename, columns, attributes=None, append=False):
+    '''Write columns of the same length as one extendable dataset per column of a HDF5 file
+
+    The names of the columns are the ``columns`` attribute of the file, in order. The attributes of
+    each call are stored in the group ``headers/<index>`` with the first row and the number of rows
+    written, so the rows of many runs can be collected into one table.
+
+    Parameters
+    ----------
+    filename: str
+        Name of the HDF5 file
+    columns: dict
+        column name to :py:obj:`numpy.ndarray`, in the order of the columns
+    attributes: dict
+        header information of the rows
+    append: bool
+        Add the rows to the table already in the file rather than overwriting the file
+    '''
+    names = list(columns.keys())
+    num_rows = {len(values) for values in columns.values()}
+    if len(num_rows) > 1:
+        raise RuntimeError('Columns have different lengths {}'.format(sorted(num_rows)))
+    num_rows = num_rows.pop() if num_rows else 0
+
+    with h5py.File(filename, 'a' if append else 'w') as handle:
+        if 'columns' in handle.attrs:
+            existing = [str(name) for name in handle.attrs['columns']]
+            if existing != names:
+                raise RuntimeError('Cannot append columns {} to table "{}" with columns {}'
+                                   ''.format(names, filename, existing))
+        else:
+            handle.attrs['columns'] = names
+            for name, values in columns.items():
+                dtype = np.asarray(values).dtype
+                if dtype.kind in 'OSU':
+                    dtype = h5py.string_dtype()
+                handle.create_dataset(name, shape=(0,), maxshape=(None,), dtype=dtype, chunks=True)
+
+        first_row = handle[names[0]].shape[0] if names else 0
+        for name, values in columns.items():
+            values = np.asarray(values)
+            if values.dtype.kind in 'OSU':
+                values = values.astype(str).astype(object)
+            handle[name].resize((first_row + num_rows,))
+            handle[name][first_row:] = values
+
+        headers = handle.require_group('headers')
+        header = headers.create_group(str(len(headers)))
+        header.attrs['first_row'] = first_row
+        header.attrs['number_rows'] = num_rows
+        for key, value in (attributes or dict()).items():
+            try:  # for python 3
+                value = value.decode()
+            except (UnicodeDecodeError, AttributeError):
+                pass
+            header.attrs[key] = value
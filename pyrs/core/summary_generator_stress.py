@@ -1,7 +1,7 @@
 """
-This module generates reduction summary for stress in plain text CSV file
+This module generates reduction summary for stress in plain text CSV file or a columnar HDF5 table
 """
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, List, Tuple
 from builtins import int, isinstance
 import math
 
@@ -12,6 +12,7 @@ from pyrs.peaks.peak_collection import PeakCollection
 
 import numpy as np
 from pyrs.core.stress_facade import StressFacade
+from pyrs.core.summary_generator import write_hdf5_table
 
 
 class SummaryGeneratorStress:
@@ -128,18 +129,7 @@ class SummaryGeneratorStress:
             Public function to generate a summary csv file for stress and input fields
         """
         def _write_summary_csv_column_names(handle):
-            column_names = 'vx, vy, vz, d0, d0_error, '
-            # directional variables
-            for field_3dir in SummaryGeneratorStress.fields_3dir:
-
-                field_name = field_3dir if field_3dir != 'Height' else 'Peak_Height'
-
-                for direction in SummaryGeneratorStress.directions:
-                    column_names += field_name + '_Dir' + direction + ', '
-                    column_names += field_name + '_Dir' + direction + '_error, '
-
-            column_names = column_names[:-2] + '\n'
-            handle.write(column_names)
+            handle.write(', '.join(self._summary_column_names()) + '\n')
             return
 
         def _write_summary_csv_body(handle):
@@ -219,7 +209,7 @@ class SummaryGeneratorStress:
                         decimals = SummaryGeneratorStress.decimals['d0']
                         line += self._write_number(d0_value, decimals) + \
                             self._write_number(d0_error, decimals)
-                        break
+                    break
 
                 # value error for fields_3dir = ['d', 'FWHM', 'Peak_Height', 'Strain', 'Stress']
                 for field_3dir in SummaryGeneratorStress.fields_3dir:
@@ -247,77 +237,14 @@ class SummaryGeneratorStress:
         """
 
         def _write_full_csv_column_names(handle):
-
-            column_names = 'vx, vy, vz, d0, d0_error, '
-
-            # directional variables
-            for field_3dir in SummaryGeneratorStress.fields_3dir:
-
-                field_name = field_3dir if field_3dir != 'Height' else 'Peak_Height'
-
-                for direction in SummaryGeneratorStress.directions:
-
-                    if field_name == 'Stress':
-                        entry_base = field_name + '_Dir' + direction
-                        column_names += entry_base + ', '
-                        column_names += entry_base + '_error, '
-                    else:
-                        runs = self._stress_facade.runs(direction)
-                        for run in runs:
-                            entry_base = field_name + '_Dir' + direction + '_' + str(run)
-                            column_names += entry_base + ', '
-                            column_names += entry_base + '_error, '
-
-            column_names = column_names[:-2] + '\n'
-            handle.write(column_names)
-
+            handle.write(', '.join(self._full_column_names()) + '\n')
             return
 
         def _write_full_csv_body(handle) -> None:
 
             body = ''
 
-            # retrieve d_reference once as it implies calculations
-            d0_scalar_field: ScalarFieldSample = self._stress_facade.d_reference
-            d0_values = d0_scalar_field.values
-            d0_errors = d0_scalar_field.errors
-
-            # [direction][0] = values, [direction][1] = errors
-            stress_fields: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
-            # [direction][run][0] = values, [direction][run][1] = errors
-            strain_fields: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {}
-            peak_data: Dict[str, Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]]] = {}
-
-            for field_3dir in SummaryGeneratorStress.fields_3dir:
-
-                for direction in SummaryGeneratorStress.directions:
-
-                    self._stress_facade.selection = direction
-
-                    if field_3dir == 'Stress':
-                        stress_fields[direction] = (self._stress_facade.stress.values,
-                                                    self._stress_facade.stress.errors)
-                    else:
-                        strain_fields[direction] = {}
-
-                        if direction not in peak_data.keys():
-                            peak_data[direction] = {}
-
-                        runs = self._stress_facade.runs(direction)
-                        for run in runs:
-
-                            self._stress_facade.selection = run
-
-                            if field_3dir == 'Strain':
-                                strain_fields[direction][run] = (self._stress_facade.strain.values,
-                                                                 self._stress_facade.strain.errors)
-                            else:
-                                if run not in peak_data[direction].keys():
-                                    peak_data[direction][run] = {}
-
-                                field_data = self._stress_facade.peak_parameter(field_3dir)
-                                peak_data[direction][run][field_3dir] = (field_data.values,
-                                                                         field_data.errors)
+            d0_values, d0_errors, stress_fields, strain_fields, peak_data = self._full_fields()
             # write for each row of the CSV body, first coordinates, d0 and
             # then fields in SummaryGeneratorStress.fields_3dir value, error per dimension
             for row, coordinate in enumerate(self._stress.coordinates):
@@ -382,6 +309,202 @@ class SummaryGeneratorStress:
 
         return
 
+    def write_summary_hdf5(self, filename: str, append: bool = False) -> None:
+        """
+            Write the columns of the summary csv file to a HDF5 table, see
+            :py:func:`~pyrs.core.summary_generator.write_hdf5_table`. Empty entries are NaN.
+
+            Args:
+                filename: name of the HDF5 file
+                append: add the rows to the table already in the file
+        """
+        self._recalc_peak_collections_data()
+        num_rows = len(self._stress.coordinates)
+
+        # d0 doesn't depend on direction so just picking the first peak_collection
+        d0: Tuple[np.ndarray, np.ndarray] = (np.array([]), np.array([]))
+        for direction in SummaryGeneratorStress.directions:
+            peak_collection = self._get_peak_collection(direction)
+            if peak_collection:
+                d0 = peak_collection.get_d_reference()
+                break
+
+        columns = self._coordinate_columns() + [d0[0], d0[1]]
+        for field_3dir in SummaryGeneratorStress.fields_3dir:
+            for direction in SummaryGeneratorStress.directions:
+                if field_3dir == 'Strain':
+                    columns.extend(self._strain_field[direction])
+                elif field_3dir == 'Stress':
+                    columns.extend(self._stress_field[direction])
+                elif self._is_calculated_33(direction):
+                    columns.extend([np.array([]), np.array([])])
+                else:
+                    columns.extend(self._peak_colllections_data[field_3dir][direction])
+
+        write_hdf5_table(filename, self._to_table(self._summary_column_names(), columns, num_rows),
+                         self._header_attributes(), append)
+
+    def write_full_hdf5(self, filename: str, append: bool = False) -> None:
+        """
+            Write the columns of the full csv file to a HDF5 table, see
+            :py:func:`~pyrs.core.summary_generator.write_hdf5_table`. Empty entries are NaN.
+
+            Args:
+                filename: name of the HDF5 file
+                append: add the rows to the table already in the file
+        """
+        d0_values, d0_errors, stress_fields, strain_fields, peak_data = self._full_fields()
+        num_rows = len(self._stress.coordinates)
+
+        columns = self._coordinate_columns() + [d0_values, d0_errors]
+        for field_3dir in SummaryGeneratorStress.fields_3dir:
+            for direction in SummaryGeneratorStress.directions:
+                if field_3dir == 'Stress':
+                    columns.extend(stress_fields[direction])
+                    continue
+
+                for run in self._stress_facade.runs(direction):
+                    if field_3dir == 'Strain':
+                        columns.extend(strain_fields[direction][run])
+                    else:
+                        columns.extend(peak_data[direction][run][field_3dir])
+
+        write_hdf5_table(filename, self._to_table(self._full_column_names(), columns, num_rows),
+                         self._header_attributes(), append)
+
+    def _summary_column_names(self) -> List[str]:
+        """
+            Names of the columns of the summary csv file
+        """
+        column_names = ['vx', 'vy', 'vz', 'd0', 'd0_error']
+        # directional variables
+        for field_3dir in SummaryGeneratorStress.fields_3dir:
+
+            field_name = field_3dir if field_3dir != 'Height' else 'Peak_Height'
+
+            for direction in SummaryGeneratorStress.directions:
+                column_names.append(field_name + '_Dir' + direction)
+                column_names.append(field_name + '_Dir' + direction + '_error')
+
+        return column_names
+
+    def _full_column_names(self) -> List[str]:
+        """
+            Names of the columns of the full csv file
+        """
+        column_names = ['vx', 'vy', 'vz', 'd0', 'd0_error']
+
+        # directional variables
+        for field_3dir in SummaryGeneratorStress.fields_3dir:
+
+            field_name = field_3dir if field_3dir != 'Height' else 'Peak_Height'
+
+            for direction in SummaryGeneratorStress.directions:
+
+                if field_name == 'Stress':
+                    entry_base = field_name + '_Dir' + direction
+                    column_names.append(entry_base)
+                    column_names.append(entry_base + '_error')
+                else:
+                    runs = self._stress_facade.runs(direction)
+                    for run in runs:
+                        entry_base = field_name + '_Dir' + direction + '_' + str(run)
+                        column_names.append(entry_base)
+                        column_names.append(entry_base + '_error')
+
+        return column_names
+
+    def _full_fields(self):
+        """
+            d0 values and errors, then the stress per direction and the strain and
+            peak parameters per direction and run of the full csv file
+        """
+        # retrieve d_reference once as it implies calculations
+        d0_scalar_field: ScalarFieldSample = self._stress_facade.d_reference
+        d0_values = d0_scalar_field.values
+        d0_errors = d0_scalar_field.errors
+
+        # [direction][0] = values, [direction][1] = errors
+        stress_fields: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        # [direction][run][0] = values, [direction][run][1] = errors
+        strain_fields: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {}
+        peak_data: Dict[str, Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]]] = {}
+
+        for field_3dir in SummaryGeneratorStress.fields_3dir:
+
+            for direction in SummaryGeneratorStress.directions:
+
+                self._stress_facade.selection = direction
+
+                if field_3dir == 'Stress':
+                    stress_fields[direction] = (self._stress_facade.stress.values,
+                                                self._stress_facade.stress.errors)
+                else:
+                    strain_fields[direction] = {}
+
+                    if direction not in peak_data.keys():
+                        peak_data[direction] = {}
+
+                    runs = self._stress_facade.runs(direction)
+                    for run in runs:
+
+                        self._stress_facade.selection = run
+
+                        if field_3dir == 'Strain':
+                            strain_fields[direction][run] = (self._stress_facade.strain.values,
+                                                             self._stress_facade.strain.errors)
+                        else:
+                            if run not in peak_data[direction].keys():
+                                peak_data[direction][run] = {}
+
+                            field_data = self._stress_facade.peak_parameter(field_3dir)
+                            peak_data[direction][run][field_3dir] = (field_data.values,
+                                                                     field_data.errors)
+
+        return d0_values, d0_errors, stress_fields, strain_fields, peak_data
+
+    def _coordinate_columns(self) -> List[np.ndarray]:
+        """
+            vx, vy, vz of each grid point
+        """
+        coordinates = np.asarray(self._stress.coordinates, dtype=float).reshape(-1, 3)
+        return [coordinates[:, index] for index in range(3)]
+
+    @staticmethod
+    def _to_table(column_names: List[str], columns: List[np.ndarray], num_rows: int) -> Dict[str, np.ndarray]:
+        """
+            Columns as float arrays of one entry per grid point, padded with NaN like the empty csv entries
+        """
+        table: Dict[str, np.ndarray] = {}
+        for name, values in zip(column_names, columns):
+            column = np.full(num_rows, np.nan)
+            values = np.asarray(values, dtype=float)[:num_rows]
+            column[:values.size] = values
+            table[name] = column
+
+        return table
+
+    def _header_attributes(self) -> Dict[str, str]:
+        """
+            The runs of each direction, Young's modulus and Poisson ratio of the csv header
+        """
+        attributes = {}
+        for direction in SummaryGeneratorStress.directions:
+            if direction == '33' and self._strain33_is_calculated:
+                attributes['Direction ' + direction] = 'calculated'
+            else:
+                attributes['Direction ' + direction] = ', '.join(self._stress_facade.runs(direction))
+        attributes['E'] = str(self._stress.youngs_modulus)
+        attributes['v'] = str(self._stress.poisson_ratio)
+
+        return attributes
+
+    def _is_calculated_33(self, direction: str) -> bool:
+        """
+            Whether there are no measured peaks because direction 33 is calculated for in-plane stress types
+        """
+        return direction == '33' and self._stress_facade.stress_type in ('in-plane-strain', 'in-plane-stress')
+
     def _write_number(self, number, decimal_digits=12) -> str:
 
         if math.isnan(number):
@@ -1,6 +1,6 @@
 # Data manager
 import numpy
-from pyrs.dataobjects import HidraConstants, SampleLogs  # type: ignore
+from pyrs.dataobjects import HidraConstants, SampleLogs, SparseCounts  # type: ignore
 from pyrs.projectfile import HidraProjectFile  # type: ignore
 from pyrs.utilities import checkdatatypes
 from pyrs.utilities.convertdatatypes import to_int
@@ -16,16 +16,33 @@ class HidraWorkspace:
     - container for fitted peaks' parameters
     - container for instrument information
     """
+    # number of sub runs whose counts (and reduced data) loaded on demand are kept in memory
+    MAX_RESIDENT_SUB_RUNS = 32
 
-    def __init__(self, name='hidradata'):
+    def __init__(self, name='hidradata', sparse_counts=False):
         """
         initialization
+
+        Parameters
+        ----------
+        name : str
+            workspace name
+        sparse_counts : bool
+            hold raw counts as the counts of the pixels with counts (SparseCounts), e.g., for short sub runs
         """
         # workspace name
         self._name = name
 
         # raw counts
-        self._raw_counts = dict()  # dict [sub-run] = count vector
+        self._raw_counts = dict()  # dict [sub-run] = count vector or SparseCounts
+        self._sparse_counts = sparse_counts
+
+        # data loaded on demand from the project file: least recently used ones are dropped first
+        self._max_resident_sub_runs = self.MAX_RESIDENT_SUB_RUNS
+        self._lazy_sub_runs = set()  # sub runs with raw counts in project file
+        self._resident_counts = dict()  # [sub-run] = count vector or SparseCounts
+        self._lazy_reduced_masks = list()  # masks with reduced diffraction data in project file
+        self._resident_reduced_data = dict()  # [mask id, sub-run] = intensities, variances
 
         # wave length
         self._wave_length = None  # single wave length for all sub runs
@@ -60,6 +77,16 @@ class HidraWorkspace:
         """
         return self._name
 
+    @property
+    def sparse_counts(self):
+        """Whether raw counts are held as sparse counts
+
+        Returns
+        -------
+        bool
+        """
+        return self._sparse_counts
+
     @property
     def hidra_project_file(self):
         """Name of the associated HiDRA project file
@@ -80,7 +107,7 @@ class HidraWorkspace:
             list of dictionary names for reduction masks
 
         """
-        return list(self._diff_data_set.keys())
+        return list(self._diff_data_set.keys()) + self._lazy_reduced_masks
 
     def _load_raw_counts(self, hidra_file):
         """ Load raw detector counts from HIDRA file
@@ -90,15 +117,84 @@ class HidraWorkspace:
         checkdatatypes.check_type('HIDRA project file', hidra_file, HidraProjectFile)
 
         for sub_run_i in self._sample_logs.subruns:
-            counts_vec_i = hidra_file.read_raw_counts(sub_run_i)
+            if self._sparse_counts:
+                counts_vec_i = hidra_file.read_sparse_raw_counts(sub_run_i)
+            else:
+                counts_vec_i = hidra_file.read_raw_counts(sub_run_i)
             self._raw_counts[sub_run_i] = counts_vec_i
         # END-FOR
 
         return
 
-    def _load_reduced_diffraction_data(self, hidra_file):
+    def _get_resident(self, resident_dict, key, read_function):
+        """ Get data loaded on demand and keep it as the most recently used
+        :param resident_dict: dictionary of resident data
+        :param key: key of the data
+        :param read_function: function to read the data from project file if it is not resident
+        :return:
+        """
+        if key in resident_dict:
+            value = resident_dict.pop(key)
+        else:
+            value = read_function()
+        resident_dict[key] = value
+
+        # drop the least recently used data
+        while len(resident_dict) > self._max_resident_sub_runs:
+            del resident_dict[next(iter(resident_dict))]
+
+        return value
+
+    def _read_lazy_raw_counts(self, sub_run):
+        """ Read raw counts of a sub run from the project file
+        :param sub_run: sub run number
+        :return:
+        """
+        if self._sparse_counts:
+            return self._project_file.read_sparse_raw_counts(sub_run)
+
+        return self._project_file.read_raw_counts(sub_run)
+
+    def _read_lazy_reduced_data(self, mask_id, sub_run):
+        """ Read reduced diffraction data of a sub run from the project file
+        :param mask_id: mask ID
+        :param sub_run: sub run number
+        :return: intensities, variances
+        """
+        vec_intensity = self._project_file.read_diffraction_intensity_vector(mask_id, sub_run)
+        vec_variance = self._project_file.read_diffraction_variance_vector(mask_id, sub_run)
+        if vec_variance is None:
+            vec_variance = numpy.sqrt(vec_intensity)
+
+        return vec_intensity, vec_variance
+
+    def _load_lazy_reduced_data(self, mask_ids=None):
+        """ Load all the reduced diffraction data of masks, which are loaded on demand so far
+        :param mask_ids: mask IDs.  None for all the masks
+        :return:
+        """
+        if mask_ids is None:
+            mask_ids = list(self._lazy_reduced_masks)
+
+        for mask_id in mask_ids:
+            if mask_id not in self._lazy_reduced_masks:
+                continue
+            self._diff_data_set[mask_id] = self._project_file.read_diffraction_intensity_vector(mask_id=mask_id,
+                                                                                                sub_run=None)
+            self._var_data_set[mask_id] = self._project_file.read_diffraction_variance_vector(mask_id=mask_id,
+                                                                                              sub_run=None)
+            if self._var_data_set[mask_id] is None:
+                self._var_data_set[mask_id] = numpy.sqrt(self._diff_data_set[mask_id])
+            self._lazy_reduced_masks.remove(mask_id)
+
+        for key in list(self._resident_reduced_data.keys()):
+            if key[0] not in self._lazy_reduced_masks:
+                del self._resident_reduced_data[key]
+
+    def _load_reduced_diffraction_data(self, hidra_file, lazy=False):
         """ Load reduced diffraction data from HIDRA file
         :param hidra_file: HidraProjectFile instance
+        :param lazy: only load 2theta and read the intensities of a sub run when it is requested
         :return:
         """
         # Check inputs
@@ -128,6 +224,14 @@ class HidraWorkspace:
         # Set value
         self._2theta_matrix = numpy.copy(matrix_2theta)
 
+        if lazy:
+            # variances are read along with the intensities
+            self._lazy_reduced_masks = [None if mask_name == HidraConstants.REDUCED_MAIN else mask_name
+                                        for mask_name in hidra_file.read_diffraction_masks()
+                                        if not mask_name.endswith('_var')]
+            self._resident_reduced_data.clear()
+            return
+
         # initialize data set for reduced diffraction patterns
         diff_mask_list = hidra_file.read_diffraction_masks()
         for mask_name in diff_mask_list:
@@ -280,9 +384,62 @@ class HidraWorkspace:
         Returns
         -------
         numpy.ndarray
+            counts of all the pixels even if the counts are held as sparse counts
+
+        """
+        counts = self._get_raw_counts(sub_run)
+        if isinstance(counts, SparseCounts):
+            counts = counts.to_dense()
+
+        return counts
+
+    def get_sparse_detector_counts(self, sub_run: int) -> SparseCounts:
+        """Get the detector counts of a sub run as the counts of the pixels with counts
+
+        Parameters
+        ----------
+        sub_run : int
+            sub run number
+
+        Returns
+        -------
+        ~pyrs.dataobjects.SparseCounts
+
+        """
+        counts = self._get_raw_counts(sub_run)
+        if not isinstance(counts, SparseCounts):
+            counts = SparseCounts.from_dense(counts)
+
+        return counts
+
+    def get_detector_counts_block(self, sub_runs) -> numpy.ndarray:
+        """Get the detector counts of several sub runs
+
+        The counts of sub runs loaded on demand from raw counts in contiguous layout are read directly from
+        the memory mapped project file, i.e., without copying for consecutive sub runs.
+
+        Parameters
+        ----------
+        sub_runs : list, numpy.ndarray
+            sub run numbers
+
+        Returns
+        -------
+        numpy.ndarray
+            counts of shape (number of sub runs) x (number of pixels)
 
         """
+        if not self._sparse_counts and self._project_file is not None \
+                and all(int(sub_run) in self._lazy_sub_runs for sub_run in sub_runs) \
+                and self._project_file.has_raw_counts_block():
+            return self._project_file.read_raw_counts_block(sub_runs)
+
+        return numpy.array([self.get_detector_counts(sub_run) for sub_run in sub_runs])
+
+    def _get_raw_counts(self, sub_run: int):
         sub_run = to_int('Sub run number', sub_run, min_value=0)  # consider 0 as a single sub run
+        if sub_run in self._lazy_sub_runs:
+            return self._get_resident(self._resident_counts, sub_run, lambda: self._read_lazy_raw_counts(sub_run))
         if sub_run not in self._raw_counts:
             raise RuntimeError('Sub run {} does not exist in loaded raw counts. FYI loaded '
                                'sub runs are {}'.format(sub_run, self._raw_counts.keys()))
@@ -350,30 +507,44 @@ class HidraWorkspace:
 
         return wave_length_dict
 
-    def load_hidra_project(self, hidra_file, load_raw_counts, load_reduced_diffraction):
+    def load_hidra_project(self, hidra_file, load_raw_counts, load_reduced_diffraction, lazy=False,
+                           max_resident_sub_runs=None):
         """
         Load HIDRA project file
+
+        In lazy mode, the raw counts and the reduced diffraction data of a sub run are read from the project file
+        when they are requested the first time.  Only the most recently used sub runs are kept in memory such that
+        the memory usage does not depend on the number of sub runs.  The project file shall be kept open.
+
         :param hidra_file: HIDRA project file instance (not file name)
         :param load_raw_counts: Flag to load raw counts
         :param load_reduced_diffraction: Flag to load reduced diffraction data
+        :param lazy: Flag to load raw counts and reduced diffraction data on demand
+        :param max_resident_sub_runs: number of sub runs loaded on demand kept in memory.  None for default
         :return:
         """
         # Check input
         checkdatatypes.check_type('HIDRA project file', hidra_file, HidraProjectFile)
         self._project_file_name = hidra_file.name
         self._project_file = hidra_file
+        if max_resident_sub_runs is not None:
+            self._max_resident_sub_runs = to_int('Maximum resident sub runs', max_resident_sub_runs, min_value=1)
 
         # create the spectrum map - must exist before loading the counts array
         self._sample_logs.subruns = hidra_file.read_sub_runs()
 
         # load raw detector counts and load instrument
         if load_raw_counts:
-            self._load_raw_counts(hidra_file)
+            if lazy:
+                self._lazy_sub_runs = set(self._sample_logs.subruns)
+                self._resident_counts.clear()
+            else:
+                self._load_raw_counts(hidra_file)
             self._load_instrument(hidra_file)
 
         # load reduced diffraction
         if load_reduced_diffraction:
-            self._load_reduced_diffraction_data(hidra_file)
+            self._load_reduced_diffraction_data(hidra_file, lazy)
 
         # load sample logs
         self._load_sample_logs(hidra_file)
@@ -441,6 +612,7 @@ class HidraWorkspace:
             pass
         else:
             checkdatatypes.check_string_variable('Mask ID', mask_id)
+        self._load_lazy_reduced_data([mask_id])
 
         # Vector 2theta
         matrix_2theta = self._2theta_matrix.copy()
@@ -516,6 +688,11 @@ class HidraWorkspace:
         # Vector 2theta
         vec_2theta = self._2theta_matrix[spec_index][:]
 
+        if mask_id in self._lazy_reduced_masks:
+            vec_intensity, vec_variance = self._get_resident(self._resident_reduced_data, (mask_id, sub_run),
+                                                             lambda: self._read_lazy_reduced_data(mask_id, sub_run))
+            return vec_2theta, vec_intensity.copy(), vec_variance.copy()
+
         # Vector intensity
         try:
             vec_intensity = self._diff_data_set[mask_id][spec_index].copy()
@@ -539,7 +716,7 @@ class HidraWorkspace:
         array list of mask ids
 
         """
-        return list(self._diff_data_set.keys())
+        return self.reduction_masks
 
     def get_sample_log_names(self):
         return sorted(self._sample_logs.keys())
@@ -639,7 +816,7 @@ class HidraWorkspace:
         """
         sub_run = to_int('Sub run', sub_run, min_value=1)
 
-        return sub_run in self._raw_counts
+        return sub_run in self._raw_counts or sub_run in self._lazy_sub_runs
 
     def has_sample_log(self, sample_log_name):
         """
@@ -704,15 +881,28 @@ class HidraWorkspace:
         """
         Set the raw counts to
         :param sub_run_number: integer for sub run number
-        :param counts: ndarray of detector counts
+        :param counts: ndarray of detector counts or SparseCounts
         :return:
         """
+        # counts set to workspace replace the counts in project file
+        self._lazy_sub_runs.discard(int(sub_run_number))
+        self._resident_counts.pop(int(sub_run_number), None)
+
+        if isinstance(counts, SparseCounts):
+            if not self._sparse_counts:
+                counts = counts.to_dense()
+            self._raw_counts[int(sub_run_number)] = counts
+            return
+
         checkdatatypes.check_numpy_arrays('Counts', [counts], dimension=None, check_same_shape=False)
 
         if len(counts.shape) == 2 and counts.shape[1] == 1:
             # 1D array in 2D format: set to 1D array
             counts = counts.reshape((counts.shape[0],))
 
+        if self._sparse_counts:
+            counts = SparseCounts.from_dense(counts)
+
         self._raw_counts[int(sub_run_number)] = counts
 
     def set_reduced_diffraction_data(self, sub_run: int, mask_id: Optional[str],
@@ -753,6 +943,9 @@ class HidraWorkspace:
             raise RuntimeError('Two theta array (bin centers) must have same dimension as intensity array. '
                                'Now they are {} and {}'.format(two_theta_array.shape, intensity_array.shape))
 
+        # data in project file is loaded to be updated
+        self._load_lazy_reduced_data([mask_id])
+
         # Set 2-theta 2D array
         if self._2theta_matrix is None or len(self._2theta_matrix.shape) != 2:
             # First time set up or legacy from input file: create the 2D array
@@ -812,6 +1005,77 @@ class HidraWorkspace:
         # Set variances
         self._var_data_set[mask_id][spec_id] = variances_array
 
+    def set_reduced_diffraction_data_block(self, sub_runs, mask_id: Optional[str],
+                                           two_theta_array: numpy.ndarray,
+                                           intensity_matrix: numpy.ndarray,
+                                           variances_matrix: numpy.ndarray) -> None:
+        """Set reduced diffraction data of several sub runs sharing the same 2theta bins to workspace
+
+        Parameters
+        ----------
+        sub_runs : list or numpy.ndarray
+            sub run numbers, one for each row of the intensity and variances matrices
+        mask_id : None or str
+            mask ID.  None for no-mask or masked by default/universal detector masks on edges
+        two_theta_array : numpy.ndarray
+            2theta bins (center) shared by all the sub runs
+        intensity_matrix : numpy.ndarray
+            histogrammed intensities in 2D array: (number of sub runs) x (number of 2theta)
+        variances_matrix : numpy.ndarray
+            histogrammed variances in 2D array: (number of sub runs) x (number of 2theta)
+
+        Returns
+        -------
+        None
+
+        """
+        # Check status of reducer whether sub run number and spectrum are initialized
+        if len(self._sample_logs.subruns) == 0:
+            raise RuntimeError('Sub run - spectrum map has not been set up yet!')
+
+        # Check inputs
+        sub_runs = numpy.atleast_1d(sub_runs)
+        if mask_id is not None:
+            checkdatatypes.check_string_variable('Mask ID', mask_id)
+        checkdatatypes.check_numpy_arrays('Intensities and variances', [intensity_matrix, variances_matrix],
+                                          2, True)
+        if intensity_matrix.shape != (sub_runs.shape[0], two_theta_array.shape[0]):
+            raise RuntimeError('Intensity matrix (shape: {}) does not match {} sub runs and {} 2theta bins'
+                               ''.format(intensity_matrix.shape, sub_runs.shape[0], two_theta_array.shape[0]))
+
+        # data in project file is loaded to be updated
+        self._load_lazy_reduced_data([mask_id])
+
+        num_sub_runs = len(self._sample_logs.subruns)
+        if self._2theta_matrix is None or len(self._2theta_matrix.shape) != 2:
+            # First time set up or legacy from input file: create the 2D array
+            self._2theta_matrix = numpy.ndarray(shape=(num_sub_runs, two_theta_array.shape[0]),
+                                                dtype=intensity_matrix.dtype)
+            self._diff_data_set[mask_id] = numpy.ndarray(shape=(num_sub_runs, two_theta_array.shape[0]),
+                                                         dtype=intensity_matrix.dtype)
+            self._var_data_set[mask_id] = numpy.ndarray(shape=(num_sub_runs, two_theta_array.shape[0]),
+                                                        dtype=variances_matrix.dtype)
+        elif mask_id not in self._diff_data_set:
+            # A new mask
+            self._diff_data_set[mask_id] = numpy.ndarray(shape=(num_sub_runs, two_theta_array.shape[0]),
+                                                         dtype=intensity_matrix.dtype)
+            self._var_data_set[mask_id] = numpy.ndarray(shape=(num_sub_runs, two_theta_array.shape[0]),
+                                                        dtype=variances_matrix.dtype)
+
+        # Another sanity check on the size of 2theta and intensity
+        if self._2theta_matrix.shape[1] != two_theta_array.shape[0] \
+                or self._diff_data_set[mask_id].shape[1] != two_theta_array.shape[0]:
+            raise RuntimeError('2theta vector are different between parent method set {} and '
+                               'reduction engine returned {}'.format(self._2theta_matrix.shape,
+                                                                     two_theta_array.shape))
+
+        # Get spectrum indexes from sub run numbers
+        spec_ids = self._sample_logs.get_subrun_indices(sub_runs)
+
+        self._2theta_matrix[spec_ids] = two_theta_array
+        self._diff_data_set[mask_id][spec_ids] = intensity_matrix
+        self._var_data_set[mask_id][spec_ids] = variances_matrix
+
     def set_sample_log(self, log_name, sub_runs, log_value_array, units=''):
         """Set sample log value for each sub run, i.e., average value in each sub run
 
@@ -856,7 +1120,8 @@ class HidraWorkspace:
         """
         self._sample_logs.subruns = sorted(sub_runs)
 
-    def save_experimental_data(self, hidra_project, sub_runs=None, ignore_raw_counts=False):
+    def save_experimental_data(self, hidra_project, sub_runs=None, ignore_raw_counts=False,
+                               contiguous_counts=False):
         """Save experimental data including raw counts and sample logs to HiDRA project file
 
         Export (aka save) raw detector counts and sample logs from this HidraWorkspace to a HiDRA project file
@@ -871,16 +1136,23 @@ class HidraWorkspace:
             None for exporting all or the specified sub runs
         ignore_raw_counts : bool
             flag to not to export raw counts to file
+        contiguous_counts : bool
+            flag to export raw counts of all the sub runs as one (uncompressed) block, which can be memory mapped
 
         Returns
         -------
         None
         """
         # Add raw counts if it is specified to save
-        if not ignore_raw_counts:
-            for sub_run_i in self._raw_counts.keys():
+        if not ignore_raw_counts and contiguous_counts:
+            export_sub_runs = [sub_run_i for sub_run_i in self._raw_counts_sub_runs()
+                               if sub_runs is None or sub_run_i in sub_runs]
+            # counts are written one sub run at a time to not hold all of them in memory
+            hidra_project.write_raw_counts_block(export_sub_runs, self.get_detector_counts)
+        elif not ignore_raw_counts:
+            for sub_run_i in self._raw_counts_sub_runs():
                 if sub_runs is None or sub_run_i in sub_runs:
-                    hidra_project.append_raw_counts(sub_run_i, self._raw_counts[sub_run_i])
+                    hidra_project.append_raw_counts(sub_run_i, self._get_raw_counts(sub_run_i))
                 else:
                     print('[WARNING] sub run {} is not exported to {}'
                           ''.format(sub_run_i, hidra_project.name))
@@ -890,7 +1162,7 @@ class HidraWorkspace:
         # Add entry for sub runs (first)
         if sub_runs is None:
             # all sub runs
-            sub_runs_array = numpy.array(sorted(self._raw_counts.keys()))
+            sub_runs_array = numpy.array(self._raw_counts_sub_runs())
         elif isinstance(sub_runs, list):
             # convert to ndarray
             sub_runs_array = numpy.array(sub_runs)
@@ -925,6 +1197,12 @@ class HidraWorkspace:
         # Save wave length
         self.save_wavelength(hidra_project)
 
+    def _raw_counts_sub_runs(self):
+        """ Sub runs with raw counts in memory or in project file
+        :return: sorted list
+        """
+        return sorted(set(self._raw_counts.keys()) | self._lazy_sub_runs)
+
     def save_wavelength(self, hidra_project):
         if self._wave_length is not None:
             hidra_project.write_wavelength(self._wave_length)
@@ -944,8 +1222,9 @@ class HidraWorkspace:
         """
 
         checkdatatypes.check_type('HIDRA project file', hidra_project, HidraProjectFile)
+        self._load_lazy_reduced_data()
 
-        if len(self._raw_counts.keys()) == len(sub_runs):
+        if len(self._raw_counts_sub_runs()) == len(sub_runs):
             hidra_project.write_reduced_diffraction_data_set(self._2theta_matrix,
                                                              self._diff_data_set,
                                                              self._var_data_set)
@@ -1023,3 +1302,5 @@ class HidraWorkspace:
 
         """
         self._2theta_matrix = None
+        self._lazy_reduced_masks = list()
+        self._resident_reduced_data.clear()
@@ -2,5 +2,6 @@
 # type: ignore
 from .constants import *
 from .sample_logs import *
+from .sparse_counts import *
 
-__all__ = constants.__all__ + sample_logs.__all__
+__all__ = constants.__all__ + sample_logs.__all__ + sparse_counts.__all__
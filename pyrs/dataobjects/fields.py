@@ -78,7 +78,6 @@ import numpy as np
 from scipy.interpolate import griddata
 from scipy.spatial import cKDTree
 from typing import TYPE_CHECKING, Any, cast, Dict, Iterator, List, Optional, Tuple, Union
-import uncertainties
 from uncertainties import unumpy
 from mantid.simpleapi import mtd, CreateMDWorkspace, BinMD
 from mantid.api import IMDHistoWorkspace
@@ -88,6 +87,7 @@ from pyrs.core.workspaces import HidraWorkspace
 from pyrs.dataobjects.sample_logs import PointList, aggregate_point_lists
 from pyrs.peaks import PeakCollection, PeakCollectionLite  # type: ignore
 from pyrs.projectfile import HidraProjectFile, HidraProjectFileMode  # type: ignore
+from pyrs.utilities.error_propagation import linear_combination
 from .constants import DEFAULT_POINT_RESOLUTION, NOT_MEASURED_NUMPY
 
 # two points in real space separated by less than this amount (in mili meters) are considered the same point
@@ -126,7 +126,9 @@ class ScalarFieldSample:
                  z: Union[List[float], np.ndarray]) -> None:
         all_lengths = [len(values), len(errors), len(x), len(y), len(z)]
         assert len(set(all_lengths)) == 1, 'input lists must all have the same lengths'
-        self._sample = unumpy.uarray(values, errors)
+        # values and errors are kept as float arrays. The uncertainties array is only created on request
+        self._values = np.array(values, dtype=float)
+        self._errors = np.array(errors, dtype=float)
         self._point_list = PointList([x, y, z])
         self._name = name
 
@@ -213,11 +215,11 @@ class ScalarFieldSample:
 
     @property
     def values(self) -> np.ndarray:
-        return unumpy.nominal_values(self.sample)
+        return self._values.copy()
 
     @property
     def errors(self) -> np.ndarray:
-        return unumpy.std_devs(self.sample)
+        return self._errors.copy()
 
     @property
     def sample(self) -> unumpy.uarray:
@@ -228,13 +230,13 @@ class ScalarFieldSample:
         -------
         ~unumpy.array
         """
-        return self._sample
+        return unumpy.uarray(self._values, self._errors)
 
     @sample.setter
     def sample(self, value: np.ndarray) -> None:
-        isinstance(value[0], uncertainties.core.Variable)
-        assert len(value) == len(self._sample)
-        self._sample = value
+        assert len(value) == len(self._values)
+        self._values = unumpy.nominal_values(value)
+        self._errors = unumpy.std_devs(value)
 
     @property
     def point_list(self) -> PointList:
@@ -273,7 +275,8 @@ class ScalarFieldSample:
          and errors) by increasing z, then by increasing y, and finally by increasing x"""
         permutation = self.point_list.argsort()
         self._point_list.sort()  # in-place sort
-        self._sample = self._sample[permutation]
+        self._values = self._values[permutation]
+        self._errors = self._errors[permutation]
 
     def interpolated_sample(self, method: str = 'linear', fill_value: float = float('nan'), keep_nan: bool = True,
                             resolution: float = DEFAULT_POINT_RESOLUTION,
@@ -357,10 +360,10 @@ class ScalarFieldSample:
         ~pyrs.dataobjects.fields.ScalarFieldSample
         """
 
+        indexes = np.asarray(target_indexes, dtype=int)
         subset = {}
         for member in ('values', 'errors', 'x', 'y', 'z'):
-            member_value = getattr(self, member)
-            subset[member] = [member_value[i] for i in target_indexes]
+            subset[member] = np.asarray(getattr(self, member))[indexes]
         return ScalarFieldSample(self.name, subset['values'], subset['errors'],
                                  subset['x'], subset['y'], subset['z'])
 
@@ -423,31 +426,25 @@ class ScalarFieldSample:
         -------
         ~pyrs.dataobjects.fields.ScalarFieldSample
         """
-        def min_error(indexes: List[int]) -> List[int]:
-            r"""Find index of sample point with minimum error of the scalar field"""
-            error_values = np.array(self.errors)[indexes]
-            error_min_index = np.nanargmin(error_values)  # ignore 'nan' values
-            return indexes[error_min_index]  #type: ignore
+        def min_error(cluster_assignments: np.ndarray) -> np.ndarray:
+            r"""Find index of sample point with minimum error of the scalar field in each cluster"""
+            error_values = np.array(self.errors, dtype=float)
+            error_values[np.isnan(error_values)] = np.inf  # ignore 'nan' values
+            # sort by cluster, then by error. Ties keep the lowest index
+            point_indexes = np.lexsort((error_values, cluster_assignments))
+            first_in_cluster = np.r_[True, np.diff(cluster_assignments[point_indexes]) != 0]
+            return point_indexes[first_in_cluster]
         criterion_functions = {'min_error': min_error}
         assert criterion in criterion_functions, f'The criterion must be one of {criterion_functions.keys()}'
 
         # cluster sample points by their mutual distance. Points within a cluster are closer than `resolution`
-        clusters = self.point_list.cluster(resolution=resolution)
-
-        # find the indexes of the aggregated point list that we want to keep, and discard the rest
-        target_indexes = list()
-        # Iterate over the cluster, selecting only one index (one sample point) from each cluster
-        # the clusters are sorted by size
-        for cluster_index, point_indexes in enumerate(clusters):
-            if len(point_indexes) == 1:
-                break  # remaining clusters have all only one index, thus the selection process is irrelevant
-            target_indexes.append(criterion_functions[criterion](point_indexes))
-        # append point indexes from all clusters having only one member
-        if 1 + cluster_index < len(clusters):  # the previous for-loop did not exhaust all the clusters
-            target_indexes.extend([point_indexes[0] for point_indexes in clusters[cluster_index:]])
+        cluster_assignments = self.point_list.cluster_labels(resolution=resolution)
+
+        # find the indexes of the sample points that we want to keep, one from each cluster, and discard the rest
+        target_indexes = criterion_functions[criterion](cluster_assignments)
 
         # create a ScalarFieldSample with the sample points corresponding to the target indexes
-        return self.extract(sorted(target_indexes))  # type: ignore
+        return self.extract(sorted(target_indexes.tolist()))  # type: ignore
 
     def fuse_with(self, other: 'ScalarFieldSample',
                   resolution: float = DEFAULT_POINT_RESOLUTION, criterion: str = 'min_error') -> 'ScalarFieldSample':
@@ -615,22 +612,18 @@ class ScalarFieldSample:
         # combine all points into a single long list with the first points having the lower indices
         all_points = aggregate_point_lists(point_list_extended, self.point_list)
 
-        # cluster all points and sort clusters according to the first index in each cluster
-        clusters = all_points.cluster(resolution=resolution)
-        clusters_sorted = sorted(clusters, key=lambda cluster: cluster[0])
+        # cluster all points, numbering clusters according to the first index in each cluster
+        cluster_assignments = all_points.cluster_labels(resolution=resolution)
+        clusters_count = cluster_assignments.max() + 1
 
         # values and errors of the field extended to `point_list_extended`
-        values = np.full(len(clusters), padding_value, dtype=float)
-        errors = np.full(len(clusters), padding_error, dtype=float)
+        values = np.full(clusters_count, padding_value, dtype=float)
+        errors = np.full(clusters_count, padding_error, dtype=float)
 
         # `all_points` indexes above `offset` are associated with sample points of `self`
         offset = len(point_list_extended)
-        for cluster_index, cluster in enumerate(clusters_sorted):
-            for index_aggregate in cluster:
-                point_list_index = index_aggregate - offset
-                if point_list_index >= 0:
-                    values[cluster_index] = self.values[point_list_index]
-                    errors[cluster_index] = self.errors[point_list_index]
+        values[cluster_assignments[offset:]] = self.values
+        errors[cluster_assignments[offset:]] = self.errors
 
         return ScalarFieldSample(self.name, values, errors,
                                  point_list_extended.vx, point_list_extended.vy, point_list_extended.vz)
@@ -760,66 +753,59 @@ class _StrainField:
         # combine all points into a single long list with the first points having the lower indices
         all_points = aggregate_point_lists(*[strain.point_list for strain in strains_unstacked])
 
-        # cluster all points and sort clusters according to the first index in each cluster
-        clusters = all_points.cluster(resolution=resolution)
-        clusters_sorted = sorted(clusters, key=lambda cluster: cluster[0])
-
-        # New winners lists. Initialize with missing scans and points
-        # There are as many clusters and points in the stacked point list
-        scan_indexes = np.full(len(clusters), SCAN_MISSING_INDEX, dtype=int)
-        point_indexes = np.full(len(clusters), POINT_MISSING_INDEX, dtype=int)
-
-        # We have a pair of winner scan_indexes and point_indexes for every strain to be stacked
-        strains_count = len(strains_unstacked)
-        winners = [[deepcopy(scan_indexes), deepcopy(point_indexes)] for _ in range(strains_count)]
+        # cluster all points, numbering clusters according to the first index in each cluster
+        cluster_assignments = all_points.cluster_labels(resolution=resolution)
+        cluster_sizes = np.bincount(cluster_assignments)
+        clusters_count = len(cluster_sizes)
 
         # Construct array strain_lengths_cumsum, which will tell us the strain associated to a particular
         # sample point from the agregated point lists `all_points`
         # Example:
         #   Three strains with corresponding lengths 4, 5, and 3. Then `all_points` has 4+5+3=12 sample points
         #   Array `strain_lengths_cumsum` is [0, 4, 9].
-        #   For aggregate index 10, we have np.where(strain_lengths_cumsum <= 10)[0][-1] == 2, meaning this
-        #   sample point corresponds to a point in the last strain (the first strain has index 0)
+        #   For aggregate index 10, we have np.searchsorted(strain_lengths_cumsum, 10, side='right') - 1 == 2,
+        #   meaning this sample point corresponds to a point in the last strain (the first strain has index 0)
         strain_lengths = [len(strain) for strain in strains_unstacked]  #type: ignore
         strain_lengths_cumsum = np.concatenate(([0], + np.cumsum(strain_lengths)[:-1]))  #type: ignore
+        strains_count = len(strains_unstacked)
+        aggregate_indexes = np.arange(len(all_points))
+        strains_unstacked_indexes = np.searchsorted(strain_lengths_cumsum, aggregate_indexes, side='right') - 1
+        # Find the point index of the point list of the strain each aggregate sample point belongs to
+        point_indexes_unstacked = aggregate_indexes - strain_lengths_cumsum[strains_unstacked_indexes]
+
+        # Make sure that a cluster can only have one and only point from each strain. Report the first
+        # offending cluster, and in that cluster the first strain with two points
+        multiplicities = np.zeros((clusters_count, strains_count), dtype=int)
+        np.add.at(multiplicities, (cluster_assignments, strains_unstacked_indexes), 1)
+        overlapping = (cluster_sizes > strains_count) | np.any(multiplicities > 1, axis=1)
+        if np.any(overlapping):
+            cluster_index = np.argmax(overlapping)
+            if cluster_sizes[cluster_index] > strains_count:
+                raise RuntimeError('At lest one of the strains has overlapping sample points')
+            raise RuntimeError(f'Strain number {1 + np.argmax(multiplicities[cluster_index] > 1)} '
+                               'has overlapping points')
 
+        # New winners lists. Initialize with missing scans and points
+        # There are as many clusters and points in the stacked point list
+        # We have a pair of winner scan_indexes and point_indexes for every strain to be stacked
         # Fill the winner scan indexes and point indexes of the future stacked strains with info
         # from the winner scan indexes and point indexes of the unstacked strains
-        for cluster_index, cluster in enumerate(clusters_sorted):
-            if len(cluster) > strains_count:
-                raise RuntimeError('At lest one of the strains has overlapping sample points')
-            # Also make sure that a cluster can only have one and only point from each strain
-            multiplicities = [0] * strains_count
-            for index_aggregate in cluster:
-                # Find which unstacked strain this aggregate sample point corresponds to
-                strains_unstacked_index = np.where(strain_lengths_cumsum <= index_aggregate)[0][-1]
-                strain_unstacked = strains_unstacked[strains_unstacked_index]
-                # Make sure that a cluster can only have one and only point from each strain
-                multiplicities[strains_unstacked_index] += 1
-                if max(multiplicities) == 2:
-                    raise RuntimeError(f'Strain number {1 + multiplicities.index(2)} has overlapping points')
-                # Fetch the winner scan_indexes and point_indexes for the stacked version of this unstacked strain
-                scan_indexes, point_indexes = winners[strains_unstacked_index][0], winners[strains_unstacked_index][1]
-                # Find the point index of the point list for object `strain`
-                point_index = index_aggregate - strain_lengths_cumsum[strains_unstacked_index]
-                # Update the winners of the future stacked strain, with info from the winners of the unstacked strain
-                scan_indexes[cluster_index] = strain_unstacked._winners.scan_indexes[point_index]  # type: ignore
-                point_indexes[cluster_index] = strain_unstacked._winners.point_indexes[point_index]  # type: ignore
+        winners = list()
+        for strains_unstacked_index, strain_unstacked in enumerate(strains_unstacked):
+            scan_indexes = np.full(clusters_count, SCAN_MISSING_INDEX, dtype=int)
+            point_indexes = np.full(clusters_count, POINT_MISSING_INDEX, dtype=int)
+            in_strain = strains_unstacked_indexes == strains_unstacked_index
+            clusters, point_index = cluster_assignments[in_strain], point_indexes_unstacked[in_strain]
+            # Update the winners of the future stacked strain, with info from the winners of the unstacked strain
+            strain_winners = strain_unstacked._winners  # type: ignore
+            scan_indexes[clusters] = strain_winners.scan_indexes[point_index]
+            point_indexes[clusters] = strain_winners.point_indexes[point_index]
+            winners.append([scan_indexes, point_indexes])
 
         # Pick the coordinates of the sample points as the average of the coordinates for each cluster
-        # Some of the lines are repeated from the previous loop, but I rather separate out the winners
-        # and coordinate tasks, for clarity
-        coordinates_all_strains = [strain.point_list.coordinates for strain in strains_unstacked]
-        xyzs = list()  # will hold the coordinates of the stacked point list
-        for cluster_index, cluster in enumerate(clusters_sorted):
-            xyz = np.zeros(3)  # aggregate the coordinates of each point in this cluster
-            for index_aggregate in cluster:
-                strains_unstacked_index = np.where(strain_lengths_cumsum <= index_aggregate)[0][-1]
-                coordinates = coordinates_all_strains[strains_unstacked_index]
-                point_index = index_aggregate - strain_lengths_cumsum[strains_unstacked_index]
-                xyz += coordinates[point_index]
-            xyzs.append(xyz / len(cluster))  # geometrical center of the points in this cluster
-        xyzs = np.array(xyzs).T  # type: ignore # shape = (3, number of points)
+        # (the geometrical center of the points in each cluster)
+        xyzs = np.array([np.bincount(cluster_assignments, weights=coordinates) / cluster_sizes
+                         for coordinates in (all_points.vx, all_points.vy, all_points.vz)])  # shape = (3, points)
         point_list_stacked = PointList(xyzs)
 
         # Assemble the stacked strains
@@ -1023,34 +1009,22 @@ class _StrainField:
         multi_scan_strain._point_list, map_points = point_lists[0].calculate_pointlist_map(point_lists[1:], resolution)
 
         # Identify which sample points from the single scans are chosen to represent
-        # each sample point of the multi scan
-        single_scan_winner_indexes = []
-        single_scan_pointlist_winner_indexes = []
-        single_scan_strains_count = len(single_scan_strains)
+        # each sample point of the multi scan. Array `map_points` has shape (multi scan points, single scans)
+        map_points = np.array(map_points, dtype=int).reshape(-1, len(single_scan_strains))
         if criterion == 'min_error':
-            # collect the criterion values from all StrainFieldSingle objects
-            strain_errors = [strain.errors for strain in single_scan_strains]
-
-            def get_cost(single_scan_strain_errors, index):
-                return np.inf if index == POINT_MISSING_INDEX else single_scan_strain_errors[index]
-
-            # loop over each sample point of the multi-scan strain
-            for point_list_index in range(len(multi_scan_strain)):
-                # in principle, each single scan contributes with a cost for this sample point
-                costs = np.zeros(single_scan_strains_count)
-                # loop over all single-scan strains, finding the associated cost
-                for single_scan_index, single_scan_errors in enumerate(strain_errors):
-                    # find the sample point index in the single scan, associated to the sample point
-                    single_scan_point_list_index = map_points[point_list_index][single_scan_index]
-                    costs[single_scan_index] = get_cost(single_scan_errors, single_scan_point_list_index)
-                assert np.all(costs >= 0.0)  # costs are either infinite or positive
-                single_scan_winner_index = np.argmin(costs)  # find the single scan with the smallest cost
-                single_scan_winner_indexes.append(single_scan_winner_index)
-                single_scan_pointlist_winner_indexes.append(map_points[point_list_index][single_scan_winner_index])
-
-            # convert the winners to arrays
-            scan_indexes = np.asarray(single_scan_winner_indexes, dtype=int)
-            point_indexes = np.asarray(single_scan_pointlist_winner_indexes, dtype=int)
+            # in principle, each single scan contributes with a cost for each sample point
+            # the cost is infinite for the single scans missing the sample point
+            costs = np.full(map_points.shape, np.inf)
+            for single_scan_index, strain in enumerate(single_scan_strains):
+                # find the sample point index in the single scan, associated to each sample point
+                single_scan_point_list_indexes = map_points[:, single_scan_index]
+                present = single_scan_point_list_indexes != POINT_MISSING_INDEX
+                costs[present, single_scan_index] = strain.errors[single_scan_point_list_indexes[present]]
+            assert np.all(costs >= 0.0)  # costs are either infinite or positive
+
+            # find the single scan with the smallest cost for each sample point
+            scan_indexes = np.argmin(costs, axis=1)
+            point_indexes = map_points[np.arange(len(map_points)), scan_indexes]
             multi_scan_strain._winners = _StrainField.ChosenSamplePoints(scan_indexes, point_indexes)
         else:
             raise ValueError(f'Unallowed value of criterion="{criterion}"')
@@ -1942,7 +1916,9 @@ class StressField:
         for stress_component in (self.stress11, self.stress22, self.stress33):
             yield stress_component  # type: ignore
 
-    def _initialize_stress_fields(self, stress11: np.ndarray, stress22: np.ndarray, stress33: np.ndarray) -> None:
+    def _initialize_stress_fields(self, stress11: Tuple[np.ndarray, np.ndarray],
+                                  stress22: Tuple[np.ndarray, np.ndarray],
+                                  stress33: Tuple[np.ndarray, np.ndarray]) -> None:
         r"""
         Instantiate ScalarFieldSample objects, to represent the stresses.
 
@@ -1950,18 +1926,17 @@ class StressField:
 
         Parameters
         ----------
-        stress11: np.ndarray
+        stress11: tuple
             Values and errors of the stress along the first direction
-        stress22 np.ndarray
+        stress22: tuple
             Values and errors of the stress along the second direction
-        stress33 np.ndarray
+        stress33: tuple
             Values and errors of the stress along the third direction
         """
-        for stress, attr in zip((stress11, stress22, stress33), ('stress11', 'stress22', 'stress33')):
-            values, errors = unumpy.nominal_values(stress), unumpy.std_devs(stress)
+        for (values, errors), attr in zip((stress11, stress22, stress33), ('stress11', 'stress22', 'stress33')):
             setattr(self, attr, ScalarFieldSample('stress', values, errors, self.x, self.y, self.z))
 
-    def _calc_stress_components(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    def _calc_stress_components(self) -> Tuple[Tuple[np.ndarray, np.ndarray], ...]:
         r"""
         Calculate the values and errors for each of the diagonal stress fields
 
@@ -1983,10 +1958,13 @@ class StressField:
 
         where :math:`E` is Young's modulus, and :math:`\nu` is Poisson's ratio/
 
+        The strains along the three directions are independent, such that the errors are propagated
+        in closed form for uncorrelated variables.
+
         Returns
         -------
         list
-            Each item is a ~unumpy.array object, corresponding to the values and error for one of the stress fields
+            Each item is a tuple of the values and errors for one of the stress fields
         """  # noqa: E501
         youngs_modulus, poisson_ratio = self.youngs_modulus, self.poisson_ratio
         # If strain in microstrain and youngs_modulus in GPa, `to_mega_pascal` ensures
@@ -1994,27 +1972,33 @@ class StressField:
         to_mega_pascal = 1.0e-03
         prefactor = to_mega_pascal * youngs_modulus / (1 + poisson_ratio)
 
-        strain11: unumpy.uarray = self._strain11.sample
-        strain22: unumpy.uarray = self._strain22.sample
-        sample_zero = unumpy.uarray(np.zeros(self.size, dtype=float), np.zeros(self.size, dtype=float))
+        strain11 = self._strain11.field
+        strain22 = self._strain22.field
+        sample_zero = np.zeros(self.size, dtype=float)
 
         # fill in the correct value for the strain in the 33-direction
+        values = [strain11.values, strain22.values, sample_zero]
+        errors = [strain11.errors, strain22.errors, sample_zero]
         if self.stress_type == StressType.DIAGONAL:
-            strain33: unumpy.uarray = self._strain33.sample
-        else:
-            strain33 = sample_zero  # this even for StressType.IN_PLANE_STRESS
+            strain33 = self._strain33.field
+            values[2], errors[2] = strain33.values, strain33.errors
+        # else strain33 is zero, this even for StressType.IN_PLANE_STRESS
 
-        # calculate the additive trace
+        # coefficient of the additive trace
         f = 1.0 if self.stress_type == StressType.IN_PLANE_STRESS else 2.0
-        additive = poisson_ratio * (strain11 + strain22 + strain33) / (1 - f * poisson_ratio)
+        additive = poisson_ratio / (1 - f * poisson_ratio)
+
+        # Calculate the stresses as linear combinations of the strains
+        def stress_component(direction):
+            coefficients = [prefactor * (additive + (1.0 if i == direction else 0.0)) for i in range(3)]
+            return linear_combination(coefficients, values, errors)
 
-        # Calculate the stresses
-        stress11 = prefactor * (strain11 + additive)
-        stress22 = prefactor * (strain22 + additive)
+        stress11 = stress_component(0)
+        stress22 = stress_component(1)
         if self.stress_type in (StressType.DIAGONAL, StressType.IN_PLANE_STRAIN):
-            stress33 = prefactor * (strain33 + additive)
+            stress33 = stress_component(2)
         elif self.stress_type == StressType.IN_PLANE_STRESS:
-            stress33 = sample_zero
+            stress33 = (sample_zero, sample_zero)
         else:
             raise ValueError('Cannot calculate stress of type {}'.format(self.stress_type))
 
@@ -2063,8 +2047,9 @@ class StressField:
         ~pyrs.dataobjects.fields.StrainField
         """
         factor = self.poisson_ratio / (self.poisson_ratio - 1)
-        strain33 = factor * (self._strain11.sample + self._strain22.sample)  # unumpy.array
-        values, errors = unumpy.nominal_values(strain33), unumpy.std_devs(strain33)  # units are microstrain
+        strain11, strain22 = self._strain11.field, self._strain22.field
+        values, errors = linear_combination([factor, factor], [strain11.values, strain22.values],
+                                            [strain11.errors, strain22.errors])  # units are microstrain
         peaks = PeakCollectionLite(str(StressType.IN_PLANE_STRESS), values, errors, strain_units='microstrain')
         return StrainField(peak_collection=peaks, point_list=PointList([self.x, self.y, self.z]))  # type: ignore
 
@@ -2084,7 +2069,7 @@ class StressField:
 
     def update_stress_calculation(self):
         # update stress values now that strains have been updated
-        stress11, stress22, stress33 = self._calc_stress_components()  # returns unumpy.array objects
+        stress11, stress22, stress33 = self._calc_stress_components()  # returns (values, errors) tuples
         self._initialize_stress_fields(stress11, stress22, stress33)
 
     @property
@@ -2172,11 +2157,9 @@ class StressField:
 
     @youngs_modulus.setter
     def youngs_modulus(self, value: float) -> None:
-        # Update the stress components
-        for stress_component in self:
-            stress_component.sample *= value / self._youngs_modulus
-        # Update the stored young modulus
+        # Update the stored young modulus and the stress components
         self._youngs_modulus = value
+        self.update_stress_calculation()
 
     @property
     def poisson_ratio(self) -> float:
@@ -2357,23 +2340,12 @@ def stack_scalar_field_samples(*fields,
     # less than `resolution` distance, we have to discard all but one of them.
     fields = tuple([field.coalesce(resolution) for field in fields])
 
-    fields_count, fields_indexes = len(fields), list(range(len(fields)))
-
-    # We are going to aggregate the sample points for all the input fields. An index,
-    # `aggregated_point_index`, will index all these aggregated points. Thus, each
-    # point will have two indexes associated. Index `point_index` will identify the point
-    # in the list of points associated to a particular input field.
-    # For every aggregated point, we want to remember which input field it came from. Index
-    # field_index will identify the input field within list `fields`.
-    #
-    # List `field_point_index_pair` will give us the `field_index` and the `point_index`
-    # for every `aggregated_point_index`.
-    #     field_point_index_pair[aggregated_point_index] == (field_index, point_index)
-    field_point_index_pair = list()
-    current_field_index = 0
-    for field in fields:
-        field_point_index_pair.extend([(current_field_index, i) for i in range(len(field))])
-        current_field_index += 1
+    fields_count = len(fields)
+
+    # We are going to aggregate the sample points for all the input fields. For every aggregated point,
+    # we want to remember which input field it came from. Array `field_indexes` will identify the input
+    # field within list `fields`. The points of each field are contiguous and in the order of the field.
+    field_indexes = np.repeat(np.arange(fields_count), [len(field) for field in fields])
     # aggregate the sample points from all scalar fields
     aggregated_points = aggregate_point_lists(*[field.point_list for field in fields])
 
@@ -2388,41 +2360,29 @@ def stack_scalar_field_samples(*fields,
     # at the common point.
     # If the cluster is missing a point from one (or more) of the input fields, and we have selected
     # `stack_mode=complete`, then we assign a value of`nan` to those fields not present in the cluster.
-    clusters = aggregated_points.cluster(resolution=resolution)
-
-    field_values: List[List] = [[] for _ in fields_indexes]  # measurements of each field at the common points
-    field_errors: List[List] = [[] for _ in fields_indexes]  # shape = (input fields, aggregated points)
-    x, y, z = [], [], []  # coordinates of the common points
-    # Process one cluster at a time. Clusters are returned as a list, with biggest cluster the first and smallest
-    # cluster the last one. Each item (each cluster) in a list of aggregated point indexes, representing
-    # the points within the cluster
-    for aggregated_indexes in clusters:
-        # if we selected stack_mode='common' and the cluster is missing at least one point from an input field,
-        # then the common point is not common to all fields, so we discard the point
-        if stack_mode == 'intersection' and len(aggregated_indexes) < fields_count:
-            break  # common point not common to all fields. Discard and go to the next cluster
-        # Here we either selected stack_mode=complete or the common point is common to all input fields
-        cluster_x, cluster_y, cluster_z = 0, 0, 0  # cluster's common point coordinates
-        # initialize the measurements of the input fields in this cluster as 'nan'
-        fields_value_in_cluster = [float('nan')] * fields_count
-        fields_error_in_cluster = [float('nan')] * fields_count
-        # Look up each point within this cluster, finding out the value of each input field.
-        for aggregated_index in aggregated_indexes:
-            field_index, point_index = field_point_index_pair[aggregated_index]
-            field = fields[field_index]  # input field associated to the field_index
-            fields_value_in_cluster[field_index] = field.values[point_index]  # update the list of measurments
-            fields_error_in_cluster[field_index] = field.errors[point_index]
-            cluster_x += field.x[point_index]
-            cluster_y += field.y[point_index]
-            cluster_z += field.z[point_index]
-        # Now we have the coordinates of the common point as well as measurements for all the input fields
-        # to be associated to the common point. We update the appropriate lists to store this information
-        for field_index in fields_indexes:
-            field_values[field_index].append(fields_value_in_cluster[field_index])
-            field_errors[field_index].append(fields_error_in_cluster[field_index])
-        x.append(cluster_x / len(aggregated_indexes))
-        y.append(cluster_y / len(aggregated_indexes))
-        z.append(cluster_z / len(aggregated_indexes))
-
-    # For each input field we now have a new, stacked, field. This field is measured at the common points
-    return [ScalarFieldSample(fields[i].name, field_values[i], field_errors[i], x, y, z) for i in fields_indexes]
+    cluster_assignments = aggregated_points.cluster_labels(resolution=resolution)
+    cluster_sizes = np.bincount(cluster_assignments)
+    # The common points are ordered as the clusters returned by PointList.cluster, with biggest cluster
+    # the first and smallest cluster the last one
+    cluster_order = np.argsort(-cluster_sizes, kind='stable')
+    # if we selected stack_mode='common' and the cluster is missing at least one point from an input field,
+    # then the common point is not common to all fields, so we discard the point
+    if stack_mode == 'intersection':
+        cluster_order = cluster_order[cluster_sizes[cluster_order] >= fields_count]
+
+    # coordinates of the common points
+    x, y, z = [(np.bincount(cluster_assignments, weights=coordinates) / cluster_sizes)[cluster_order]
+               for coordinates in (aggregated_points.vx, aggregated_points.vy, aggregated_points.vz)]
+
+    # For each input field we now have a new, stacked, field. This field is measured at the common points,
+    # with 'nan' for the common points missing a sample point of the field
+    stacked_fields = list()
+    for field_index, field in enumerate(fields):
+        in_field = field_indexes == field_index
+        values = np.full(len(cluster_sizes), np.nan)
+        errors = np.full(len(cluster_sizes), np.nan)
+        values[cluster_assignments[in_field]] = field.values
+        errors[cluster_assignments[in_field]] = field.errors
+        stacked_fields.append(ScalarFieldSample(field.name, values[cluster_order], errors[cluster_order], x, y, z))
+
+    return stacked_fields
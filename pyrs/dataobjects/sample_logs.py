@@ -1,7 +1,8 @@
 # extentable version of dict https://treyhunner.com/2019/04/why-you-shouldnt-inherit-from-list-and-dict-in-python/
 from collections.abc import Iterable, MutableMapping
 import numpy as np
-from scipy.cluster.hierarchy import fclusterdata
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from scipy.spatial import cKDTree
 from typing import Optional, Union, List, NamedTuple, Tuple
 from pyrs.utilities.convertdatatypes import to_int
@@ -931,17 +932,45 @@ class PointList:
         -------
         list
         """
-        # fclusterdata returns a vector T of length equal to the number of points. T[i] is the cluster number to
-        # which point i belongs. Notice that cluster numbers begin at 1, not 0.
-        cluster_assignments = fclusterdata(self.coordinates, resolution, criterion='distance', method='single')
-        # variable `clusters` is a list of lists, each list-item containing the point-list indexes for one cluster
-        clusters: List[List] = [[] for _ in range(max(cluster_assignments))]
-        for point_index, cluster_number in enumerate(cluster_assignments):
-            clusters[cluster_number - 1].append(point_index)
-        # Sort the clusters by size (i.e, sort the list items by list length)
-        clusters = sorted(clusters, key=lambda x: len(x), reverse=True)
-        # Sort the points indexes within each cluster according to increasing index
-        return [sorted(indexes) for indexes in clusters]
+        cluster_assignments = self.cluster_labels(resolution=resolution)
+        cluster_sizes = np.bincount(cluster_assignments)
+        # point indexes grouped by cluster, each group sorted by increasing index
+        point_indexes = np.argsort(cluster_assignments, kind='stable')
+        clusters = np.split(point_indexes, np.cumsum(cluster_sizes)[:-1])
+        # Sort the clusters by size. Clusters of the same size remain sorted by their first index
+        cluster_order = np.argsort(-cluster_sizes, kind='stable')
+        return [clusters[cluster_number].tolist() for cluster_number in cluster_order]
+
+    def cluster_labels(self, resolution: float = DEFAULT_POINT_RESOLUTION) -> np.ndarray:
+        r"""
+        Cluster number of each point, clustering the points according to mutual euclidean distance.
+
+        Two points are in the same cluster if they are connected through a chain of points, each closer
+        than `resolution` to the next. Clusters are numbered from zero by increasing index of their first point.
+        The pairs of close points are found with a KD-tree, thus memory and time scale with the number of
+        points and pairs rather than with the square of the number of points.
+
+        Parameters
+        ----------
+        resolution: float
+            Two points are considered the same if they are separated by a distance smaller than this quantity
+
+        Returns
+        -------
+        numpy.ndarray
+            Array of integers with shape (number_points,)
+        """
+        points_count = len(self)
+        pairs = self._close_pairs(resolution)
+        adjacency = coo_matrix((np.ones(len(pairs), dtype=bool), (pairs[:, 0], pairs[:, 1])),
+                               shape=(points_count, points_count))
+        # components are labelled in the order of their first point
+        _, cluster_assignments = connected_components(adjacency, directed=False)
+        return cluster_assignments
+
+    def _close_pairs(self, resolution: float) -> np.ndarray:
+        r"""Pairs of point-list indexes, with shape (number_pairs, 2), of the points closer than `resolution`"""
+        return cKDTree(self.coordinates).query_pairs(resolution, output_type='ndarray')
 
     def has_overlapping_points(self, resolution: float = DEFAULT_POINT_RESOLUTION) -> bool:
         r"""
@@ -956,10 +985,7 @@ class PointList:
         -------
         bool
         """
-        largest_cluster = self.cluster(resolution=resolution)[0]  # the first cluster is the largest
-        if len(largest_cluster) > 1:
-            return True
-        return False
+        return len(self._close_pairs(resolution)) > 0
 
     def intersection_aggregated_indexes(self, other: 'PointList',
                                         resolution: float = DEFAULT_POINT_RESOLUTION) -> List:
@@ -981,14 +1007,10 @@ class PointList:
         list
         """
         all_points = self.aggregate(other)
-        clusters = all_points.cluster(resolution=resolution)
-        # Find the clusters having more than one index. These clusters contain common elements
-        points_common_indexes = list()
-        for point_indexes in clusters:
-            if len(point_indexes) == 1:
-                break
-            points_common_indexes.extend(point_indexes)
-        return sorted(points_common_indexes)
+        cluster_assignments = all_points.cluster_labels(resolution=resolution)
+        # Find the points of the clusters having more than one index. These clusters contain common elements
+        cluster_sizes = np.bincount(cluster_assignments)
+        return np.flatnonzero(cluster_sizes[cluster_assignments] > 1).tolist()
 
     def intersection(self, other: 'PointList', resolution: float = DEFAULT_POINT_RESOLUTION) -> 'PointList':
         r"""
@@ -1035,14 +1057,13 @@ class PointList:
         """
         # combine all points into a single long list with the first points having the lower indices
         all_points = self.aggregate(other)
-        # create clusters of all points that are within ``resolution`` distance of each other
-        clusters = all_points.cluster(resolution=resolution)
-
         if single_value:
-            # Pick only the first point out of each cluster
-            return sorted([point_indexes[0] for point_indexes in clusters])
+            # create clusters of all points that are within ``resolution`` distance of each other
+            # and pick only the first point out of each cluster. Clusters are numbered by their first point
+            cluster_assignments = all_points.cluster_labels(resolution=resolution)
+            return np.unique(cluster_assignments, return_index=True)[1].tolist()
         else:
-            return sorted(clusters)
+            return sorted(all_points.cluster(resolution=resolution))
 
     def fuse_with(self, other: 'PointList', resolution: float = DEFAULT_POINT_RESOLUTION) -> 'PointList':
         r"""
@@ -1111,16 +1132,18 @@ class PointList:
 
         point_list_aggregated = self.aggregate(point_list)
         # Each cluster should contain two indices of the aggregated point list, the first index
-        # also being an index of point list `self`. Function `sorted()` below will sort the clusters
-        # according to the value of this first index within each cluster
-        clusters = sorted(point_list_aggregated.cluster())
+        # also being an index of point list `self`. Clusters are numbered according to the value
+        # of this first index within each cluster
+        cluster_assignments = point_list_aggregated.cluster_labels()
         # Each cluster should contain two indices of the aggregated list
-        populations = [len(cluster) for cluster in clusters]
-        assert np.all(np.array(populations) == 2), 'No one-to-one correspondence between sample points'
+        populations = np.bincount(cluster_assignments)
+        assert np.all(populations == 2), 'No one-to-one correspondence between sample points'
+        # rows of (first index, second index) of each cluster, sorted by cluster number
+        clusters = np.argsort(cluster_assignments, kind='stable').reshape(-1, 2)
         # `sample_points_count` is a shift taking us from indices of the aggregated point list to indices
         # of `point_list`
         sample_points_count = len(self)
-        return np.array([cluster[1] - sample_points_count for cluster in clusters], dtype=int)
+        return (clusters[:, 1] - sample_points_count).astype(int)
 
     def calculate_pointlist_map(self,
                                 point_lists: List['PointList'],
@@ -1157,17 +1180,19 @@ class PointList:
         point_lists.insert(0, self)  # insert self to the beginning to treat it generically
 
         # calculate the clustering of all points
-        # variable `cluster_indices` is a list with as many elements as clusters. Each list element represents one
-        # cluster, and is made up of a list of point-list indexes, specifying the sample points belonging to the
-        # cluster.
-        # TODO why call `sorted`? Seems irrelevant in this algorithm
-        cluster_indices = sorted(full_point_list.cluster(resolution=resolution))
+        # variable `cluster_assignments` has the cluster number of each point of the aggregated point list.
+        # Clusters are numbered according to the first aggregate index within each cluster
+        cluster_assignments = full_point_list.cluster_labels(resolution=resolution)
+        cluster_sizes = np.bincount(cluster_assignments)
 
         # create a list of which aggregate index starts each contributing PointList
         point_list_starts = list(np.cumsum([len(point_list) for point_list in point_lists]))
         point_list_starts.insert(0, 0)  # pointlist start at index=0
 
-        merged_positions = []  # average position of the sample points contained in each cluster
+        # new position is the average of all the contributing points
+        x_array, y_array, z_array = [np.bincount(cluster_assignments, weights=coordinates) / cluster_sizes
+                                     for coordinates in (full_point_list.vx, full_point_list.vy, full_point_list.vz)]
+
         # variable `full_clusters`:
         #     - is a list, with an item per cluster (or per point of the aggregated point list)
         #     - each item is a list of length `num_point_lists`
@@ -1176,48 +1201,32 @@ class PointList:
         # Individual point lists indexes are [0, 1, 2] and [0, 1] for the first and second point list.
         #     aggregate indexes then run from zero to four: [0, 1, 2, 3, 4]
         #     the correspondence between aggregate and individual indexes: [0, 1, 2, 3 ,4] --> [0, 1, 2, 0, 1]
-        # cluster_indices = [[0, 3], [1], [2, 4]]  three clusters, first and last have contributions for all lists
+        # cluster_assignments = [0, 1, 2, 0, 2]  three clusters, first and last have contributions for all lists
         # full_clusters = [[0, 0], [1, -1], [2, 1]]  second cluster is missing a point from the second list
-        full_clusters = []
+        # a "full cluster" has an aggregate index for each PointList, otherwise some of the entries
+        # will remain with a value of MISSING_INDEX
         num_point_lists = len(point_lists)  # number of input PointList instances
-        for i, cluster in enumerate(cluster_indices):
-            # make sure the aggregate indices in list `cluster` are sorted, from lowest to highest
-            cluster = sorted(cluster)  # variable `cluster` is a list of aggregate indices
-
-            # new position is the average of all the contributing points
-            x = np.average(full_point_list.vx[cluster])
-            y = np.average(full_point_list.vy[cluster])
-            z = np.average(full_point_list.vz[cluster])
-
-            # variable `full_cluster` is a 1D array of length `num_point_lists`
-            # a "full cluster" has an aggregate index for each PointList, otherwise some of the entries in
-            # `full_cluster` will remain with a value of MISSING_INDEX
-            full_cluster = np.full(num_point_lists, self.MISSING_INDEX, dtype=int)
-
-            # convert each index of the aggregated point list into the index of the individual point list it's
-            # associated with.
-            # for every aggregate index of `cluster`, find where in `point_list_startst` should be inserted in
-            # order to preserve the order of `point_list_starts`. This identifies which point list the aggregate
-            # index belongs to.
-            # Example: If I have three lists of lengths 3, 5, and 2, then `point_list_starts==[0, 3, 8]`. Then
-            # np.searchsorted(point_list_starts, [2, 4, 9], side='right') == [1, 2, 3] indicating that
-            # aggregated point 2 corresponds to the first point list, point 4 corresponds to the second list, and
-            # point 9 corresponds to the third list
-            pointlist_indexes = np.searchsorted(point_list_starts, cluster, side='right') - 1  # -1, number-->index
-
-            for pointlist_index, aggregate_index in zip(pointlist_indexes, cluster):
-                # TODO if we have two sample points within resolution in the same point list, then
-                # TODO we will write to full_cluster[pointlist_index] twice, thus loosing one of the two points
-                # TODO instrument scientist confirm this possibility flags a problem with the motors
-                full_cluster[pointlist_index] = int(aggregate_index - point_list_starts[pointlist_index])
-
-            merged_positions.append((x, y, z))
-            full_clusters.append(full_cluster)
-
-        # prepare to convert x,y,z triplets into a PointList
-        x_array, y_array, z_array = np.asarray(merged_positions).transpose()
-
-        return PointList([x_array, y_array, z_array]), full_clusters
+        full_clusters = np.full((len(cluster_sizes), num_point_lists), self.MISSING_INDEX, dtype=int)
+
+        # convert each index of the aggregated point list into the index of the individual point list it's
+        # associated with.
+        # for every aggregate index, find where in `point_list_starts` should be inserted in
+        # order to preserve the order of `point_list_starts`. This identifies which point list the aggregate
+        # index belongs to.
+        # Example: If I have three lists of lengths 3, 5, and 2, then `point_list_starts==[0, 3, 8]`. Then
+        # np.searchsorted(point_list_starts, [2, 4, 9], side='right') == [1, 2, 3] indicating that
+        # aggregated point 2 corresponds to the first point list, point 4 corresponds to the second list, and
+        # point 9 corresponds to the third list
+        aggregate_indexes = np.arange(len(full_point_list))
+        pointlist_indexes = np.searchsorted(point_list_starts, aggregate_indexes, side='right') - 1  # number-->index
+
+        # TODO if we have two sample points within resolution in the same point list, then
+        # TODO we will write to full_clusters[cluster, pointlist_index] twice, keeping the last of the two points
+        # TODO instrument scientist confirm this possibility flags a problem with the motors
+        full_clusters[cluster_assignments, pointlist_indexes] = \
+            aggregate_indexes - np.asarray(point_list_starts)[pointlist_indexes]
+
+        return PointList([x_array, y_array, z_array]), list(full_clusters)
 
     def get_indices(self, other: 'PointList',
                     resolution: float = DEFAULT_POINT_RESOLUTION) -> np.ndarray:
@@ -1241,10 +1250,7 @@ class PointList:
             _, full_indices = self.calculate_pointlist_map([other], resolution=resolution)
 
             # get the second item of each cluster as that is the index into the "other" PointList
-            indices = np.full(len(full_indices), self.MISSING_INDEX, dtype=int)
-            for i, index in enumerate(full_indices):
-                indices[i] = index[1]
-            return indices[:len(self)]
+            return np.array(full_indices, dtype=int)[:len(self), 1]
 
     def extents(self, resolution=DEFAULT_POINT_RESOLUTION) -> ExtentTriad:
         r"""
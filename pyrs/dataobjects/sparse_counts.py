@@ -0,0 +1,92 @@
+import numpy as np
+from pyrs.utilities.convertdatatypes import to_int
+
+__all__ = ['SparseCounts']
+
+
+class SparseCounts:
+    r"""
+    Detector counts of a sub run stored as (pixel ID, count) pairs of the pixels with counts
+
+    Short sub runs and low flux samples leave most of the detector pixels without counts, such that the pairs
+    take a small fraction of the memory of the counts of all the pixels.
+
+    Parameters
+    ----------
+    pixel_ids: np.ndarray
+        sorted IDs of the pixels with counts
+    counts: np.ndarray
+        counts of the pixels
+    num_pixels: int
+        number of pixels of the detector
+    """
+
+    def __init__(self, pixel_ids, counts, num_pixels):
+        self._num_pixels = to_int('Number of pixels', num_pixels, min_value=1)
+        pixel_ids = np.asarray(pixel_ids)
+        counts = np.asarray(counts)
+        if pixel_ids.ndim != 1 or pixel_ids.shape != counts.shape:
+            raise RuntimeError('Pixel IDs of shape {} and counts of shape {} shall be 1D arrays of the same shape'
+                               ''.format(pixel_ids.shape, counts.shape))
+        if pixel_ids.size > 0 and (pixel_ids[0] < 0 or pixel_ids[-1] >= self._num_pixels
+                                   or np.any(np.diff(pixel_ids) <= 0)):
+            raise RuntimeError('Pixel IDs shall be sorted, unique and within [0, {})'.format(self._num_pixels))
+
+        self._pixel_ids = pixel_ids
+        self._counts = counts
+
+    @staticmethod
+    def from_dense(counts_array):
+        r"""
+        Sparse counts of the pixels with non-zero counts
+
+        Parameters
+        ----------
+        counts_array: np.ndarray
+            counts of all the pixels
+
+        Returns
+        -------
+        ~pyrs.dataobjects.sparse_counts.SparseCounts
+        """
+        counts_array = np.asarray(counts_array).reshape(-1)
+        pixel_ids = np.flatnonzero(counts_array)
+
+        return SparseCounts(pixel_ids, counts_array[pixel_ids], counts_array.size)
+
+    @property
+    def pixel_ids(self):
+        r"""IDs of the pixels with counts"""
+        return self._pixel_ids
+
+    @property
+    def counts(self):
+        r"""Counts of the pixels with counts"""
+        return self._counts
+
+    @property
+    def num_pixels(self):
+        r"""Number of pixels of the detector"""
+        return self._num_pixels
+
+    @property
+    def dtype(self):
+        r"""Type of the counts"""
+        return self._counts.dtype
+
+    def __len__(self):
+        r"""Number of pixels with counts"""
+        return self._pixel_ids.size
+
+    def to_dense(self):
+        r"""
+        Counts of all the pixels
+
+        Returns
+        -------
+        np.ndarray
+        """
+        counts_array = np.zeros(self._num_pixels, dtype=self._counts.dtype)
+        counts_array[self._pixel_ids] = self._counts
+
+        return counts_array
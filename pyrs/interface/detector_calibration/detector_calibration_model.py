@@ -1,3 +1,4 @@
+import os
 import numpy as np
 from qtpy.QtCore import Signal, QObject  # type:ignore
 from pyrs.calibration.mantid_peakfit_calibration import FitCalibration
@@ -15,6 +16,9 @@ class DetectorCalibrationModel(QObject):
         self._run_number = None
         self._calibration_obj = None
         self._nexus_file = None
+        self._checkpoint = None
+        self._checkpoint_interval = None
+        self._resume = False
 
         self.detector_params = [0, 0, 0, 0, 0, 0, 0, 0]
         # self.sub_runs = np.array([1])
@@ -81,12 +85,19 @@ class DetectorCalibrationModel(QObject):
             return np.sqrt((residual**2).sum() / residual.shape[0]), residual.sum()
 
     def get_calibration_values(self, x_item, y_item):
+        calibration_history = self._calibration_obj.calibration_history
         if x_item == 0:
-            _x = np.arange(self._calibration_obj._calibration.shape[1] - 1)
+            _x = np.arange(calibration_history.shape[1] - 1)
         else:
-            _x = self._calibration_obj._calibration[x_item - 1, 1:]
+            _x = calibration_history[x_item - 1, 1:]
 
-        return _x, self._calibration_obj._calibration[y_item, 1:]
+        return _x, calibration_history[y_item, 1:]
+
+    def set_checkpoint(self, file_name, interval=None):
+        """Write checkpoints of the detector calibration, which is resumed from file_name if it exists"""
+        self._checkpoint = file_name
+        self._checkpoint_interval = interval
+        self._resume = file_name is not None and os.path.exists(file_name)
 
     def calibrate_detector(self, fit_recipe):
 
@@ -94,7 +105,24 @@ class DetectorCalibrationModel(QObject):
             # self._calibration_obj.initalize_calib_results()
             calibration = []
             calibration_error = []
-            for recipe in fit_recipe:
+
+            fit_recipe = [recipe for recipe in fit_recipe if recipe != '']
+            self._calibration_obj.reset_stages()
+            if self._resume:
+                # resume only once: the next calibration starts from the first stage again
+                self._resume = False
+                completed = self._calibration_obj.load_checkpoint(self._checkpoint)
+                if completed != fit_recipe[:len(completed)]:
+                    raise RuntimeError('Checkpoint {} was written for recipe {}, not {}'.format(
+                        self._checkpoint, completed, fit_recipe))
+            self._calibration_obj.set_checkpoint(self._checkpoint, self._checkpoint_interval)
+
+            # stages restored from the checkpoint are not refined again
+            for stage_calibration, stage_error in self._calibration_obj.stage_results:
+                calibration.append(stage_calibration)
+                calibration_error.append(stage_error)
+
+            for recipe in fit_recipe[len(calibration):]:
                 if recipe == "wavelength":
                     self._calibration_obj.calibrate_wave_length()
                 elif recipe == "rotations":
@@ -116,9 +144,9 @@ class DetectorCalibrationModel(QObject):
                 elif recipe == 'tth0':
                     self._calibration_obj.calibrate_tth0()
 
-                if recipe != '':
-                    calibration.append(np.copy(self._calibration_obj.calibration_array))
-                    calibration_error.append(np.copy(self._calibration_obj.calibration_error_array))
+                self._calibration_obj.complete_stage(recipe)
+                calibration.append(np.copy(self._calibration_obj.calibration_array))
+                calibration_error.append(np.copy(self._calibration_obj.calibration_error_array))
 
             try:
                 return calibration, calibration_error, self._calibration_obj.residual_sum, \
@@ -11,8 +11,13 @@ class FitEngineFactory:
     """
     @staticmethod
     def getInstance(hidraworkspace, peak_function_name, background_function_name,
-                    wavelength, out_of_plane_angle=None, engine_name='mantid'):
+                    wavelength, out_of_plane_angle=None, engine_name='mantid', warm_start=False,
+                    peak_at_maximum=False):
         """Get instance of Peak fitting engine
+
+        Warm-started fitting of neighbouring sub runs is only supported by the numpy engine.
+        Starting peaks at the maximum of the data only applies to the numpy engine, as Mantid estimates
+        the peak parameters from the data.
         """
         engine_name = str(engine_name).lower()
 
@@ -20,7 +25,14 @@ class FitEngineFactory:
         from .mantid_fit_peak import MantidPeakFitEngine
 
         if engine_name == 'mantid':
+            if warm_start:
+                raise RuntimeError('Fit engine "mantid" does not support warm start')
             return MantidPeakFitEngine(hidraworkspace, peak_function_name, background_function_name,
                                        wavelength=wavelength, out_of_plane_angle=out_of_plane_angle)
+        elif engine_name == 'numpy':
+            from .numpy_fit_peak import NumpyPeakFitEngine
+            return NumpyPeakFitEngine(hidraworkspace, peak_function_name, background_function_name,
+                                      wavelength=wavelength, out_of_plane_angle=out_of_plane_angle,
+                                      warm_start=warm_start, peak_at_maximum=peak_at_maximum)
         else:
             raise RuntimeError('Cannot create a fit engine name="{}"'.format(engine_name))
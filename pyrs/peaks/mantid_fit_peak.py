@@ -1,9 +1,10 @@
 from .peak_fit_engine import PeakFitEngine, FitResult
+from pyrs.core import mantid_helper
 from pyrs.core.peak_profile_utility import PeakShape
 from pyrs.peaks import PeakCollection  # type: ignore
 import numpy as np
 from mantid.kernel import Logger
-from mantid.simpleapi import DeleteWorkspace, FitPeaks, RenameWorkspace
+from mantid.simpleapi import CreateWorkspace, DeleteWorkspace, FitPeaks, RenameWorkspace
 
 __all__ = ['MantidPeakFitEngine']
 
@@ -29,6 +30,15 @@ class MantidPeakFitEngine(PeakFitEngine):
         # configure logging for this class
         self._log = Logger(__name__)
 
+        self._mtd_wksp = mantid_helper.generate_mantid_workspace(hidraworkspace, hidraworkspace.name,
+                                                                 out_of_plane_angle)
+
+    def _get_spectrum(self, index):
+        return self._mtd_wksp.readX(index), self._mtd_wksp.readY(index)
+
+    def _get_number_spectra(self):
+        return self._mtd_wksp.getNumberHistograms()
+
     def fit_peaks(self, peak_tag, x_min, x_max):
         '''
 
@@ -41,11 +51,45 @@ class MantidPeakFitEngine(PeakFitEngine):
 
         x_min, x_max = self._check_fit_range(x_min, x_max)
 
+        peak_collection, model_ws = self.__fit_peaks(peak_tag, x_min, x_max, str(self._mtd_wksp))
+
+        # create the difference workspace
+        difference = self._mtd_wksp - model_ws
+        difference = RenameWorkspace(InputWorkspace=difference, OutputWorkspace=peak_tag+'_diff')
+
+        # return the final results
+        return FitResult(peakcollections=(peak_collection,), fitted=model_ws, difference=difference)
+
+    def _fit_peak(self, peak_tag, x_min, x_max):
+        # output workspace names are unique to the peak for the peaks fitted concurrently
+        peak_collection, model_ws = self.__fit_peaks(peak_tag, x_min, x_max,
+                                                     '{0}_{1}'.format(self._mtd_wksp, peak_tag))
+
+        model = model_ws.extractY()
+        DeleteWorkspace(model_ws)
+
+        return peak_collection, model
+
+    def _create_fit_result(self, peakcollections, fitted, fitted_name, difference_name):
+        vec_x = self._mtd_wksp.extractX()
+        difference = CreateWorkspace(DataX=vec_x, DataY=self._mtd_wksp.extractY() - fitted,
+                                     NSpec=fitted.shape[0], OutputWorkspace=difference_name, EnableLogging=False)
+        fitted = CreateWorkspace(DataX=vec_x, DataY=fitted, NSpec=fitted.shape[0],
+                                 OutputWorkspace=fitted_name, EnableLogging=False)
+
+        return FitResult(peakcollections=peakcollections, fitted=fitted, difference=difference)
+
+    def __fit_peaks(self, peak_tag, x_min, x_max, ws_suffix):
+        '''Fit a peak by Mantid FitPeaks
+
+        :param str ws_suffix: suffix of the names of the output workspaces
+        :return: peak collection and workspace of the calculated peaks
+        '''
         # Create output workspace names
-        r_positions_ws_name = 'fitted_peak_positions_{0}'.format(self._mtd_wksp)
-        r_param_table_name = 'param_m_{0}'.format(self._mtd_wksp)
-        r_error_table_name = 'param_e_{0}'.format(self._mtd_wksp)
-        r_model_ws_name = 'model_full_{0}'.format(self._mtd_wksp)
+        r_positions_ws_name = 'fitted_peak_positions_{0}'.format(ws_suffix)
+        r_param_table_name = 'param_m_{0}'.format(ws_suffix)
+        r_error_table_name = 'param_e_{0}'.format(ws_suffix)
+        r_model_ws_name = 'model_full_{0}'.format(ws_suffix)
 
         # estimate the peak center
         peak_center = self._guess_center(x_min, x_max)
@@ -86,13 +130,7 @@ class MantidPeakFitEngine(PeakFitEngine):
         DeleteWorkspace(fit_return.OutputPeakParametersWorkspace)
         DeleteWorkspace(fit_return.OutputParameterFitErrorsWorkspace)
 
-        # create the difference workspace
-        difference = self._mtd_wksp - fit_return.FittedPeaksWorkspace
-        difference = RenameWorkspace(InputWorkspace=difference, OutputWorkspace=peak_tag+'_diff')
-
-        # return the final results
-        return FitResult(peakcollections=(peak_collection,), fitted=fit_return.FittedPeaksWorkspace,
-                         difference=difference)
+        return peak_collection, fit_return.FittedPeaksWorkspace
 
     def __tables_to_peak_collection(self, peak_tag, table_params, table_errors):
         def convert_from_table_to_arrays(table_ws):  # TODO put this in mantid_helper
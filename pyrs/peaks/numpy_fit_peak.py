@@ -0,0 +1,484 @@
+from .peak_fit_engine import PeakFitEngine, FitResult
+from pyrs.core.peak_profile_utility import PeakShape, BackgroundFunction, get_parameter_dtype
+from pyrs.core.peak_profile_utility import Gaussian, PseudoVoigt
+from pyrs.peaks import PeakCollection  # type: ignore
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import breadth_first_order, minimum_spanning_tree
+from scipy.spatial import cKDTree
+
+__all__ = ['NumpyPeakFitEngine', 'FittedSpectra']
+
+# conversion between Gaussian's sigma and FWHM
+SIGMA_TO_FWHM = 2. * np.sqrt(2. * np.log(2.))
+
+
+class FittedSpectra:
+    '''Calculated or difference spectra of all the sub runs with the accessors of the Mantid
+    MatrixWorkspace used by the viewers
+
+    :param str name: name of the spectra
+    :param numpy.ndarray vec_x: x values (2D) of shape (number of sub runs) x (number of points)
+    :param numpy.ndarray vec_y: y values (2D) of the same shape
+    '''
+    def __init__(self, name, vec_x, vec_y):
+        self._name = name
+        self._vec_x = vec_x
+        self._vec_y = vec_y
+
+    def name(self):
+        return self._name
+
+    def getNumberHistograms(self):
+        return self._vec_y.shape[0]
+
+    def readX(self, index):
+        return self._vec_x[index]
+
+    def readY(self, index):
+        return self._vec_y[index]
+
+    def readE(self, index):
+        return np.zeros_like(self._vec_y[index])
+
+    def extractX(self):
+        return self._vec_x
+
+    def extractY(self):
+        return self._vec_y
+
+
+class NumpyPeakFitEngine(PeakFitEngine):
+    '''Peak fitting engine in numpy
+
+    A peak is fitted in all the sub runs at once by Levenberg-Marquardt with the analytic Jacobian of
+    the peak and background functions.  The peak functions are the same as Mantid's, such that
+    the native parameters are the same as the ones of :py:obj:`~pyrs.peaks.mantid_fit_peak.MantidPeakFitEngine`.
+    Parameters' uncertainties are the square roots of the diagonal of the covariance matrix, which is
+    calculated from the uncertainties of the data.
+
+    With warm start, the sub runs are fitted in the order of their proximity of sample positions. Each fit starts
+    from the parameters of the nearest sub run fitted before. Sub runs without a good neighbour fit, or whose
+    warm-started fit fails, start from the guess shared by all the sub runs.
+    '''
+
+    # same as Mantid FitPeaks' MaxFitIterations
+    MAX_ITERATIONS = 500
+    # relative change of chi2 for convergence
+    TOLERANCE = 1.E-10
+    # start and limit of the Levenberg-Marquardt damping factor
+    INITIAL_DAMPING = 1.E-3
+    MAX_DAMPING = 1.E10
+
+    def __init__(self, hidraworkspace, peak_function_name, background_function_name, wavelength,
+                 out_of_plane_angle, warm_start=False, peak_at_maximum=False):
+        super(NumpyPeakFitEngine, self).__init__(hidraworkspace, peak_function_name,
+                                                 background_function_name, wavelength=wavelength,
+                                                 out_of_plane_angle=out_of_plane_angle)
+        '''
+        :param str hidraworkspace: hidraworkspace with detector counts and position
+        :param str peak_function_name: peak shape function for peak fitting (Gaussian or PseudoVoigt)
+        :param str background_function_name: background function for peak fitting (Flat, Linear or Quadratic)
+        :param float wavelength: neutron wavelength used to measure diffraction data
+        :param out_of_plane_angle: out-of-plane angle used for texture analysis
+        :type out_of_plane_angle: float, optional
+        :param bool warm_start: flag to start the fit of each sub run from the result of its nearest neighbour
+        :param bool peak_at_maximum: flag to start the peak of each sub run at the maximum of its data if the data
+            at the center estimated from all the sub runs is less than half of it
+        '''
+        self._name = hidraworkspace.name
+        self._vec_x, self._vec_y, self._vec_e = hidraworkspace.get_reduced_diffraction_data_set(out_of_plane_angle)
+
+        # same as the Mantid engine: no good peak will have NaN
+        self._vec_y[np.isnan(self._vec_y)] = 0.
+        self._vec_e[np.isnan(self._vec_e)] = 0.
+
+        self._param_names = self._peak_function.native_parameters + self._background_function.native_parameters
+        self._peak_at_maximum = peak_at_maximum
+
+        # sub runs fitted together in each step of the warm start and the sub runs they start from
+        self._warm_start_steps = None
+        if warm_start:
+            try:
+                coordinates = hidraworkspace.get_pointlist().coordinates
+            except ValueError as error:
+                self._log.notice('Warm start follows the order of sub runs: {}'.format(error))
+                coordinates = np.arange(self._get_number_spectra(), dtype=float).reshape(-1, 1)
+            self._warm_start_steps = warm_start_steps(*proximity_tree(coordinates))
+
+    def _get_spectrum(self, index):
+        return self._vec_x[index], self._vec_y[index]
+
+    def _get_number_spectra(self):
+        return self._vec_y.shape[0]
+
+    def fit_peaks(self, peak_tag, x_min, x_max):
+        '''
+
+        :param str peak_tag: Id to define peak
+        :param float x_min: min 2theta for peak fitting window
+        :param float x_max: max 2theta for peak fitting window
+        :return: peaks collections of fitting results
+        :rtype: FitResult
+        '''
+        x_min, x_max = self._check_fit_range(x_min, x_max)
+
+        peak_collection, fitted = self._fit_peak(peak_tag, x_min, x_max)
+
+        return self._create_fit_result((peak_collection,), fitted, 'model_full_{}'.format(self._name),
+                                       peak_tag + '_diff')
+
+    def _create_fit_result(self, peakcollections, fitted, fitted_name, difference_name):
+        difference = FittedSpectra(difference_name, self._vec_x, self._vec_y - fitted)
+        fitted = FittedSpectra(fitted_name, self._vec_x, fitted)
+
+        return FitResult(peakcollections=peakcollections, fitted=fitted, difference=difference)
+
+    def _fit_peak(self, peak_tag, x_min, x_max):
+        '''Fit a peak in a window of all the sub runs
+
+        :return: peak collection and calculated peaks (2D), which are zero out of the fit window
+        :rtype: PeakCollection, numpy.ndarray
+        '''
+        # columns covering the fit window of all the sub runs
+        in_window = (self._vec_x >= x_min) & (self._vec_x <= x_max)
+        columns = np.flatnonzero(in_window.any(axis=0))
+        if columns.size == 0:
+            raise RuntimeError('Failed to find requested x-range({} < {}) in data'.format(x_min, x_max))
+        window = slice(columns[0], columns[-1] + 1)
+        vec_x = self._vec_x[:, window]
+        vec_y = self._vec_y[:, window]
+        in_window = in_window[:, window]
+
+        # weights: inverse of uncertainties in fit window and zero elsewhere
+        vec_e = self._vec_e[:, window]
+        weights = np.where(vec_e > 0., 1. / np.where(vec_e > 0., vec_e, 1.), 1.) * in_window
+
+        params = self._estimate_parameters(vec_x, vec_y, in_window, self._guess_center(x_min, x_max))
+        if self._warm_start_steps is None:
+            params, errors, chi2 = self._levenberg_marquardt(vec_x, vec_y, weights, params)
+        else:
+            params, errors, chi2 = self._fit_warm_started(vec_x, vec_y, weights, params, x_min, x_max)
+
+        # convert to structured arrays in the same form as the Mantid engine
+        param_values = np.zeros(params.shape[0], dtype=get_parameter_dtype(self._peak_function,
+                                                                           self._background_function))
+        param_errors = np.zeros(params.shape[0], dtype=param_values.dtype)
+        for index, name in enumerate(self._param_names):
+            param_values[name] = params[:, index]
+            param_errors[name] = errors[:, index]
+
+        peak_collection = PeakCollection(peak_tag=peak_tag, peak_profile=self._peak_function,
+                                         background_type=self._background_function, wavelength=self._wavelength,
+                                         projectfilename=self._project_file_name,
+                                         runnumber=self._runnumber)
+        peak_collection.set_peak_fitting_values(self._subruns, param_values, param_errors, chi2)
+
+        fitted = np.zeros_like(self._vec_y)
+        fitted[:, window] = np.where(in_window, self._calculate(vec_x, params, False)[0], 0.)
+
+        return peak_collection, fitted
+
+    def _fit_warm_started(self, vec_x, vec_y, weights, guess, x_min, x_max):
+        '''Fit the sub runs step by step starting from the results of their neighbours
+
+        :param numpy.ndarray guess: starting parameters (2D) shared by all the sub runs
+        :return: parameters (2D), their uncertainties (2D) and reduced chi2 (1D)
+        '''
+        params = guess.copy()
+        errors = np.zeros_like(guess)
+        chi2 = np.full(guess.shape[0], np.inf)
+        good = np.zeros(guess.shape[0], dtype=bool)
+
+        for rows, neighbours in self._warm_start_steps:
+            # start from the neighbour if its fit is good
+            warm = neighbours >= 0
+            warm[warm] = good[neighbours[warm]]
+            start = guess[rows]
+            start[warm] = params[neighbours[warm]]
+            params[rows], errors[rows], chi2[rows] = self._levenberg_marquardt(vec_x[rows], vec_y[rows],
+                                                                               weights[rows], start)
+            good[rows] = self._is_good_fit(params[rows], chi2[rows], x_min, x_max)
+
+            # fall back to the shared guess for the failed warm-started fits
+            retry = rows[warm & ~good[rows]]
+            if retry.size > 0:
+                params[retry], errors[retry], chi2[retry] = self._levenberg_marquardt(vec_x[retry], vec_y[retry],
+                                                                                      weights[retry], guess[retry])
+                good[retry] = self._is_good_fit(params[retry], chi2[retry], x_min, x_max)
+
+        return params, errors, chi2
+
+    def _is_good_fit(self, params, chi2, x_min, x_max):
+        '''Good fits have finite chi2 and the peak in the fit window'''
+        if self._peak_function == PeakShape.GAUSSIAN:
+            center, width = params[:, 1], params[:, 2]
+        else:
+            center, width = params[:, 2], params[:, 3]
+
+        return np.isfinite(chi2) & (center > x_min) & (center < x_max) & (width > 0.) & (width < x_max - x_min)
+
+    def _estimate_parameters(self, vec_x, vec_y, in_window, center):
+        '''Starting values of the native parameters of all the sub runs
+
+        The background is the line between the ends of the fit window.  The peak starts at the center
+        (estimated from all the sub runs), or optionally at the maximum of the data above background if it is
+        far from the center, with the height and width of the data above background.
+        '''
+        num_spectra = vec_x.shape[0]
+        rows = np.arange(num_spectra)
+        first = in_window.argmax(axis=1)
+        last = in_window.shape[1] - 1 - in_window[:, ::-1].argmax(axis=1)
+        x_left, x_right = vec_x[rows, first], vec_x[rows, last]
+        y_left, y_right = vec_y[rows, first], vec_y[rows, last]
+
+        # background
+        slope = (y_right - y_left) / np.where(x_right > x_left, x_right - x_left, 1.)
+        if self._background_function == BackgroundFunction.FLAT:
+            slope[:] = 0.
+            intercept = 0.5 * (y_left + y_right)
+        else:
+            intercept = y_left - slope * x_left
+        signal = np.where(in_window, vec_y - (intercept[:, np.newaxis] + slope[:, np.newaxis] * vec_x), 0.)
+
+        # peak height: signal at the center or the maximum signal if it is not positive
+        center_index = np.abs(np.where(in_window, vec_x, np.inf) - center).argmin(axis=1)
+        height = signal[rows, center_index]
+        max_index = signal.argmax(axis=1)
+        max_signal = signal[rows, max_index]
+        if self._peak_at_maximum:
+            # the peak is away from the center if the signal there is less than half of the maximum
+            off_center = height < 0.5 * max_signal
+            center = np.where(off_center, vec_x[rows, max_index], center)
+            height = np.where(off_center, max_signal, height)
+        height = np.where(height > 0., height, max_signal)
+        height = np.where(height > 0., height, 1.)
+
+        # FWHM: width of the signal above half height, limited by the fit window
+        bin_width = np.abs(np.diff(vec_x, axis=1)).mean(axis=1) if vec_x.shape[1] > 1 else np.ones(num_spectra)
+        fwhm = np.count_nonzero(signal > 0.5 * height[:, np.newaxis], axis=1) * bin_width
+        window_width = x_right - x_left
+        fwhm = np.where((fwhm > 0.) & (fwhm < 0.5 * window_width), fwhm, window_width / 6.)
+        fwhm = np.where(fwhm > 0., fwhm, 1.)
+
+        params = np.zeros((num_spectra, len(self._param_names)))
+        if self._peak_function == PeakShape.GAUSSIAN:
+            # ['Height', 'PeakCentre', 'Sigma']
+            params[:, 0] = height
+            params[:, 1] = center
+            params[:, 2] = Gaussian.cal_sigma(fwhm)
+        else:
+            # ['Mixing', 'Intensity', 'PeakCentre', 'FWHM'] with the same mixing as the Mantid engine
+            mixing = 0.6
+            params[:, 0] = mixing
+            params[:, 1] = PseudoVoigt.cal_intensity(height, fwhm, mixing)
+            params[:, 2] = center
+            params[:, 3] = fwhm
+
+        # background: A0, A1 and A2
+        num_peak_params = len(self._peak_function.native_parameters)
+        params[:, num_peak_params] = intercept
+        if len(self._background_function.native_parameters) > 1:
+            params[:, num_peak_params + 1] = slope
+
+        return params
+
+    def _calculate(self, vec_x, params, with_jacobian=True):
+        '''Calculate peak plus background and optionally the Jacobian for all the sub runs
+
+        :param numpy.ndarray vec_x: x values (2D) of shape (number of sub runs) x (number of points)
+        :param numpy.ndarray params: native parameters (2D) of shape (number of sub runs) x (number of parameters)
+        :param bool with_jacobian: flag to calculate the Jacobian
+        :return: values (2D) and Jacobian (3D) of shape (number of sub runs) x (number of points)
+            x (number of parameters) or None
+        '''
+        jacobian = None
+        if with_jacobian:
+            jacobian = np.empty(vec_x.shape + (params.shape[1],))
+
+        if self._peak_function == PeakShape.GAUSSIAN:
+            # Mantid Gaussian: Height * exp(-0.5 * ((x - PeakCentre) / Sigma)^2)
+            height, center, sigma = (params[:, index, np.newaxis] for index in range(3))
+            z = (vec_x - center) / sigma
+            gauss = np.exp(-0.5 * z ** 2)
+            values = height * gauss
+            if with_jacobian:
+                jacobian[..., 0] = gauss
+                jacobian[..., 1] = values * z / sigma
+                jacobian[..., 2] = values * z ** 2 / sigma
+            num_peak_params = 3
+        else:
+            # Mantid PseudoVoigt: Intensity * (Mixing * G + (1 - Mixing) * L) with normalized G and L
+            mixing, intensity, center, fwhm = (params[:, index, np.newaxis] for index in range(4))
+            sigma = fwhm / SIGMA_TO_FWHM
+            half_width = 0.5 * fwhm
+            dx = vec_x - center
+            gauss = np.exp(-0.5 * (dx / sigma) ** 2) / (sigma * np.sqrt(2. * np.pi))
+            denominator = dx ** 2 + half_width ** 2
+            lorentz = half_width / (np.pi * denominator)
+            profile = mixing * gauss + (1. - mixing) * lorentz
+            values = intensity * profile
+            if with_jacobian:
+                jacobian[..., 0] = intensity * (gauss - lorentz)
+                jacobian[..., 1] = profile
+                d_gauss_d_center = gauss * dx / sigma ** 2
+                d_lorentz_d_center = lorentz * 2. * dx / denominator
+                jacobian[..., 2] = intensity * (mixing * d_gauss_d_center + (1. - mixing) * d_lorentz_d_center)
+                d_gauss_d_fwhm = gauss * (dx ** 2 / sigma ** 3 - 1. / sigma) / SIGMA_TO_FWHM
+                d_lorentz_d_fwhm = 0.5 * (dx ** 2 - half_width ** 2) / (np.pi * denominator ** 2)
+                jacobian[..., 3] = intensity * (mixing * d_gauss_d_fwhm + (1. - mixing) * d_lorentz_d_fwhm)
+            num_peak_params = 4
+
+        # background: A0 + A1 * x + A2 * x^2
+        for order in range(params.shape[1] - num_peak_params):
+            values = values + params[:, num_peak_params + order, np.newaxis] * vec_x ** order
+            if with_jacobian:
+                jacobian[..., num_peak_params + order] = vec_x ** order
+
+        return values, jacobian
+
+    def _constrain(self, params):
+        '''Keep peak widths positive and PseudoVoigt's mixing between 0 and 1'''
+        if self._peak_function == PeakShape.GAUSSIAN:
+            params[:, 2] = np.abs(params[:, 2])
+        else:
+            params[:, 0] = np.clip(params[:, 0], 0., 1.)
+            params[:, 3] = np.abs(params[:, 3])
+
+        return params
+
+    def _levenberg_marquardt(self, vec_x, vec_y, weights, params):
+        '''Minimize the weighted sum of squared residuals of all the sub runs at once
+
+        :return: parameters (2D), their uncertainties (2D) and reduced chi2 (1D).  Sub runs with fewer points
+            than parameters or without finite result have infinite chi2
+        '''
+        num_spectra, num_params = params.shape
+
+        def cost(rows, trial_params):
+            values, jacobian = self._calculate(vec_x[rows], trial_params)
+            residuals = weights[rows] * (vec_y[rows] - values)
+            return np.sum(residuals ** 2, axis=1), residuals, jacobian * weights[rows, :, np.newaxis]
+
+        all_rows = np.arange(num_spectra)
+        chi2, residuals, jacobian = cost(all_rows, params)
+        damping = np.full(num_spectra, self.INITIAL_DAMPING)
+        active = np.isfinite(chi2)
+
+        for _ in range(self.MAX_ITERATIONS):
+            rows = np.flatnonzero(active)
+            if rows.size == 0:
+                break
+
+            # damped normal equations of the active sub runs
+            normal_matrix = np.einsum('nmk,nml->nkl', jacobian[rows], jacobian[rows])
+            gradient = np.einsum('nmk,nm->nk', jacobian[rows], residuals[rows])
+            diagonal = np.diagonal(normal_matrix, axis1=1, axis2=2)
+            diagonal = np.where(diagonal > 0., diagonal, 1.)
+            damped_matrix = normal_matrix + (damping[rows, np.newaxis] * diagonal)[:, :, np.newaxis] \
+                * np.eye(num_params)
+            try:
+                step = np.linalg.solve(damped_matrix, gradient[..., np.newaxis])[..., 0]
+            except np.linalg.LinAlgError:
+                step = np.einsum('nkl,nl->nk', np.linalg.pinv(damped_matrix), gradient)
+
+            trial_params = self._constrain(params[rows] + step)
+            trial_chi2, trial_residuals, trial_jacobian = cost(rows, trial_params)
+
+            # accept the steps reducing chi2 and adjust damping.  A collapsed peak width may have finite chi2
+            # but overflowing Jacobian
+            better = np.isfinite(trial_chi2) & (trial_chi2 <= chi2[rows]) \
+                & np.all(np.isfinite(trial_jacobian), axis=(1, 2))
+            accepted = rows[better]
+            converged = np.zeros(num_spectra, dtype=bool)
+            converged[accepted] = (chi2[accepted] - trial_chi2[better]) <= self.TOLERANCE * chi2[accepted]
+            params[accepted] = trial_params[better]
+            chi2[accepted] = trial_chi2[better]
+            residuals[accepted] = trial_residuals[better]
+            jacobian[accepted] = trial_jacobian[better]
+            damping[accepted] *= 0.1
+            damping[rows[~better]] *= 10.
+
+            active &= ~converged & (damping < self.MAX_DAMPING)
+
+        # uncertainties from the covariance matrix
+        normal_matrix = np.einsum('nmk,nml->nkl', jacobian, jacobian)
+        covariance = np.linalg.pinv(normal_matrix)
+        errors = np.sqrt(np.abs(np.diagonal(covariance, axis1=1, axis2=2)))
+
+        # reduced chi2
+        degrees_of_freedom = np.count_nonzero(weights, axis=1) - num_params
+        reduced_chi2 = np.full(num_spectra, np.inf)
+        valid = (degrees_of_freedom > 0) & np.isfinite(chi2)
+        reduced_chi2[valid] = chi2[valid] / degrees_of_freedom[valid]
+
+        return params, errors, reduced_chi2
+
+
+def proximity_tree(coordinates, num_neighbours=8):
+    '''Order points such that each point is next to its nearest point earlier in the order
+
+    The order is the breadth first order of the minimum spanning tree of the graph connecting each point to its
+    nearest points, starting from the first point.  Groups of points that are not connected by this graph, e.g.,
+    scans far apart, start from their first point without a neighbour.
+
+    :param numpy.ndarray coordinates: coordinates (2D) of shape (number of points) x (number of dimensions)
+    :param int num_neighbours: number of nearest points connected to each point
+    :return: order of the points and the nearest point earlier in the order (-1 for the first point)
+    :rtype: numpy.ndarray, numpy.ndarray
+    '''
+    num_points = coordinates.shape[0]
+    if num_points == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    # graph of the nearest points.  Coincident points are connected by the smallest positive distance
+    # because zero entries are not edges
+    distances, indexes = cKDTree(coordinates).query(coordinates, k=min(num_neighbours + 1, num_points))
+    distances, indexes = distances.reshape(num_points, -1), indexes.reshape(num_points, -1)
+    points = np.repeat(np.arange(num_points), indexes.shape[1])
+    edges = (indexes.ravel() != points) & np.isfinite(distances.ravel())
+    weights = np.maximum(distances.ravel()[edges], np.finfo(float).tiny)
+
+    # a virtual root connects the first point of each group of connected points, which is the lowest point
+    # because the weights of these edges increase with the point
+    max_weight = 2. * weights.max() + 1. if weights.size > 0 else 1.
+    root = num_points
+    rows = np.concatenate((points[edges], np.full(num_points, root)))
+    columns = np.concatenate((indexes.ravel()[edges], np.arange(num_points)))
+    weights = np.concatenate((weights, max_weight * (1. + np.arange(num_points) / num_points)))
+    graph = csr_matrix((weights, (rows, columns)), shape=(num_points + 1, num_points + 1))
+
+    tree = minimum_spanning_tree(graph)
+    order, predecessors = breadth_first_order(tree, root, directed=False, return_predecessors=True)
+
+    neighbours = predecessors[:num_points].astype(int)
+    neighbours[neighbours == root] = -1
+
+    return order[1:].astype(int), neighbours
+
+
+def warm_start_steps(order, neighbours):
+    '''Group points in steps such that the neighbour of each point is in an earlier step
+
+    Points of the same step can be fitted together.
+
+    :param numpy.ndarray order: order of the points from :py:func:`proximity_tree`
+    :param numpy.ndarray neighbours: neighbours of the points from :py:func:`proximity_tree`
+    :return: list of the points of each step and their neighbours
+    :rtype: list
+    '''
+    # depth of each point in the tree by pointer jumping: each pass doubles the distance to the ancestors
+    has_neighbour = neighbours >= 0
+    depths = has_neighbour.astype(int)
+    ancestors = np.where(has_neighbour, neighbours, np.arange(neighbours.size))
+    while np.any(ancestors != ancestors[ancestors]):
+        depths = depths + depths[ancestors]
+        ancestors = ancestors[ancestors]
+
+    if depths.size == 0:
+        return []
+
+    # points of each depth in increasing order
+    points_by_depth = np.split(np.argsort(depths, kind='stable'), np.cumsum(np.bincount(depths))[:-1])
+
+    return [(points, neighbours[points]) for points in points_by_depth]
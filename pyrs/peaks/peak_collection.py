@@ -3,8 +3,8 @@ from pathlib import Path
 from pyrs.core.peak_profile_utility import get_parameter_dtype, get_effective_parameters_converter, PeakShape, \
     BackgroundFunction
 from pyrs.dataobjects import SubRuns  # type: ignore
-from typing import Optional, Tuple, Union
-from uncertainties import unumpy
+from typing import Tuple, Union
+from pyrs.utilities.error_propagation import propagate_errors
 
 __all__ = ['PeakCollection', 'PeakCollectionLite']
 
@@ -52,8 +52,8 @@ def to_microstrain(strains):
 
 
 def _create_d_reference_array(values: Union[float, np.ndarray],
-                              errors: Union[float, np.ndarray], size: int) -> unumpy.uarray:
-    '''Convert the d-reference values to a :py:obj:`unumpy.uarray`
+                              errors: Union[float, np.ndarray], size: int) -> Tuple[np.ndarray, np.ndarray]:
+    '''Convert the d-reference values and errors to float arrays
 
     Parameters
     ----------
@@ -66,7 +66,8 @@ def _create_d_reference_array(values: Union[float, np.ndarray],
 
     Returns
     -------
-    :py:obj:`unumpy.uarray`
+    tuple
+        values and errors
     '''
     # d-reference should be, at minimum, length one
     num_values = size if size else 1
@@ -84,8 +85,7 @@ def _create_d_reference_array(values: Union[float, np.ndarray],
     else:
         nd_errors = np.array([errors] * num_values)
 
-    # store value and uncertainties together
-    return unumpy.uarray(nd_values, nd_errors)
+    return np.array(nd_values, dtype=float), np.array(nd_errors, dtype=float)
 
 
 class PeakCollectionLite:
@@ -104,10 +104,12 @@ class PeakCollectionLite:
         self._tag: str = peak_tag
 
         # We need to store strains in strain units, NOT in microstrains
-        self._strain = unumpy.uarray(strain, strain_error) / get_strain_conversion_factor(strain_units)
+        conversion_factor = get_strain_conversion_factor(strain_units)
+        self._strain = np.array(strain, dtype=float) / conversion_factor
+        self._strain_error = np.array(strain_error, dtype=float) / conversion_factor
 
         # must happen after the sub_run array is set
-        self._d_reference = unumpy.uarray(np.nan, np.nan)  # set this correctly in next call
+        self._d_reference: Tuple[np.ndarray, np.ndarray]
         self.set_d_reference(d_reference, d_reference_error)
 
     @property
@@ -143,7 +145,6 @@ class PeakCollectionLite:
                         errors: Union[float, np.ndarray] = 0.) -> None:
         """Set d reference values
         """
-        # store value and uncertainties together
         self._d_reference = _create_d_reference_array(values, errors, self._strain.size)
 
     def get_d_reference(self) -> Tuple[np.ndarray, np.ndarray]:
@@ -155,7 +156,7 @@ class PeakCollectionLite:
             1D array for peak's reference position in dSpacing.  NaN for not being set.
 
         """
-        return unumpy.nominal_values(self._d_reference), unumpy.std_devs(self._d_reference)
+        return self._d_reference[0].copy(), self._d_reference[1].copy()
 
     def get_strain(self, units: str = 'strain') -> Tuple[np.ndarray, np.ndarray]:
         """get strain values and uncertainties in units of strain
@@ -174,10 +175,7 @@ class PeakCollectionLite:
         conversion_factor = get_strain_conversion_factor(units)
 
         # multiplying by 1e6 converts to micro
-        strain = conversion_factor * self._strain
-
-        # unpack the values to return
-        return unumpy.nominal_values(strain), unumpy.std_devs(strain)
+        return conversion_factor * self._strain, conversion_factor * self._strain_error
 
     @property
     def runnumber(self) -> int:
@@ -234,7 +232,7 @@ class PeakCollection:
         self._fit_status = None
 
         # must happen after the sub_run array is set
-        self._d_reference: Optional[unumpy.uarray]
+        self._d_reference: Tuple[np.ndarray, np.ndarray]
         self.set_d_reference(d_reference, d_reference_error)
 
     def __len__(self):
@@ -391,12 +389,11 @@ class PeakCollection:
             1D array for peak's reference position in dSpacing.  NaN for not being set.
 
         """
-        return unumpy.nominal_values(self._d_reference), unumpy.std_devs(self._d_reference)
+        return self._d_reference[0].copy(), self._d_reference[1].copy()
 
     def set_d_reference(self, values: Union[float, np.ndarray] = np.nan,
                         errors: Union[float, np.ndarray] = 0.) -> None:
         '''Set d reference values'''
-        # store value and uncertainties together
         self._d_reference = _create_d_reference_array(values, errors, self._sub_run_array.size)
 
     def get_strain(self, units: str = 'strain') -> Tuple[np.ndarray, np.ndarray]:
@@ -416,13 +413,16 @@ class PeakCollection:
         # prepare to return the requested units
         conversion_factor = get_strain_conversion_factor(units)
 
-        d_fitted = self._get_dspacing_center()
+        d_fitted, d_fitted_error = self.get_dspacing_center()
+        d_reference, d_reference_error = self._d_reference
 
         # multiplying by 1e6 converts to micro
-        strain = conversion_factor * (d_fitted - self._d_reference)/self._d_reference
+        strain = conversion_factor * (d_fitted - d_reference) / d_reference
+        strain_error = propagate_errors([conversion_factor / d_reference,
+                                         -conversion_factor * d_fitted / d_reference**2],
+                                        [d_fitted_error, d_reference_error])
 
-        # unpack the values to return
-        return unumpy.nominal_values(strain), unumpy.std_devs(strain)
+        return strain, strain_error
 
     def get_native_params(self):
         return self._params_value_array, self._params_error_array
@@ -439,21 +439,6 @@ class PeakCollection:
 
         return eff_values, eff_errors
 
-    def _get_dspacing_center(self):
-        '''Internal function for getting d-spacing position'''
-        effective_values, effective_errors = self.get_effective_params()
-        theta_center = unumpy.uarray(0.5 * np.deg2rad(effective_values['Center']),
-                                     0.5 * np.deg2rad(effective_errors['Center']))
-        sine_theta = unumpy.sin(theta_center)
-        try:
-            dspacing_center = 0.5 * self._wavelength / sine_theta
-        except ZeroDivisionError:
-            # replace zeros in the denominator with nan explicitly
-            dspacing_center = np.where(unumpy.nominal_values(sine_theta) != 0.,
-                                       unumpy.std_devs(0.5 * self._wavelength / sine_theta.clip(1e-9)), np.nan)
-
-        return dspacing_center
-
     def get_dspacing_center(self) -> Tuple[np.ndarray, np.ndarray]:
         r"""
         peak center in unit of d spacing.
@@ -463,8 +448,18 @@ class PeakCollection:
         tuple
             A two-item tuple containing the peak center and its uncertainty.
         """
-        d_spacing = self._get_dspacing_center()
-        return unumpy.nominal_values(d_spacing), unumpy.std_devs(d_spacing)
+        effective_values, effective_errors = self.get_effective_params()
+        theta_center = (0.5 * np.deg2rad(effective_values['Center'])).astype(float)
+        theta_center_error = (0.5 * np.deg2rad(effective_errors['Center'])).astype(float)
+        sine_theta = np.sin(theta_center)
+
+        # replace zeros in the denominator with nan explicitly
+        sine_theta = np.where(sine_theta != 0., sine_theta, np.nan)
+        dspacing_center = 0.5 * self._wavelength / sine_theta
+        dspacing_error = propagate_errors([-dspacing_center * np.cos(theta_center) / sine_theta],
+                                          [theta_center_error])
+
+        return dspacing_center, dspacing_error
 
     def get_chisq(self) -> np.ndarray:
         if self._fit_cost_array is not None:
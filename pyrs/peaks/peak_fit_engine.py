@@ -1,8 +1,7 @@
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from mantid.kernel import Logger
-from mantid.simpleapi import DeleteWorkspace, RenameWorkspace
 import numpy as np
-from pyrs.core import mantid_helper
 from pyrs.core.peak_profile_utility import BackgroundFunction, PeakShape
 
 __all__ = ['PeakFitEngine']
@@ -10,7 +9,9 @@ __all__ = ['PeakFitEngine']
 
 class FitResult(namedtuple('FitResult', 'peakcollections fitted difference')):
     '''(:py:obj:`(~pyrs.peaks.peak_collection)`, :py:obj:`~mantid.api.MatrixWorkspace`,
-    :py:obj:`~mantid.api.MatrixWorkspace`)'''
+    :py:obj:`~mantid.api.MatrixWorkspace`)
+
+    The numpy engine returns :py:obj:`~pyrs.peaks.numpy_fit_peak.FittedSpectra` in place of the workspaces'''
     pass
 
 
@@ -31,8 +32,6 @@ class PeakFitEngine:
         # configure logging for this class
         self._log = Logger(__name__)
 
-        self._mtd_wksp = mantid_helper.generate_mantid_workspace(hidraworkspace, hidraworkspace.name,
-                                                                 out_of_plane_angle)
         self._subruns = hidraworkspace.get_sub_runs()
         self._project_file_name = hidraworkspace.hidra_project_file
         self._runnumber = hidraworkspace.get_sample_log_value('run_number') \
@@ -73,45 +72,52 @@ class PeakFitEngine:
         '''Fit a single peak across subruns. This will return a :py:obj:`FitResult`'''
         raise NotImplementedError('This must be implemented by the concrete class')
 
-    def fit_multiple_peaks(self, peak_tags, x_mins, x_maxs):
+    def fit_multiple_peaks(self, peak_tags, x_mins, x_maxs, max_workers=None):
         '''Fit multiple peaks across subruns. This will return a :py:obj:`FitResult`
-        Concrete instances may instantiate this as needed
+
+        The peak windows are independent and fitted concurrently in a thread pool. The calculated peaks are
+        summed into a single fitted spectra. The peak collections are in the same order as the peak tags.
 
         :param str peak_tag: Id to define peak
         :param float x_min: min 2theta for peak fitting window
         :param float x_max: max 2theta for peak fitting window
+        :param max_workers: maximum number of threads (default of :py:obj:`~concurrent.futures.ThreadPoolExecutor`)
+        :type max_workers: int, optional
         :return: peaks collections of fitting results
         :rtype: FitResult
         '''
-
         x_mins, x_maxs = self._check_fit_range(x_mins, x_maxs)
         assert len(peak_tags) == len(x_mins) == len(x_maxs), 'All inputs must have same number of values'
 
-        # fit each peak separately
-        peakcollections = []
-        fitted = None
-        for peak_tag, x_min, x_max in zip(peak_tags, x_mins, x_maxs):
-            # fit an individual peak
-            individual = self.fit_peaks(peak_tag, x_min, x_max)
-
-            # collect information
-            peakcollections.extend(individual.peakcollections)
-            if fitted:
-                fitted += individual.fitted
-                DeleteWorkspace(individual.fitted)
-            else:
-                fitted = individual.fitted
-                fitted = RenameWorkspace(InputWorkspace=fitted,
-                                         OutputWorkspace='{}_fitted'.format(peak_tags[0]))
+        # fit each peak separately. map returns the results in the order of the peaks
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(self._fit_peak, peak_tags, x_mins, x_maxs))
 
-            # original difference isn't needed
-            DeleteWorkspace(individual.difference)
+        peakcollections = [peak_collection for peak_collection, _ in results]
+        fitted = np.sum([model for _, model in results], axis=0)
 
-        # calculate the difference
-        difference = self._mtd_wksp - fitted
-        difference = RenameWorkspace(InputWorkspace=difference, OutputWorkspace=peak_tags[0]+'_diff')
+        return self._create_fit_result(peakcollections, fitted, '{}_fitted'.format(peak_tags[0]),
+                                       peak_tags[0] + '_diff')
 
-        return FitResult(peakcollections=peakcollections, fitted=fitted, difference=difference)
+    def _fit_peak(self, peak_tag, x_min, x_max):
+        '''Fit a single peak across subruns. This must be safe to call from multiple threads
+
+        :return: peak collection and calculated peak (2D) of shape (number of sub runs) x (number of points)
+        :rtype: PeakCollection, numpy.ndarray
+        '''
+        raise NotImplementedError('This must be implemented by the concrete class')
+
+    def _create_fit_result(self, peakcollections, fitted, fitted_name, difference_name):
+        '''Create the :py:obj:`FitResult` from the peak collections and the calculated peaks (2D)'''
+        raise NotImplementedError('This must be implemented by the concrete class')
+
+    def _get_spectrum(self, index):
+        '''Get x and y values of the spectrum (i.e., sub run) at an index'''
+        raise NotImplementedError('This must be implemented by the concrete class')
+
+    def _get_number_spectra(self):
+        '''Get the number of spectra, i.e., sub runs'''
+        raise NotImplementedError('This must be implemented by the concrete class')
 
     def _guess_center(self, x_min, x_max):
         '''
@@ -122,15 +128,15 @@ class PeakFitEngine:
         '''
         center = []
 
-        for wksp_index in range(self._mtd_wksp.getNumberHistograms()):
-            x_vals = self._mtd_wksp.readX(wksp_index)
+        for wksp_index in range(self._get_number_spectra()):
+            x_vals, y_vals = self._get_spectrum(wksp_index)
             i_min, i_max = x_vals.searchsorted([x_min, x_max])
             if i_min >= i_max:
                 msg = 'Failed to find requested x-range({} < {}) '.format(x_min, x_max)
                 msg += 'in data with x-range ({} < {})'.format(x_vals[0], x_vals[-1])
                 self._log.warning(msg)
                 continue  # don't use this workspace index
-            y_vals = self._mtd_wksp.readY(wksp_index)[i_min:i_max]
+            y_vals = y_vals[i_min:i_max]
             y_offset = np.abs(y_vals.max())
 
             # add the first moment to the list of centers
@@ -9,9 +9,9 @@ from pyrs.utilities.convertdatatypes import to_float, to_int
 from pyrs.utilities.file_util import to_filepath
 from pyrs.core.instrument_geometry import DENEXDetectorGeometry, HidraSetup
 from pyrs.peaks import PeakCollection  # type: ignore
-from pyrs.dataobjects import HidraConstants, SampleLogs  # type: ignore
+from pyrs.dataobjects import HidraConstants, SampleLogs, SparseCounts  # type: ignore
 from pyrs.projectfile import HidraProjectFileMode  # type: ignore
-from typing import Union
+from typing import Callable, Optional, Union
 
 __all__ = ['HidraProjectFile']
 
@@ -33,6 +33,7 @@ class HidraProjectFile:
     File structure:
     - experiment
         - scans (raw counts)
+        - counts and counts sub runs (raw counts of all scans in contiguous layout)
         - logs
     - instrument
         - calibration
@@ -48,6 +49,18 @@ class HidraProjectFile:
           - ...
     '''
 
+    # default compression filter of raw counts: fast and without extra dependency
+    RAW_COUNTS_COMPRESSION = 'lzf'
+    # number of pixels in a chunk of compressed raw counts
+    RAW_COUNTS_CHUNK = 2 ** 16
+    # entries of sparse raw counts
+    SPARSE_PIXEL_IDS = 'sparse pixel ids'
+    SPARSE_COUNTS = 'sparse counts'
+    NUM_PIXELS = 'number of pixels'
+    # entries of raw counts in contiguous layout: (sub runs x pixels) block and its sub runs
+    COUNTS_BLOCK = 'counts'
+    COUNTS_BLOCK_SUB_RUNS = 'counts sub runs'
+
     def __init__(self, project_file_name: Union[str, Path],
                  mode: HidraProjectFileMode = HidraProjectFileMode.READONLY):
         """
@@ -69,6 +82,11 @@ class HidraProjectFile:
                                       check_exists=bool(self._io_mode != HidraProjectFileMode.OVERWRITE))
         self._checkFileAccess()
 
+        # sub run number to row of reduced diffraction data, built when first needed
+        self._sub_run_rows: Optional[dict] = None
+        # sub run number to row of raw counts in contiguous layout, built when first needed
+        self._counts_block_rows: Optional[dict] = None
+
         # open the file using h5py
         self._project_h5 = h5py.File(self._file_name, mode=str(self._io_mode))
         if self._io_mode == HidraProjectFileMode.OVERWRITE:
@@ -142,27 +160,144 @@ class HidraProjectFile:
         """
         return self._project_h5.filename
 
-    def append_raw_counts(self, sub_run_number: int, counts_array: numpy.ndarray) -> None:
+    def append_raw_counts(self, sub_run_number: int, counts_array: Union[numpy.ndarray, SparseCounts],
+                          overwrite: bool = False, compression: Optional[str] = RAW_COUNTS_COMPRESSION) -> None:
         """Add raw detector counts collected in a single scan/Pt
 
+        With compression, non-negative integer counts are stored with the narrowest unsigned integer type and
+        in compressed chunks.  The original type and the compression are recorded as attributes of the
+        dataset such that :py:meth:`read_raw_counts` returns the counts as they were.
+
+        Sparse counts are stored as the pixel IDs and the counts of the pixels with counts.
+
         Parameters
         ----------
         sub_run_number : int
             sub run number
-        counts_array : ~numpy.ndarray
+        counts_array : ~numpy.ndarray, ~pyrs.dataobjects.SparseCounts
             detector counts
+        overwrite : bool
+            replace the counts if the sub run already exists, e.g., counts updated by incremental conversion
+        compression : str, None
+            h5py compression filter ('lzf' or 'gzip').  None to store the counts as they are
         """
         # check
         assert self._project_h5 is not None, 'cannot be None'
         assert self._is_writable, 'must be writable'
         sub_run_number = to_int('Sub-run index', sub_run_number, min_value=0)
 
+        sub_runs_group = self._project_h5[HidraConstants.RAW_DATA][HidraConstants.SUB_RUNS]
+        sub_run_name = '{:04}'.format(sub_run_number)
+        if overwrite and sub_run_name in sub_runs_group:
+            # delete the existing counts to replace
+            del sub_runs_group[sub_run_name]
+
         # create group
-        scan_i_group = self._project_h5[HidraConstants.RAW_DATA][HidraConstants.SUB_RUNS].create_group(
-            '{:04}'.format(sub_run_number))
-        scan_i_group.create_dataset('counts', data=counts_array.reshape(-1))
+        scan_i_group = sub_runs_group.create_group(sub_run_name)
+        if isinstance(counts_array, SparseCounts):
+            scan_i_group.attrs[self.NUM_PIXELS] = counts_array.num_pixels
+            self._create_counts_dataset(scan_i_group, self.SPARSE_PIXEL_IDS, counts_array.pixel_ids, compression)
+            self._create_counts_dataset(scan_i_group, self.SPARSE_COUNTS, counts_array.counts, compression)
+        else:
+            self._create_counts_dataset(scan_i_group, 'counts', counts_array.reshape(-1), compression)
+
+    def _create_counts_dataset(self, group, name, counts_array, compression):
+        """Create a dataset for counts (or pixel IDs), narrowed and compressed unless compression is None"""
+        if compression is None or counts_array.size == 0:
+            group.create_dataset(name, data=counts_array)
+            return
+
+        original_dtype = counts_array.dtype
+        counts_array = counts_array.astype(self._narrow_counts_dtype(original_dtype, counts_array.min(),
+                                                                     counts_array.max()), copy=False)
+        compression_opts = 1 if compression == 'gzip' else None
+        counts_dataset = group.create_dataset(name, data=counts_array,
+                                              chunks=(min(self.RAW_COUNTS_CHUNK, counts_array.size),),
+                                              compression=compression, compression_opts=compression_opts,
+                                              shuffle=counts_array.dtype.itemsize > 1)
+        counts_dataset.attrs['compression'] = compression
+        counts_dataset.attrs['original dtype'] = original_dtype.str
+
+    @staticmethod
+    def _narrow_counts_dtype(dtype, min_count, max_count):
+        """Narrowest unsigned integer type for non-negative integer counts; otherwise the type itself"""
+        dtype = numpy.dtype(dtype)
+        if dtype.kind in 'iu' and min_count >= 0:
+            return numpy.min_scalar_type(max_count)
+
+        return dtype
+
+    def write_raw_counts_block(self, sub_runs, counts: Union[numpy.ndarray, Callable[[int], numpy.ndarray]],
+                               overwrite: bool = False) -> None:
+        """Add raw detector counts of all the sub runs in contiguous layout
 
-    def append_experiment_log(self, log_name, log_value_array, units=''):
+        The counts are stored uncompressed as one (sub runs x pixels) dataset along with the sub run of each
+        row, such that rows are read without group lookups and the block can be memory mapped
+        (see :py:meth:`read_raw_counts_block`).  :py:meth:`read_raw_counts` reads either layout.
+        Non-negative integer counts are stored with the narrowest unsigned integer type.
+
+        The counts can be given by a function of the sub run, which is called twice per sub run (for the
+        range of the counts and to write the row), such that only the counts of one sub run are held in memory.
+
+        Parameters
+        ----------
+        sub_runs : list, ~numpy.ndarray
+            sub run numbers of the rows
+        counts : ~numpy.ndarray, callable
+            detector counts of shape (number of sub runs) x (number of pixels) or a function returning the
+            counts of a sub run
+        overwrite : bool
+            replace the counts if they already exist
+        """
+        assert self._project_h5 is not None, 'cannot be None'
+        assert self._is_writable, 'must be writable'
+        sub_runs = numpy.atleast_1d(sub_runs)
+        if sub_runs.size == 0:
+            raise RuntimeError('No sub run to write raw counts in contiguous layout')
+
+        if callable(counts):
+            read_counts = counts
+
+            def get_row(index):
+                return numpy.asarray(read_counts(sub_runs[index])).reshape(-1)
+        else:
+            checkdatatypes.check_numpy_arrays('Counts matrix', [counts], 2, False)
+            if counts.shape[0] != sub_runs.shape[0]:
+                raise RuntimeError('Counts matrix of shape {} does not match {} sub runs'
+                                   ''.format(counts.shape, sub_runs.shape[0]))
+            counts_matrix = counts
+
+            def get_row(index):
+                return counts_matrix[index]
+
+        # type and range of the counts, one sub run at a time
+        row = get_row(0)
+        num_pixels, original_dtype = row.size, row.dtype
+        min_count, max_count = row.min(), row.max()
+        for index in range(1, sub_runs.size):
+            row = get_row(index)
+            if row.size != num_pixels:
+                raise RuntimeError('Sub run {} has {} pixels but sub run {} has {} pixels'
+                                   ''.format(sub_runs[index], row.size, sub_runs[0], num_pixels))
+            min_count, max_count = min(min_count, row.min()), max(max_count, row.max())
+
+        raw_data_group = self._project_h5[HidraConstants.RAW_DATA]
+        if self.COUNTS_BLOCK in raw_data_group:
+            if not overwrite:
+                raise RuntimeError('Raw counts in contiguous layout already exist')
+            del raw_data_group[self.COUNTS_BLOCK]
+            del raw_data_group[self.COUNTS_BLOCK_SUB_RUNS]
+
+        counts_block = raw_data_group.create_dataset(self.COUNTS_BLOCK, shape=(sub_runs.size, num_pixels),
+                                                     dtype=self._narrow_counts_dtype(original_dtype, min_count,
+                                                                                     max_count))
+        counts_block.attrs['original dtype'] = original_dtype.str
+        for index in range(sub_runs.size):
+            counts_block[index] = get_row(index)
+        raw_data_group.create_dataset(self.COUNTS_BLOCK_SUB_RUNS, data=sub_runs)
+        self._counts_block_rows = None
+
+    def append_experiment_log(self, log_name, log_value_array, units='', overwrite=False):
         r"""
         Insert information about the experiment including scan indexes, sample logs, 2theta, etc
 
@@ -174,6 +309,8 @@ class HidraProjectFile:
             Values of the log, one value for each subrun
         units: str
             Units of the sample log
+        overwrite: bool
+            replace the log if it already exists, e.g., sub runs added by incremental conversion
 
         Raises
         ------
@@ -189,6 +326,11 @@ class HidraProjectFile:
 
         self._log.debug('Add sample log: {}'.format(log_name))
         node_logs = self._project_h5[HidraConstants.RAW_DATA][HidraConstants.SAMPLE_LOGS]
+        if log_name == HidraConstants.SUB_RUNS:
+            self._sub_run_rows = None
+        if overwrite and log_name in node_logs:
+            # delete the existing log to replace
+            del node_logs[log_name]
         try:
             data_set = node_logs.create_dataset(log_name, data=log_value_array)
         except RuntimeError as run_err:
@@ -404,14 +546,8 @@ class HidraProjectFile:
             # all the sub runs
             reduced_diff_hist = self._project_h5[HidraConstants.REDUCED_DATA][mask_id][()]
         else:
-            # specific one sub run
-            sub_run_list = self.read_sub_runs()
-            sub_run_index = sub_run_list.index(sub_run)
-
-            if mask_id is None:
-                mask_id = HidraConstants.REDUCED_MAIN
-
-            reduced_diff_hist = self._project_h5[HidraConstants.REDUCED_DATA][mask_id][()][sub_run_index]
+            # specific one sub run: read only its row
+            reduced_diff_hist = self._project_h5[HidraConstants.REDUCED_DATA][mask_id][self._get_sub_run_row(sub_run)]
         # END-IF-ELSE
 
         return reduced_diff_hist
@@ -438,23 +574,75 @@ class HidraProjectFile:
                 # all the sub runs
                 reduced_variance_hist = self._project_h5[HidraConstants.REDUCED_DATA][mask_id][()]
             else:
-                # specific one sub run
-                sub_run_list = self.read_sub_runs()
-                sub_run_index = sub_run_list.index(sub_run)
-
-                if mask_id is None:
-                    mask_id = HidraConstants.REDUCED_MAIN
-
-                if '_var' not in mask_id:
-                    mask_id += '_var'
-
-                reduced_variance_hist = self._project_h5[HidraConstants.REDUCED_DATA][mask_id][()][sub_run_index]
+                # specific one sub run: read only its row
+                reduced_variance_hist = \
+                    self._project_h5[HidraConstants.REDUCED_DATA][mask_id][self._get_sub_run_row(sub_run)]
             # END-IF-ELSE
         except ValueError:
             reduced_variance_hist = None
 
         return reduced_variance_hist
 
+    def read_diffraction_intensity_vectors(self, mask_id, sub_runs):
+        """ Get the (reduced) diffraction data's intensities of several sub runs in one read
+        :param mask_id: mask ID.  None for the main (not masked) data
+        :param sub_runs: sub run numbers in any order and possibly repeated
+        :return: 2D array with a row for each sub run in the order of sub_runs
+        """
+        if mask_id is None:
+            mask_id = HidraConstants.REDUCED_MAIN
+
+        checkdatatypes.check_string_variable('Mask ID', mask_id,
+                                             list(self._project_h5[HidraConstants.REDUCED_DATA].keys()))
+
+        return self._read_sub_run_rows(self._project_h5[HidraConstants.REDUCED_DATA][mask_id], sub_runs)
+
+    def read_diffraction_variance_vectors(self, mask_id, sub_runs):
+        """ Get the (reduced) diffraction data's variances of several sub runs in one read
+        :param mask_id: mask ID.  None for the main (not masked) data
+        :param sub_runs: sub run numbers in any order and possibly repeated
+        :return: 2D array with a row for each sub run in the order of sub_runs or None without variances
+        """
+        if mask_id is None:
+            mask_id = HidraConstants.REDUCED_MAIN
+
+        if '_var' not in mask_id:
+            mask_id += '_var'
+
+        if mask_id not in self._project_h5[HidraConstants.REDUCED_DATA]:
+            return None
+
+        return self._read_sub_run_rows(self._project_h5[HidraConstants.REDUCED_DATA][mask_id], sub_runs)
+
+    def _get_sub_run_row(self, sub_run):
+        """ Get the row of a sub run in the reduced diffraction data from the cached sub run to row map
+        :param sub_run: sub run number
+        :return: int
+        """
+        if self._sub_run_rows is None:
+            self._sub_run_rows = {sub_run_i: row for row, sub_run_i in enumerate(self.read_sub_runs())}
+
+        try:
+            return self._sub_run_rows[int(sub_run)]
+        except KeyError:
+            # same exception as searching for the sub run in the list of sub runs
+            raise ValueError('Sub run {} is not in the sub runs of {}'.format(sub_run, self._file_name))
+
+    def _read_sub_run_rows(self, dataset, sub_runs):
+        """ Read the rows of several sub runs from a dataset with one selection
+        :param h5py.Dataset dataset: reduced diffraction data (number of sub runs x number of bins)
+        :param sub_runs: sub run numbers
+        :return: 2D array
+        """
+        rows = numpy.array([self._get_sub_run_row(sub_run) for sub_run in sub_runs], dtype=numpy.int64)
+        if rows.size == 0:
+            return numpy.zeros((0,) + dataset.shape[1:], dtype=dataset.dtype)
+
+        # h5py selects rows in increasing order without duplicates
+        unique_rows, order = numpy.unique(rows, return_inverse=True)
+
+        return dataset[unique_rows.tolist()][order]
+
     def read_diffraction_masks(self):
         """
         Get the list of masks
@@ -584,18 +772,143 @@ class HidraProjectFile:
         """
         get the raw detector counts
         """
+        counts = self._read_raw_counts_entry(sub_run)
+        if isinstance(counts, SparseCounts):
+            counts = counts.to_dense()
+
+        return counts
+
+    def read_sparse_raw_counts(self, sub_run: int) -> SparseCounts:
+        """Get the raw detector counts as the counts of the pixels with counts
+
+        Parameters
+        ----------
+        sub_run : int
+            sub run number
+
+        Returns
+        -------
+        ~pyrs.dataobjects.SparseCounts
+        """
+        counts = self._read_raw_counts_entry(sub_run)
+        if not isinstance(counts, SparseCounts):
+            counts = SparseCounts.from_dense(counts)
+
+        return counts
+
+    def _read_raw_counts_entry(self, sub_run: int) -> Union[numpy.ndarray, SparseCounts]:
+        """Read raw counts as they were stored: counts of all the pixels or sparse counts"""
         assert self._project_h5 is not None, 'blabla'
         sub_run = to_int('sun run', sub_run, min_value=0)
 
+        counts_block_rows = self._get_counts_block_rows()
+        if sub_run in counts_block_rows:
+            counts_block = self._project_h5[HidraConstants.RAW_DATA][self.COUNTS_BLOCK]
+            counts = counts_block[counts_block_rows[sub_run]]
+            # counts are stored with a narrower type
+            if 'original dtype' in counts_block.attrs:
+                counts = counts.astype(counts_block.attrs['original dtype'])
+            return counts
+
         sub_run_str = '{:04}'.format(sub_run)
         try:
-            counts = self._project_h5[HidraConstants.RAW_DATA][HidraConstants.SUB_RUNS][sub_run_str]['counts'][()]
+            sub_run_group = self._project_h5[HidraConstants.RAW_DATA][HidraConstants.SUB_RUNS][sub_run_str]
+            if self.SPARSE_COUNTS in sub_run_group:
+                return SparseCounts(self._read_counts_dataset(sub_run_group[self.SPARSE_PIXEL_IDS]),
+                                    self._read_counts_dataset(sub_run_group[self.SPARSE_COUNTS]),
+                                    sub_run_group.attrs[self.NUM_PIXELS])
+            counts_dataset = sub_run_group['counts']
         except KeyError as key_error:
             err_msg = 'Unable to access sub run {} with key {}: {}\nAvailable runs are: {}' \
                       ''.format(sub_run, sub_run_str, key_error,
                                 self._project_h5[HidraConstants.RAW_DATA][HidraConstants.SUB_RUNS].keys())
             raise KeyError(err_msg)
 
+        return self._read_counts_dataset(counts_dataset)
+
+    def _get_counts_block_rows(self) -> dict:
+        """Sub run number to row of the raw counts in contiguous layout.  Empty without such counts"""
+        if self._counts_block_rows is None:
+            raw_data_group = self._project_h5[HidraConstants.RAW_DATA]
+            if self.COUNTS_BLOCK_SUB_RUNS in raw_data_group:
+                self._counts_block_rows = {int(sub_run): row for row, sub_run
+                                           in enumerate(raw_data_group[self.COUNTS_BLOCK_SUB_RUNS][()])}
+            else:
+                self._counts_block_rows = dict()
+
+        return self._counts_block_rows
+
+    def has_raw_counts_block(self) -> bool:
+        """Whether the raw counts are stored in contiguous layout"""
+        return len(self._get_counts_block_rows()) > 0
+
+    def read_raw_counts_block(self, sub_runs=None):
+        """Get the raw detector counts of sub runs stored in contiguous layout
+
+        The block is memory mapped, such that the counts of consecutive sub runs are returned without
+        reading or copying the counts.  Rows of other sub runs are read with a single selection.
+
+        Parameters
+        ----------
+        sub_runs : list, ~numpy.ndarray, None
+            sub run numbers.  None for all the sub runs in the order they are stored
+
+        Returns
+        -------
+        ~numpy.ndarray
+            counts of shape (number of sub runs) x (number of pixels), with the (narrowed) type they are stored
+        """
+        counts_block_rows = self._get_counts_block_rows()
+        if len(counts_block_rows) == 0:
+            raise RuntimeError('Project file {} has no raw counts in contiguous layout'.format(self._file_name))
+        counts_block = self._map_dataset(self._project_h5[HidraConstants.RAW_DATA][self.COUNTS_BLOCK])
+
+        if sub_runs is None:
+            return counts_block[()]
+
+        try:
+            rows = numpy.array([counts_block_rows[int(sub_run)] for sub_run in numpy.atleast_1d(sub_runs)],
+                               dtype=numpy.int64)
+        except KeyError as key_error:
+            raise RuntimeError('Sub run {} is not in raw counts of {}'.format(key_error, self._file_name))
+        if rows.size == 0:
+            return numpy.zeros((0,) + counts_block.shape[1:], dtype=counts_block.dtype)
+
+        if numpy.all(numpy.diff(rows) == 1):
+            # consecutive rows
+            return counts_block[rows[0]:rows[-1] + 1]
+
+        # h5py selects rows in increasing order without duplicates
+        unique_rows, order = numpy.unique(rows, return_inverse=True)
+        return counts_block[unique_rows.tolist()][order]
+
+    def _map_dataset(self, dataset):
+        """Memory map a dataset if it is stored uncompressed and contiguous; otherwise return the dataset
+
+        Parameters
+        ----------
+        dataset : h5py.Dataset
+
+        Returns
+        -------
+        ~numpy.memmap, h5py.Dataset
+        """
+        offset = dataset.id.get_offset()
+        if offset is None or dataset.chunks is not None or not dataset.dtype.isnative:
+            return dataset
+
+        # data written to the file shall be visible to the map
+        self._project_h5.flush()
+
+        return numpy.memmap(self._file_name, mode='r', dtype=dataset.dtype, shape=dataset.shape, offset=offset)
+
+    @staticmethod
+    def _read_counts_dataset(counts_dataset):
+        counts = counts_dataset[()]
+        # compressed counts are stored with a narrower type
+        if 'original dtype' in counts_dataset.attrs:
+            counts = counts.astype(counts_dataset.attrs['original dtype'])
+
         return counts
 
     def read_sub_runs(self):
@@ -1039,6 +1352,7 @@ class HidraProjectFile:
 
         sample_log_entry = self._project_h5[HidraConstants.RAW_DATA][HidraConstants.SAMPLE_LOGS]
         sample_log_entry.create_dataset(HidraConstants.SUB_RUNS, data=sub_runs)
+        self._sub_run_rows = None
 
     def _create_diffraction_node(self, sub_run_number):
         """ Create a node to record diffraction data
@@ -0,0 +1,88 @@
+"""
+First order propagation of uncertainties over float arrays
+
+The uncertainty of :math:`f(x_1, \\ldots, x_n)` is
+
+.. math::
+    \\sigma_f^2 = \\sum_{ij} \\frac{\\partial f}{\\partial x_i} \\frac{\\partial f}{\\partial x_j}
+                  \\rho_{ij} \\sigma_i \\sigma_j
+
+where :math:`\\rho_{ij}` is the correlation coefficient of :math:`x_i` and :math:`x_j` (one for :math:`i = j`).
+This is the same as :py:obj:`uncertainties.unumpy` to first order, without an object for each element.
+"""
+from typing import Dict, Optional, Sequence, Tuple, Union
+import numpy as np
+
+__all__ = ['propagate_errors', 'linear_combination']
+
+FloatOrArray = Union[float, np.ndarray]
+
+
+def propagate_errors(derivatives: Sequence[FloatOrArray], errors: Sequence[FloatOrArray],
+                     correlations: Optional[Dict[Tuple[int, int], FloatOrArray]] = None) -> np.ndarray:
+    r"""
+    Uncertainty of a function of several variables from its partial derivatives
+
+    Parameters
+    ----------
+    derivatives: list
+        partial derivatives of the function with respect to each variable
+    errors: list
+        uncertainties of each variable
+    correlations: dict
+        correlation coefficients of pairs of variables, keyed by the pair of indices :math:`(i, j)` with
+        :math:`i < j`. Variables not in the dictionary are uncorrelated. A coefficient of one for identical
+        variables.
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    if len(derivatives) != len(errors):
+        raise RuntimeError('Number of derivatives ({}) and errors ({}) are different'
+                           ''.format(len(derivatives), len(errors)))
+
+    # exact variables do not contribute, even with an infinite or NaN derivative (0 * inf is discarded)
+    with np.errstate(invalid='ignore'):
+        components = [np.where(np.equal(error, 0.), 0., np.multiply(derivative, error))
+                      for derivative, error in zip(derivatives, errors)]
+    variance = sum(component**2 for component in components)
+    if correlations:
+        for (i, j), correlation in correlations.items():
+            variance = variance + 2. * correlation * components[i] * components[j]
+
+    # correlated variables may cancel to a small negative number by rounding
+    return np.sqrt(np.maximum(variance, 0.))
+
+
+def linear_combination(coefficients: Sequence[float], values: Sequence[FloatOrArray],
+                       errors: Sequence[FloatOrArray],
+                       correlations: Optional[Dict[Tuple[int, int], FloatOrArray]] = None) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    r"""
+    Values and uncertainties of :math:`\sum_i c_i x_i`
+
+    Parameters
+    ----------
+    coefficients: list
+        coefficient of each variable
+    values: list
+        values of each variable
+    errors: list
+        uncertainties of each variable
+    correlations: dict
+        correlation coefficients as in :py:func:`propagate_errors`
+
+    Returns
+    -------
+    tuple
+        values and uncertainties
+    """
+    if len(coefficients) != len(values):
+        raise RuntimeError('Number of coefficients ({}) and values ({}) are different'
+                           ''.format(len(coefficients), len(values)))
+
+    combination = np.asarray(sum(coefficient * np.asarray(value, dtype=float)
+                                 for coefficient, value in zip(coefficients, values)), dtype=float)
+
+    return combination, propagate_errors(coefficients, errors, correlations)
@@ -0,0 +1,42 @@
+#!/usr/bin/python
+# Convert HB2B NeXus files of several runs to Hidra project files in parallel
+#
+# Example:
+#   pyrs_batch_conversion.py 1086 1087 1090 --output=/HFIR/HB2B/IPTS-22731/shared/manualreduce --mask=mask.xml
+#                            --workers=4
+#
+# Runs with project files newer than their NeXus files are skipped unless --overwrite is given
+import argparse
+from pyrs.core.nexus_conversion import convert_nexus_files
+
+
+def _parse_run(run):
+    # run number or NeXus file name
+    return int(run) if run.isdigit() else run
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert HB2B NeXus files to Hidra project files')
+    parser.add_argument('runs', nargs='+', type=_parse_run, help='run numbers or NeXus files')
+    parser.add_argument('--output', required=True, help='directory to write the project files to')
+    parser.add_argument('--mask', default=None, help='Mantid XML mask applied to all the runs')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--overwrite', action='store_true', help='convert runs with up-to-date project files')
+    options = parser.parse_args()
+
+    reports = convert_nexus_files(options.runs, options.output, mask_file_name=options.mask,
+                                  n_workers=options.workers, overwrite=options.overwrite)
+
+    for report in reports:
+        if report.skipped:
+            status = 'up to date'
+        elif report.error is not None:
+            status = 'FAILED: {}'.format(report.error)
+        else:
+            status = '{} events in {:.1f} s ({:.3g} events/s)'.format(report.num_events, report.duration,
+                                                                      report.event_rate)
+        print('{} -> {}: {}'.format(report.nexus_file, report.project_file, status))
+
+    if any(report.error is not None for report in reports):
+        raise RuntimeError('Failed to convert {} of {} runs'
+                           ''.format(sum(report.error is not None for report in reports), len(reports)))
@@ -23,6 +23,9 @@ _options += '"mask": default detector mask\n'
 _options += '"old calibration": override default settings with an old calibration file\n'
 _options += '"method": method that will be used to refine instrument geometry (default is shifts+rotations)\n'
 _options += '"cycle": HFIR run cycle\n'
+_options += '"workers": number of processes to evaluate the residuals of each refinement in parallel (default is 1)\n'
+_options += '"checkpoint": file to save the refinement after each method, which is resumed if the file exists\n'
+_options += '"checkpoint interval": number of iterations between checkpoints within a method\n'
 
 M_options = 'Options for Method inputs:\n'
 M_options += '"full": refine x, y, z shifts+rotations and wavelength\n'
@@ -50,6 +53,9 @@ nexus_file = None
 KEEP_SUB_RUNS = None
 CalibName = None
 HFIR_CYCLE = None
+N_WORKERS = None
+CHECKPOINT = None
+CHECKPOINT_INTERVAL = None
 
 # Allow a varriety of inputs to catch errors
 powerinput = ['powder scan', 'powder', 'powder_scan', 'powderscan', 'powder scans', 'powder_scans', 'powderscans']
@@ -61,6 +67,9 @@ savelatest = ['write latest', 'write_latest', 'latest']
 output_input = ['output', 'calib file']
 nexus_input = ['nexus', 'nexus file', 'nexus run', 'nexus_file']
 keep_input = ['keep', 'keep list']
+workers_input = ['workers', 'n_workers', 'n workers']
+checkpoint_input = ['checkpoint', 'checkpoint file', 'checkpoint_file']
+interval_input = ['checkpoint interval', 'checkpoint_interval']
 
 # Defualt check for method input
 method_options = ["full", "geometry", "shifts", "shift x", "shift_x", "shift y", "shift_y",
@@ -172,6 +181,12 @@ if __name__ == '__main__':
             nexus_file = calibration_inputs[key]
         elif key.lower() in keep_input:
             KEEP_SUB_RUNS = calibration_inputs[key]
+        elif key.lower() in workers_input:
+            N_WORKERS = int(calibration_inputs[key])
+        elif key.lower() in checkpoint_input:
+            CHECKPOINT = calibration_inputs[key]
+        elif key.lower() in interval_input:
+            CHECKPOINT_INTERVAL = int(calibration_inputs[key])
 
     if '+' in REFINE_METHOD:
         SPLITTER = '+'
@@ -186,7 +201,8 @@ if __name__ == '__main__':
         nexus_file = _get_nexus_data(POWDER_RUN)
 
     calibrator = mantid_peakfit_calibration.FitCalibration(nexus_file=nexus_file, eta_slice=ETA_Slice, bins=TTH_Bins,
-                                                           mask_file=DATA_MASK, vanadium=VAN_RUN)
+                                                           mask_file=DATA_MASK, vanadium=VAN_RUN,
+                                                           n_workers=N_WORKERS)
 
     if KEEP_SUB_RUNS is not None:
         calibrator.set_keep_subrun_list(KEEP_SUB_RUNS)
@@ -194,8 +210,19 @@ if __name__ == '__main__':
     if INSTRUMENT_CALIBRATION is not None:
         calibrator.get_archived_calibration(INSTRUMENT_CALIBRATION)
 
-    for calib_method in REFINE_METHOD.split(SPLITTER):
+    calib_methods = REFINE_METHOD.split(SPLITTER)
+    if CHECKPOINT is not None:
+        if os.path.exists(CHECKPOINT):
+            completed_methods = calibrator.load_checkpoint(CHECKPOINT)
+            if completed_methods != calib_methods[:len(completed_methods)]:
+                raise RuntimeError('Checkpoint {} was written for methods {}, not {}'.format(
+                    CHECKPOINT, completed_methods, calib_methods))
+            print('Resume calibration from {} after {}'.format(CHECKPOINT, completed_methods))
+        calibrator.set_checkpoint(CHECKPOINT, CHECKPOINT_INTERVAL)
+
+    for calib_method in calib_methods[len(calibrator.completed_stages):]:
         calibrator = _run_calibration(calibrator, calib_method)
+        calibrator.complete_stage(calib_method)
 
     if CalibName is not None:
         calibrator.write_calibration(CalibName)
@@ -75,6 +75,7 @@ if __name__ == "__main__":
     scripts = ['scripts/pyrsplot',
                'scripts/pyrs_calibration.py',
                'scripts/pyrs_calibration_correlation.py',
+               'scripts/pyrs_batch_conversion.py',
                'scripts/create_mask.py']
     setup(
         name=NAME,
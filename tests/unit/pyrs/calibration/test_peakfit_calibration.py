@@ -1,11 +1,17 @@
 # Migrated from /HFIR/HB2B/shared/Quick_Calibration.py
 # Original can be found at ./Quick_Calibration_v3.py
 # Renamed from  ./prototypes/calibration/Quick_Calibration_Class.py
+from concurrent.futures import ProcessPoolExecutor
 import pytest
 import time
 import os
 import json
+import numpy as np
 from pyrs.calibration import mantid_peakfit_calibration
+from pyrs.core.instrument_geometry import DENEXDetectorGeometry, DENEXDetectorShift
+from pyrs.core.reduce_hb2b_pyrs import ResidualStressInstrument
+from pyrs.core.workspaces import HidraWorkspace
+from pyrs.dataobjects import HidraConstants  # type: ignore
 
 
 try:
@@ -252,5 +258,124 @@ def test_load_print_calibration():
     return
 
 
+def build_powder_workspace(detector_shift, wavelength):
+    r"""Workspace with the Ni (111) reflection measured by a small detector"""
+    num_pixels = 256
+    setup = DENEXDetectorGeometry(num_pixels, num_pixels, 0.3 / num_pixels, 0.3 / num_pixels, 0.985, False)
+
+    workspace = HidraWorkspace('powder')
+    workspace.set_instrument_geometry(setup)
+    sub_runs = np.array([1])
+    workspace.set_sub_runs(sub_runs)
+    workspace.set_sample_log(HidraConstants.TWO_THETA, sub_runs, np.array([44.]))
+    workspace.set_sample_log('sy', sub_runs, np.array([62.]))
+    workspace.set_sample_log('mrot', sub_runs, np.array([-20.]))
+
+    instrument = ResidualStressInstrument(setup)
+    instrument.build_instrument(-44., 0.985, detector_shift)
+    peak = np.rad2deg(np.arcsin(wavelength / 2 / (3.526314 / np.sqrt(3)))) * 2
+    counts = 10. + 1000. * np.exp(-0.5 * ((instrument.get_pixels_2theta(1) - peak) / 0.2) ** 2)
+    workspace.set_raw_counts(1, np.random.default_rng(22).poisson(counts))
+
+    return workspace
+
+
+def test_fast_reduction():
+    """Calibrate a synthetic powder from the pixels near its reflection"""
+    workspace = build_powder_workspace(DENEXDetectorShift(0., 0., 0., 0., 0., 0., 0.3), 1.540)
+    calibrator = mantid_peakfit_calibration.FitCalibration(reduction_engine=workspace, bins=128,
+                                                           fast_reduction=True)
+
+    # the reflection is shifted by 2theta_0 and it is at the expected position with the calibration
+    residual = calibrator.get_alignment_residual(calibrator.get_calib())
+    assert residual.size == 5
+    assert residual == pytest.approx(0.3, abs=0.03)
+    calibration = calibrator.get_calib()
+    calibration[6] = 0.3
+    assert calibrator.get_alignment_residual(calibration) == pytest.approx(0., abs=0.03)
+
+    # the reflection moves out of the selected pixels, which are selected again
+    calibration[6] = -2.
+    assert calibrator.get_alignment_residual(calibration) == pytest.approx(2.3, abs=0.03)
+
+
+def test_parallel_residuals():
+    """Refinements and grid points with the residuals evaluated by worker processes are the same as in serial"""
+    workspace = build_powder_workspace(DENEXDetectorShift(0., 0., 0., 0., 0., 0., 0.3), 1.540)
+    grid = [np.array([-0.5, 1.54]), np.array([0.5, 1.545])]
+
+    results = dict()
+    for n_workers in (None, 2):
+        calibrator = mantid_peakfit_calibration.FitCalibration(reduction_engine=workspace, bins=128,
+                                                               fast_reduction=True, n_workers=n_workers)
+        calibrator.set_max_nfev(2)
+        calibrator.calibrate_wave_shift()
+        results[n_workers] = calibrator.get_calib()
+
+    # brute force grid points evaluated by the workers
+    calibrator = mantid_peakfit_calibration.FitCalibration(reduction_engine=workspace, bins=128,
+                                                           fast_reduction=True)
+    expected = [calibrator.peak_alignment_wave_shift(x, True) for x in grid]
+    with ProcessPoolExecutor(max_workers=2, initializer=mantid_peakfit_calibration._init_calibration_worker,
+                             initargs=(calibrator,)) as executor:
+        workers = mantid_peakfit_calibration.ResidualWorkers(executor, 'peak_alignment_wave_shift',
+                                                             calibrator.get_calib(), (True, 2))
+        grid_residuals = list(workers.map(calibrator.peak_alignment_wave_shift, grid))
+
+    np.testing.assert_allclose(results[2], results[None])
+    np.testing.assert_allclose(grid_residuals, expected)
+
+
+def test_checkpoint(tmpdir):
+    """Refinements resumed from a checkpoint do not evaluate the residuals again"""
+    workspace = build_powder_workspace(DENEXDetectorShift(0., 0., 0., 0., 0., 0., 0.3), 1.540)
+    checkpoint = str(tmpdir.join('calibration_checkpoint.json'))
+
+    # checkpoint written after each residual evaluation of an interrupted stage
+    calibrator = mantid_peakfit_calibration.FitCalibration(reduction_engine=workspace, bins=128,
+                                                           fast_reduction=True, max_nfev=2)
+    calibrator.set_checkpoint(checkpoint, interval=1)
+    calibrator.calibrate_wave_shift()
+
+    # each memoised residual is appended once after the reduction settings
+    num_residuals = np.unique(calibrator.calibration_history[:, 1:], axis=1).shape[1]
+    with open(checkpoint + '.residuals') as residual_file:
+        assert len(residual_file.readlines()) == num_residuals + 1
+    # a job dying while appending leaves an incomplete line
+    with open(checkpoint + '.residuals', 'a') as residual_file:
+        residual_file.write('[[0.')
+
+    resumed = mantid_peakfit_calibration.FitCalibration(reduction_engine=workspace, bins=128,
+                                                        fast_reduction=True, max_nfev=2)
+    assert resumed.load_checkpoint(checkpoint) == []
+    np.testing.assert_equal(resumed.calibration_history, calibrator.calibration_history[:, :1])
+
+    # the interrupted stage is repeated from memoised residuals
+    fitted = []
+    fit_peaks = resumed.fit_peaks
+
+    def count_fit_peaks():
+        fitted.append(True)
+        return fit_peaks()
+
+    resumed.fit_peaks = count_fit_peaks
+    resumed.calibrate_wave_shift()
+    assert len(fitted) == 0
+    np.testing.assert_equal(resumed.get_calib(), calibrator.get_calib())
+    np.testing.assert_equal(resumed.calibration_history, calibrator.calibration_history)
+
+    # completed stages are restored with their calibration
+    resumed.set_checkpoint(checkpoint)
+    resumed.complete_stage('wavelength_tth0')
+    restored = mantid_peakfit_calibration.FitCalibration(reduction_engine=workspace, bins=128,
+                                                         fast_reduction=True)
+    assert restored.load_checkpoint(checkpoint) == ['wavelength_tth0']
+    np.testing.assert_equal(restored.get_calib(), calibrator.get_calib())
+    np.testing.assert_equal(restored.stage_results[0][0], calibrator.get_calib())
+    np.testing.assert_equal(restored.calibration_history, calibrator.calibration_history)
+    with open(checkpoint + '.residuals') as residual_file:
+        assert len(residual_file.readlines()) == num_residuals + 1
+
+
 if __name__ == '__main__':
     pytest.main([__file__])
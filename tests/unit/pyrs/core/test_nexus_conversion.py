@@ -1,9 +1,14 @@
 from mantid.kernel import Int32TimeSeriesProperty as IntLog
+import h5py
 import numpy as np
 import pytest
 import os
+from types import SimpleNamespace
 
-from pyrs.core.nexus_conversion import Splitter, NeXusConvertingApp
+from pyrs.core import nexus_conversion
+from pyrs.core.nexus_conversion import HIDRA_PIXEL_NUMBER, Splitter, NeXusConvertingApp, convert_nexus_files
+from pyrs.core.nexus_conversion import IncrementalNeXusConverter
+from pyrs.projectfile import HidraProjectFile  # type: ignore
 from pyrs.dataobjects.constants import HidraConstants
 
 
@@ -22,6 +27,161 @@ class TestNeXusConvertingApp:
         assert sample_logs.units(HidraConstants.SUB_RUN_DURATION) == 'second'
 
 
+@pytest.fixture(scope='module')
+def synthetic_events(tmpdir_factory):
+    r"""NeXus file with only the neutron events and a splitter of 3 sub runs"""
+    rng = np.random.default_rng(938)
+    num_pulses = 600
+    event_index = np.sort(rng.integers(0, 50000, num_pulses))
+    event_index[0] = 0
+    event_id = rng.integers(0, HIDRA_PIXEL_NUMBER, 50000).astype(np.uint32)
+
+    file_name = str(tmpdir_factory.mktemp('nexus').join('HB2B_0.nxs.h5'))
+    with h5py.File(file_name, 'w') as nexus_h5:
+        bank1_events = nexus_h5.create_group('entry').create_group('bank1_events')
+        bank1_events['total_counts'] = [event_id.size]
+        bank1_events['event_id'] = event_id
+        bank1_events['event_index'] = event_index
+        pulse_times = bank1_events.create_dataset('event_time_zero', data=np.arange(num_pulses) / 60.)
+        pulse_times.attrs['units'] = np.bytes_('second')
+        pulse_times.attrs['offset'] = '2020-01-01T00:00:00'
+
+    # sub runs start/stop at 1, 3, 4, 7, 8 and 10 seconds
+    start_time = np.datetime64('2020-01-01T00:00:00')
+    times = start_time + np.array([1, 3, 4, 7, 8, 10]) * np.timedelta64(1, 's')
+    return file_name, SimpleNamespace(times=times, subruns=np.array([1, 2, 3]))
+
+
+@pytest.mark.parametrize('use_splitter', [False, True])
+def test_histogram_events_nxs(synthetic_events, use_splitter):
+    file_name, splitter = synthetic_events
+
+    def converter(event_memory):
+        # converter without loading the logs by mantid
+        app = NeXusConvertingApp.__new__(NeXusConvertingApp)
+        app._event_ws_name = 'HB2B_0'
+        app._nexus_name = file_name
+        app._splitter = splitter if use_splitter else None
+        app._event_memory = event_memory
+        return app
+
+    # reference: histogram all the events read at once
+    event_id_array, subrun_eventindex_array = converter(None).get_events_time_nxs()
+    if use_splitter:
+        expected = [np.bincount(event_id_array[start:stop], minlength=HIDRA_PIXEL_NUMBER)
+                    for start, stop in zip(subrun_eventindex_array[::2], subrun_eventindex_array[1::2])]
+    else:
+        expected = [np.bincount(event_id_array, minlength=HIDRA_PIXEL_NUMBER)]
+
+    # chunks of 1000 events
+    subruns, hist_list = converter(4000).histogram_events_nxs()
+    assert subruns == ([1, 2, 3] if use_splitter else [1])
+    assert len(hist_list) == len(expected)
+    for hist, expected_hist in zip(hist_list, expected):
+        np.testing.assert_array_equal(hist, expected_hist)
+
+
+def test_convert_nexus_files(tmpdir, monkeypatch):
+    nexus_files = list()
+    for run_number in (1, 2, 3):
+        nexus_file = tmpdir.join('HB2B_{}.nxs.h5'.format(run_number))
+        nexus_file.write('')
+        nexus_files.append(str(nexus_file))
+    output_dir = tmpdir.mkdir('output')
+    # run 1 is up to date but run 2 is converted before the NeXus file is updated
+    output_dir.join('HB2B_1.h5').write('')
+    output_dir.join('HB2B_2.h5').write('')
+    os.utime(str(output_dir.join('HB2B_2.h5')), (0, 0))
+
+    converted = list()
+
+    def convert(nexus_file, project_file, mask_array, extra_logs, event_memory):
+        converted.append(nexus_file)
+        if nexus_file.endswith('HB2B_3.nxs.h5'):
+            raise RuntimeError('Run has no count')
+        return 2., 1000
+
+    monkeypatch.setattr(nexus_conversion, '_convert_nexus_file', convert)
+
+    reports = convert_nexus_files(nexus_files, str(output_dir))
+    assert converted == nexus_files[1:]
+    assert [report.skipped for report in reports] == [True, False, False]
+    assert reports[1].project_file == str(output_dir.join('HB2B_2.h5'))
+    assert reports[1].event_rate == 500.
+    assert reports[1].error is None
+    assert reports[2].error == 'Run has no count'
+
+    converted.clear()
+    convert_nexus_files(nexus_files, str(output_dir), overwrite=True)
+    assert converted == nexus_files
+
+
+def write_live_nexus(file_name, event_id, event_index, num_pulses):
+    r"""NeXus file with events of pulses at 60 Hz and the scan_index, 2theta and mrot logs"""
+    with h5py.File(file_name, 'w') as nexus_h5:
+        bank1_events = nexus_h5.create_group('entry').create_group('bank1_events')
+        bank1_events['event_id'] = event_id
+        bank1_events['event_index'] = event_index[:num_pulses]
+        pulse_times = bank1_events.create_dataset('event_time_zero', data=np.arange(num_pulses) / 60.)
+        pulse_times.attrs['units'] = np.bytes_('second')
+        pulse_times.attrs['offset'] = '2020-01-01T00:00:00'
+
+        das_logs = nexus_h5['entry'].create_group('DASlogs')
+        for log_name, times, values, units in [('scan_index', [0., 1., 3., 4., 7., 8.], [0, 1, 0, 2, 0, 3], ''),
+                                               ('2theta', [0., 2., 5.], [80., 81., 85.], 'degrees'),
+                                               ('mrot', [0.], [-40.], 'degrees')]:
+            log_group = das_logs.create_group(log_name)
+            log_times = log_group.create_dataset('time', data=times)
+            log_times.attrs['start'] = np.bytes_('2020-01-01T00:00:00')
+            log_group.create_dataset('value', data=values).attrs['units'] = np.bytes_(units)
+
+
+@pytest.mark.parametrize('growing', [False, True])
+def test_incremental_conversion(tmpdir, growing):
+    rng = np.random.default_rng(1086)
+    num_pulses = 600
+    event_index = np.sort(rng.integers(0, 50000, num_pulses))
+    event_index[0] = 0
+    event_id = rng.integers(0, HIDRA_PIXEL_NUMBER, 50000).astype(np.uint32)
+    nexus_file = str(tmpdir.join('HB2B_1.nxs.h5'))
+    project_file = str(tmpdir.join('HB2B_1.h5'))
+
+    # reference: sub run of each event by the scan_index at its pulse time
+    event_pulses = np.searchsorted(event_index, np.arange(event_id.size), side='right') - 1
+    event_sub_runs = np.array([0, 1, 0, 2, 0, 3])[np.searchsorted([0., 1., 3., 4., 7., 8.], event_pulses / 60.,
+                                                                  side='right') - 1]
+    expected = {sub_run: np.bincount(event_id[event_sub_runs == sub_run], minlength=HIDRA_PIXEL_NUMBER)
+                for sub_run in (1, 2, 3)}
+
+    if growing:
+        # the file grows with some events of the last pulse recorded
+        write_live_nexus(nexus_file, event_id[:event_index[300] + 3], event_index, 301)
+        converter = IncrementalNeXusConverter(nexus_file, project_file, event_memory=4000)
+        assert converter.update() == [1, 2]
+        write_live_nexus(nexus_file, event_id, event_index, num_pulses)
+        assert converter.update() == [2, 3]
+    else:
+        # replay a complete file in time slices
+        write_live_nexus(nexus_file, event_id, event_index, num_pulses)
+        converter = IncrementalNeXusConverter(nexus_file, project_file, event_memory=4000)
+        assert converter.update('2020-01-01T00:00:02.5') == [1]
+        assert converter.update('2020-01-01T00:00:02.5') == []
+        assert converter.update('2020-01-01T00:00:05') == [1, 2]
+        assert converter.update() == [2, 3]
+    assert converter.last_pulse_time == np.datetime64('2020-01-01T00:00:00') + np.timedelta64(9983333333, 'ns')
+
+    project = HidraProjectFile(project_file)
+    assert project.read_sub_runs() == [1, 2, 3]
+    for sub_run in (1, 2, 3):
+        np.testing.assert_array_equal(converter.get_raw_counts(sub_run), expected[sub_run])
+        np.testing.assert_array_equal(project.read_raw_counts(sub_run), expected[sub_run])
+    np.testing.assert_allclose(project.read_log_value(HidraConstants.SUB_RUN_DURATION)[()],
+                               [2., 3., 599 / 60. - 8.], rtol=1E-6)
+    np.testing.assert_allclose(project.read_log_value('2theta')[()], [80.5, 251. / 3, 85.])
+    assert project.read_wavelengths() == pytest.approx(1.452)
+    project.close()
+
+
 class TestSplitter:
 
     def test_empty_constructor(self):
@@ -0,0 +1,53 @@
+from pyrs.core.polefigurecalculator import PoleFigureCalculator, export_to_mtex
+import numpy as np
+import pytest
+
+
+def test_rotate_project_q():
+    calculator = PoleFigureCalculator()
+
+    # scalar projection
+    alpha, beta = calculator.rotate_project_q(30., 10., 5., 20., 3.)
+    assert isinstance(alpha, float)
+    assert alpha == pytest.approx(21.408424270130396)
+    assert beta == pytest.approx(-0.3524400828073909)
+
+    # projection of arrays is the same as of each point
+    theta = np.array([30., 45., 12.])
+    omega = np.array([10., 80., 35.])
+    chi = np.array([5., -60., 70.])
+    phi = np.array([20., 135., 290.])
+    eta = np.array([3., -7., 0.])
+    alpha_vec, beta_vec = calculator.rotate_project_q(theta, omega, chi, phi, eta)
+    for index in range(theta.size):
+        alpha, beta = calculator.rotate_project_q(theta[index], omega[index], chi[index], phi[index], eta[index])
+        assert alpha_vec[index] == alpha
+        assert beta_vec[index] == beta
+
+    with pytest.raises(TypeError):
+        calculator.rotate_project_q('theta', 10., 5., 20., 3.)
+
+
+def test_calculate_pole_figure(tmpdir):
+    calculator = PoleFigureCalculator()
+    log_dict = {'chi': np.array([5., -60.]), 'phi': np.array([20., 135.]), 'omega': np.array([10., -10.]),
+                'eta': np.array([3., -7.]), 'center': np.array([60., 90.]), 'intensity': np.array([100., 2.5])}
+    calculator.add_input_data_set(1, log_dict)
+    calculator.calculate_pole_figure()
+
+    # negative omega is shifted by 90 degrees
+    pole_figure = calculator.get_polefigure_array(1)
+    assert pole_figure.shape == (2, 3)
+    np.testing.assert_equal(pole_figure[0, :2], calculator.rotate_project_q(30., 10., 5., 20., 3.))
+    np.testing.assert_equal(pole_figure[1, :2], calculator.rotate_project_q(45., 80., -60., 135., -7.))
+    np.testing.assert_equal(pole_figure[:, 2], [100., 2.5])
+
+    file_name = str(tmpdir.join('HB2B_1_111'))
+    export_to_mtex({1: pole_figure}, [1], file_name, header='Ni 111')
+    with open(file_name + '.jul') as mtex_file:
+        lines = mtex_file.read().split('\n')
+
+    assert lines[:3] == ['NRSF2', 'alpha beta intensity', 'Ni 111']
+    assert lines[3] == '{0:5.5f}\t{1:5.5f}\t{2:5.5f}'.format(*pole_figure[0])
+    assert lines[4] == '{0:5.5f}\t{1:5.5f}\t{2:5.5f}'.format(*pole_figure[1])
+    assert lines[5:] == ['']
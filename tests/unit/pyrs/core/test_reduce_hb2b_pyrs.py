@@ -0,0 +1,189 @@
+import numpy as np
+import pytest
+
+from pyrs.core.instrument_geometry import DENEXDetectorGeometry, DENEXDetectorShift
+from pyrs.core.reduce_hb2b_pyrs import (HistogramBinningPlan, InstrumentGeometryCache, PyHB2BReduction,
+                                        ResidualStressInstrument)
+from pyrs.dataobjects import SparseCounts  # type: ignore
+
+
+@pytest.fixture(scope='module')
+def pixel_data():
+    rng = np.random.default_rng(42)
+    pixel_2theta = rng.uniform(70., 90., 4096)
+    counts = rng.poisson(3., 4096).astype(np.float64)
+    vanadium = rng.poisson(20., 4096).astype(np.float64)
+    mask = (rng.uniform(size=4096) > 0.1).astype(np.int32)
+    return pixel_2theta, counts, vanadium, mask
+
+
+@pytest.mark.parametrize('use_mask', [False, True])
+@pytest.mark.parametrize('use_vanadium', [False, True])
+@pytest.mark.parametrize('is_point_data', [False, True])
+def test_binning_plan_matches_numpy(pixel_data, use_mask, use_vanadium, is_point_data):
+    pixel_2theta, counts, vanadium, mask = pixel_data
+    counts = counts.copy()
+    counts[[3, 17]] = np.nan  # pixels with invalid counts shall be excluded
+    vanadium = vanadium.copy()
+    vanadium[[5, 11]] = 0.  # pixels without vanadium counts shall be excluded
+
+    # bins range narrower than the pixels' 2theta range and with last edge on a pixel
+    two_theta_bins = np.linspace(72., pixel_2theta[100], 201)
+    mask_array = mask if use_mask else None
+    van_array = vanadium if use_vanadium else None
+
+    plan = HistogramBinningPlan(pixel_2theta, two_theta_bins, mask_array)
+    bins, hist, var = plan.histogram(counts, is_point_data, van_array)
+
+    # reference: mask the pixels and histogram by numpy
+    keep = np.ones_like(mask, dtype=bool) if mask_array is None else mask == 1
+    ref_bins, ref_hist, ref_var = PyHB2BReduction.histogram_by_numpy(
+        pixel_2theta[keep], counts[keep], two_theta_bins, is_point_data,
+        None if van_array is None else van_array[keep])
+
+    np.testing.assert_equal(bins, ref_bins)
+    np.testing.assert_allclose(hist, ref_hist, rtol=1E-12)
+    np.testing.assert_allclose(var, ref_var, rtol=1E-12)
+
+
+@pytest.mark.parametrize('use_mask', [False, True])
+@pytest.mark.parametrize('use_vanadium', [False, True])
+def test_binning_plan_sparse(pixel_data, use_mask, use_vanadium):
+    pixel_2theta, counts, vanadium, mask = pixel_data
+    # low counts sub run
+    counts = np.where(counts > 4., counts - 4., 0.)
+    counts[[3, 17]] = np.nan  # pixels with invalid counts shall be excluded
+    vanadium = vanadium.copy()
+    vanadium[[5, 11]] = 0.  # pixels without vanadium counts shall be excluded
+    mask_array = mask if use_mask else None
+    van_array = vanadium if use_vanadium else None
+
+    plan = HistogramBinningPlan(pixel_2theta, np.linspace(72., 88., 201), mask_array)
+    sparse_counts = SparseCounts.from_dense(counts)
+    assert len(sparse_counts) < counts.size // 2
+
+    expected = plan.histogram(counts, False, van_array)
+    for _ in range(2):  # second time with the vanadium histogram from the first time
+        histogram = plan.histogram_sparse(sparse_counts, False, van_array)
+        np.testing.assert_equal(histogram[0], expected[0])
+        np.testing.assert_allclose(histogram[1], expected[1], rtol=1E-12)
+        np.testing.assert_allclose(histogram[2], expected[2], rtol=1E-12)
+
+    with pytest.raises(RuntimeError):
+        plan.histogram_sparse(SparseCounts.from_dense(counts[:100]))
+
+
+def test_binning_plan_wrong_size(pixel_data):
+    pixel_2theta, counts, _, _ = pixel_data
+    plan = HistogramBinningPlan(pixel_2theta, np.linspace(70., 90., 11))
+    assert plan.matrix.shape == (10, pixel_2theta.shape[0])
+    with pytest.raises(RuntimeError):
+        plan.histogram(counts[:100])
+
+
+def test_binning_plan_reused():
+    pixel_size = 0.3 / 64
+    setup = DENEXDetectorGeometry(64, 64, pixel_size, pixel_size, 0.985, False)
+    engine = PyHB2BReduction(setup)
+    engine.set_experimental_data(-80., None, np.ones(64 * 64))
+    engine.build_instrument(None)
+
+    two_theta = engine.instrument.get_pixels_2theta(1)
+    two_theta_bins = np.linspace(two_theta.min(), two_theta.max(), 51)
+    mask = np.ones(64 * 64, dtype=np.int32)
+    mask[:64] = 0
+
+    plan = engine.get_binning_plan(two_theta_bins, mask)
+    # same bins and same mask (even in a different array) shall give the same plan
+    assert engine.get_binning_plan(two_theta_bins.copy(), mask.copy()) is plan
+    assert engine.get_binning_plan(two_theta_bins, None) is not plan
+
+    _, hist, _ = engine.reduce_to_2theta_histogram(two_theta_bins, mask)
+    assert hist.sum() == pytest.approx(64 * 63)
+
+    # rebuilding the instrument discards the plans
+    engine.build_instrument(None)
+    assert engine.get_binning_plan(two_theta_bins, mask) is not plan
+
+
+def test_geometry_cache(tmpdir):
+    pixel_size = 0.3 / 32
+    setup = DENEXDetectorGeometry(32, 32, pixel_size, pixel_size, 0.985, False)
+    shift = DENEXDetectorShift(0.001, -0.002, 0.003, 0.1, -0.2, 0.3, 0.05)
+
+    def build(cache, two_theta, calibration):
+        engine = PyHB2BReduction(setup, geometry_cache=cache)
+        engine.set_experimental_data(two_theta, None, np.ones(32 * 32))
+        engine.build_instrument(calibration)
+        return engine.instrument.get_pixels_2theta(1), engine.instrument.get_eta_values(1)
+
+    expected = [build(None, two_theta, calibration) for two_theta in (-80., -85.) for calibration in (None, shift)]
+
+    cache = InstrumentGeometryCache()
+    for _ in range(2):
+        built = [build(cache, two_theta, calibration) for two_theta in (-80., -85.) for calibration in (None, shift)]
+        for (exp_2theta, exp_eta), (two_theta, eta) in zip(expected, built):
+            np.testing.assert_array_equal(two_theta, exp_2theta)
+            np.testing.assert_array_equal(eta, exp_eta)
+    assert (cache.hits, cache.misses) == (4, 4)
+    assert len(cache) == 4
+    assert not built[0][0].flags.writeable
+
+    # memory cap discards the least recently used geometry
+    geometry_size = cache.memory // 4
+    small_cache = InstrumentGeometryCache(max_memory=2 * geometry_size)
+    build(small_cache, -80., None)
+    build(small_cache, -85., None)
+    build(small_cache, -80., None)
+    build(small_cache, -90., None)
+    assert len(small_cache) == 2
+    assert small_cache.memory == 2 * geometry_size
+    assert small_cache.make_key(setup, -85., setup.arm_length, None) not in small_cache
+    assert small_cache.make_key(setup, -80., setup.arm_length, None) in small_cache
+
+    # geometries stored on disk are shared among caches
+    disk_cache = InstrumentGeometryCache(cache_dir=str(tmpdir.join('geometry')))
+    build(disk_cache, -80., shift)
+    other_cache = InstrumentGeometryCache(cache_dir=str(tmpdir.join('geometry')))
+    two_theta, eta = build(other_cache, -80., shift)
+    assert (other_cache.hits, other_cache.misses) == (1, 0)
+    np.testing.assert_array_equal(two_theta, expected[1][0])
+    np.testing.assert_array_equal(eta, expected[1][1])
+
+
+@pytest.mark.parametrize('two_theta', [0., -80., 35.])
+@pytest.mark.parametrize('use_calibration', [False, True])
+def test_build_instrument(two_theta, use_calibration):
+    pixel_size = 0.3 / 32
+    setup = DENEXDetectorGeometry(32, 16, pixel_size, 2 * pixel_size, 0.985, False)
+    shift = DENEXDetectorShift(0.001, -0.002, 0.003, 0.1, -0.2, 0.3, 0.05) if use_calibration else None
+    instrument = ResidualStressInstrument(setup)
+    instrument.build_instrument(two_theta, 0.95, shift)
+
+    # reference: shift, rotate by calibration, push to arm length and rotate by 2theta step by step
+    pixels = np.zeros((16, 32, 3))
+    pixels[:, :, 0] = ((7.5 - np.arange(16)) * pixel_size).reshape((-1, 1))
+    pixels[:, :, 1] = (np.arange(32) - 15.5) * 2 * pixel_size
+    arm_length = 0.95
+    if use_calibration:
+        pixels += [shift.center_shift_x, shift.center_shift_y, 0.]
+        rotation_angles = np.deg2rad([shift.rotation_x, shift.rotation_y, shift.rotation_z])
+        rotation = instrument.generate_rotation_matrix(*rotation_angles)
+        pixels = pixels @ np.asarray(rotation).T
+        arm_length += shift.center_shift_z
+        two_theta += shift.two_theta_0
+    pixels[:, :, 2] += arm_length
+    pixels = pixels @ np.asarray(instrument._cal_rotation_matrix_y(np.deg2rad(two_theta))).T
+
+    np.testing.assert_allclose(instrument.get_pixel_matrix(), pixels, atol=1E-15)
+    np.testing.assert_allclose(instrument.get_pixels_2theta(2),
+                               np.rad2deg(np.arccos(pixels[:, :, 2] / np.linalg.norm(pixels, axis=2))), atol=1E-10)
+    eta = 180. - np.rad2deg(np.arctan2(pixels[:, :, 1], pixels[:, :, 0]))
+    eta[eta > 180.] -= 360.
+    np.testing.assert_allclose(instrument.get_eta_values(2), eta, atol=1E-10)
+    assert instrument.get_pixel_array().shape == (512, 3)
+
+    # without a geometry cache the arrays are reused when the instrument is built again
+    two_theta_matrix = instrument.get_pixels_2theta(2)
+    instrument.build_instrument(-90., 0.95, shift)
+    assert np.shares_memory(instrument.get_pixels_2theta(2), two_theta_matrix)
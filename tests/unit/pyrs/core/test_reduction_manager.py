@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+
+from pyrs.core.instrument_geometry import DENEXDetectorGeometry
+from pyrs.core.reduction_manager import HB2BReductionManager
+from pyrs.core.workspaces import HidraWorkspace
+from pyrs.dataobjects import HidraConstants  # type: ignore
+
+NUM_PIXELS_LINEAR = 64
+
+
+def build_interleaved_workspace(sparse_counts=False):
+    r"""Workspace with sub runs measured at interleaved detector positions"""
+    pixel_size = 0.3 / NUM_PIXELS_LINEAR
+    setup = DENEXDetectorGeometry(NUM_PIXELS_LINEAR, NUM_PIXELS_LINEAR, pixel_size, pixel_size, 0.985, False)
+
+    sub_runs = np.arange(1, 8)
+    two_thetas = np.array([80., 85., 80., 85., 85., 90., 80.])
+
+    workspace = HidraWorkspace('interleaved', sparse_counts=sparse_counts)
+    workspace.set_instrument_geometry(setup)
+    workspace.set_sub_runs(sub_runs)
+    workspace.set_sample_log(HidraConstants.TWO_THETA, sub_runs, two_thetas)
+    workspace.set_sample_log(HidraConstants.SUB_RUN_DURATION, sub_runs, np.full(sub_runs.shape, 60.))
+
+    rng = np.random.default_rng(1017)
+    for sub_run in sub_runs:
+        counts = rng.poisson(5., NUM_PIXELS_LINEAR ** 2)
+        counts[rng.integers(0, NUM_PIXELS_LINEAR ** 2, 200)] = 0
+        workspace.set_raw_counts(sub_run, counts)
+
+    return workspace
+
+
+@pytest.fixture(scope='function')
+def interleaved_workspace():
+    return build_interleaved_workspace()
+
+
+def reduce_one_by_one(workspace, mask_vec, vanadium=None):
+    r"""Reference reduction calling reduce_sub_run_diffraction for each sub run"""
+    manager = HB2BReductionManager()
+    manager.init_session('reference', workspace)
+    workspace.reset_diffraction_data()
+    for sub_run in workspace.get_sub_runs():
+        manager.reduce_sub_run_diffraction(workspace, sub_run, None, (None, mask_vec), num_bins=300,
+                                           vanadium_counts=vanadium)
+    return workspace.get_reduced_diffraction_data_set(None)
+
+
+@pytest.mark.parametrize('use_mask', [False, True])
+@pytest.mark.parametrize('use_vanadium', [False, True])
+def test_batched_reduction(interleaved_workspace, use_mask, use_vanadium):
+    num_pixels = NUM_PIXELS_LINEAR ** 2
+    mask_vec = None
+    if use_mask:
+        mask_vec = np.ones(num_pixels, dtype=np.int32)
+        mask_vec[:3 * NUM_PIXELS_LINEAR] = 0
+    vanadium = np.random.default_rng(42).poisson(30., num_pixels).astype(np.float64) if use_vanadium else None
+
+    expected = reduce_one_by_one(interleaved_workspace, mask_vec, vanadium)
+
+    manager = HB2BReductionManager()
+    manager.MAX_BATCH_SUB_RUNS = 2  # force several batches for a detector position
+    manager.init_session('batched', interleaved_workspace)
+    manager.reduce_diffraction_data('batched', False, 300, None, mask_vec, None, vanadium_counts=vanadium)
+    reduced = interleaved_workspace.get_reduced_diffraction_data_set(None)
+
+    for expected_matrix, reduced_matrix in zip(expected, reduced):
+        np.testing.assert_allclose(reduced_matrix, expected_matrix, rtol=1E-12)
+
+
+def test_set_reduced_diffraction_data_block(interleaved_workspace):
+    two_theta = np.linspace(70., 90., 11)
+    intensities = np.arange(33.).reshape((3, 11))
+
+    interleaved_workspace.set_reduced_diffraction_data_block([2, 5, 7], 'block', two_theta, intensities,
+                                                             np.sqrt(intensities))
+    vec_2theta, vec_intensity, vec_variance = interleaved_workspace.get_reduced_diffraction_data(5, 'block')
+    np.testing.assert_equal(vec_2theta, two_theta)
+    np.testing.assert_equal(vec_intensity, intensities[1])
+    np.testing.assert_equal(vec_variance, np.sqrt(intensities[1]))
+
+    with pytest.raises(RuntimeError):
+        interleaved_workspace.set_reduced_diffraction_data_block([2, 5], 'block', two_theta, intensities,
+                                                                 intensities)
+
+
+@pytest.mark.parametrize('eta_step', [None, 3.])
+def test_parallel_reduction(interleaved_workspace, eta_step):
+    vanadium = np.random.default_rng(7).poisson(30., NUM_PIXELS_LINEAR ** 2).astype(np.float64)
+
+    manager = HB2BReductionManager()
+    manager.init_session('reduction', interleaved_workspace)
+
+    def reduce(n_workers):
+        manager.reduce_diffraction_data('reduction', False, 300, None, None, None, vanadium_counts=vanadium,
+                                        eta_step=eta_step, eta_min=-6., eta_max=6., n_workers=n_workers)
+        return {mask_id: interleaved_workspace.get_reduced_diffraction_data_set(mask_id)
+                for mask_id in interleaved_workspace.reduction_masks}
+
+    serial = reduce(None)
+    parallel = reduce(2)
+
+    assert list(parallel.keys()) == list(serial.keys())
+    for mask_id in serial:
+        for serial_matrix, parallel_matrix in zip(serial[mask_id], parallel[mask_id]):
+            np.testing.assert_array_equal(parallel_matrix, serial_matrix)
+
+
+def test_sparse_reduction(interleaved_workspace):
+    vanadium = np.random.default_rng(3).poisson(30., NUM_PIXELS_LINEAR ** 2).astype(np.float64)
+
+    sparse_workspace = build_interleaved_workspace(sparse_counts=True)
+    for sub_run in sparse_workspace.get_sub_runs():
+        assert len(sparse_workspace.get_sparse_detector_counts(sub_run)) < NUM_PIXELS_LINEAR ** 2
+        np.testing.assert_equal(sparse_workspace.get_detector_counts(sub_run),
+                                interleaved_workspace.get_detector_counts(sub_run))
+
+    reduced = dict()
+    for workspace in [interleaved_workspace, sparse_workspace]:
+        manager = HB2BReductionManager()
+        manager.init_session('reduction', workspace)
+        manager.reduce_diffraction_data('reduction', False, 300, None, None, None, vanadium_counts=vanadium)
+        reduced[workspace.sparse_counts] = workspace.get_reduced_diffraction_data_set(None)
+
+    for dense_matrix, sparse_matrix in zip(reduced[False], reduced[True]):
+        np.testing.assert_allclose(sparse_matrix, dense_matrix, rtol=1E-12)
@@ -0,0 +1,94 @@
+import h5py
+import numpy as np
+import pytest
+from pyrs.core.peak_profile_utility import get_parameter_dtype
+from pyrs.core.summary_generator import SummaryGenerator, write_hdf5_table
+from pyrs.dataobjects import SampleLogs  # type: ignore
+from pyrs.peaks import PeakCollection  # type: ignore
+
+
+def test_write_data(tmpdir):
+    """The body has the text of each value of the peak and '-' for excluded sub runs"""
+    num_subruns = 3
+    sample_logs = SampleLogs()
+    sample_logs.subruns = np.arange(1, num_subruns + 1)
+    sample_logs['vx'] = np.array([0.1, 1. / 3., np.nan])
+    sample_logs['vy'] = np.array([1, 2, 3])
+
+    param_values = np.zeros(num_subruns, dtype=get_parameter_dtype('Gaussian', 'Linear'))
+    param_errors = np.zeros(num_subruns, dtype=get_parameter_dtype('Gaussian', 'Linear'))
+    param_values['PeakCentre'] = [80., 80.5, 81. / 7.]
+    param_values['Height'] = [10., 20., 30.]
+    param_values['Sigma'] = 0.1
+    param_errors['PeakCentre'] = 1.E-3
+    peaks = PeakCollection('peak', 'Gaussian', 'Linear', wavelength=1.54, d_reference=1.17)
+    peaks.set_peak_fitting_values(sample_logs.subruns.raw_copy(), param_values, param_errors,
+                                  np.array([1.5, np.inf, 2.5]))
+    peaks.set_exclude_subrun(1, True)
+
+    filename = str(tmpdir.join('summary.csv'))
+    SummaryGenerator(filename, log_list=['vx', 'vy']).write_csv(sample_logs, [peaks])
+    with open(filename) as handle:
+        rows = [line.rstrip('\n').split(',') for line in handle if not line.startswith('#')][1:]
+
+    dspacing, dspacing_error = peaks.get_dspacing_center()
+    strain, strain_error = peaks.get_strain(units='microstrain')
+    values, errors = peaks.get_effective_params()
+    for index in (0, 2):
+        expected = [str(sample_logs.subruns[index]), str(sample_logs['vx'][index]), str(sample_logs['vy'][index]),
+                    str(dspacing[index]), str(strain[index])] + [str(value) for value in values[index]] \
+            + [str(dspacing_error[index]), str(strain_error[index])] + [str(error) for error in errors[index]] \
+            + [str(peaks.fitting_costs[index])]
+        assert rows[index] == expected
+    assert rows[1][:3] == ['2', '0.3333333333333333', '2']
+    assert rows[1][3:] == ['-'] * (len(rows[1]) - 3)
+
+
+def test_write_hdf5(tmpdir):
+    """The table has the columns of the CSV file as numbers and the rows of every run appended to it"""
+    sample_logs = SampleLogs()
+    sample_logs.subruns = np.arange(1, 4)
+    sample_logs['run_number'] = np.array([1234] * 3)
+    sample_logs['vx'] = np.array([0.1, 0.2, 0.3])
+    sample_logs['vy'] = np.array([1., 1., 1.])
+
+    param_values = np.zeros(3, dtype=get_parameter_dtype('Gaussian', 'Linear'))
+    param_values['PeakCentre'] = [80., 80.5, 81.]
+    param_values['Height'] = 10.
+    param_values['Sigma'] = 0.1
+    peaks = PeakCollection('peak', 'Gaussian', 'Linear', wavelength=1.54, d_reference=1.17)
+    peaks.set_peak_fitting_values(sample_logs.subruns.raw_copy(), param_values, param_values.copy(),
+                                  np.array([1.5, 2., 2.5]))
+    peaks.set_exclude_subrun(1, True)
+
+    csv_filename = str(tmpdir.join('summary.csv'))
+    filename = str(tmpdir.join('summary.h5'))
+    SummaryGenerator(csv_filename, log_list=['vx', 'vy', 'vz']).write_csv(sample_logs, [peaks])
+    # the HDF5 table does not need a CSV file
+    summary = SummaryGenerator(log_list=['vx', 'vy', 'vz'])
+    summary.write_hdf5(filename, sample_logs, [peaks])
+    summary.write_hdf5(filename, sample_logs, [peaks], append=True)
+    with open(csv_filename) as handle:
+        column_names = [line.rstrip('\n') for line in handle if not line.startswith('#')][0].split(',')
+
+    strain, _ = peaks.get_strain(units='microstrain')
+    with h5py.File(filename, 'r') as handle:
+        assert list(handle.attrs['columns']) == column_names
+        np.testing.assert_equal(handle['sub-run'][()], [1, 2, 3, 1, 2, 3])
+        np.testing.assert_equal(handle['vx'][()], np.tile(sample_logs['vx'], 2))
+        np.testing.assert_equal(handle['peak_strain'][()], np.tile([strain[0], np.nan, strain[2]], 2))
+        header = handle['headers/1']
+        assert (header.attrs['first_row'], header.attrs['number_rows']) == (3, 3)
+        assert header.attrs['run_number'] == 1234
+        assert header.attrs['vy'] == 1.
+        assert header.attrs['missing'] == 'vz'
+
+    # only tables with the same columns are appended
+    with pytest.raises(RuntimeError):
+        write_hdf5_table(filename, {'sub-run': np.arange(3)}, append=True)
+    with pytest.raises(RuntimeError):
+        summary.write_csv(sample_logs, [peaks])
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
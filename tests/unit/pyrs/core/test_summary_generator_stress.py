@@ -0,0 +1,70 @@
+import h5py
+import numpy as np
+import pytest
+from pyrs.core.summary_generator_stress import SummaryGeneratorStress
+
+
+def read_csv(filename):
+    """Column names and the numbers of each column of a stress csv file, NaN for the empty entries"""
+    with open(filename) as handle:
+        lines = [line.rstrip('\n').split(', ') for line in handle if not line.startswith('#')]
+    columns = [[float(entry) if entry else np.nan for entry in column] for column in zip(*lines[1:])]
+    return lines[0], columns
+
+
+@pytest.mark.parametrize('stress_type', ['diagonal', 'in-plane-strain', 'in-plane-stress'])
+def test_summary_csv_beyond_d_reference(tmpdir, strain_stress_object_1, stress_type):
+    """Grid points beyond the d-reference of the first peak collection have a single empty d0 entry"""
+    for strain in strain_stress_object_1['strains'].values():
+        for peak_collection in strain.peak_collections:
+            peak_collection.projectfilename = 'HB2B_{}.h5'.format(peak_collection.runnumber)
+    stress = strain_stress_object_1['stresses'][stress_type]
+    filename = str(tmpdir.join('stress.csv'))
+    SummaryGeneratorStress(filename, stress).write_summary_csv()
+
+    with open(filename) as handle:
+        lines = [line.rstrip('\n').split(', ') for line in handle if not line.startswith('#')]
+    column_names, rows = lines[0], lines[1:]
+    # strain11 (run 1234) only has the first 8 grid points
+    assert len(rows) > 8
+    for row in rows:
+        assert len(row) == len(column_names)
+    for row in rows[8:]:
+        assert row[column_names.index('d0')] == ''
+        assert row[column_names.index('d0_error')] == ''
+    _, columns = read_csv(filename)
+    np.testing.assert_allclose(columns[column_names.index('vx')], np.arange(len(rows)))
+    np.testing.assert_allclose(columns[column_names.index('d0')][:8], 1.)
+
+
+@pytest.mark.parametrize('stress_type', ['diagonal', 'in-plane-strain', 'in-plane-stress'])
+@pytest.mark.parametrize('full', [False, True])
+def test_write_hdf5(tmpdir, strain_stress_object_1, stress_type, full):
+    """The table has the columns of the csv files and the rows of every run appended to it"""
+    for strain in strain_stress_object_1['strains'].values():
+        for peak_collection in strain.peak_collections:
+            peak_collection.projectfilename = 'HB2B_{}.h5'.format(peak_collection.runnumber)
+    summary = SummaryGeneratorStress(str(tmpdir.join('stress.csv')), strain_stress_object_1['stresses'][stress_type])
+    filename = str(tmpdir.join('stress.h5'))
+    if full:
+        summary.write_full_csv()
+        summary.write_full_hdf5(filename)
+        summary.write_full_hdf5(filename, append=True)
+    else:
+        summary.write_summary_csv()
+        summary.write_summary_hdf5(filename)
+        summary.write_summary_hdf5(filename, append=True)
+
+    column_names, columns = read_csv(str(tmpdir.join('stress.csv')))
+    with h5py.File(filename, 'r') as handle:
+        assert list(handle.attrs['columns']) == column_names
+        assert handle['headers/1'].attrs['first_row'] == len(columns[0])
+        assert handle['headers/0'].attrs['Direction 11'] == '1234'
+        for name, column in zip(column_names, columns):
+            # the csv values are rounded to at most 12 decimals, strain and stress to integers
+            atol = 0.5 if name.startswith(('Strain', 'Stress')) else 0.01
+            np.testing.assert_allclose(handle[name][()], np.tile(column, 2), atol=atol, err_msg=name)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
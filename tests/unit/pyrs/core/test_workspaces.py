@@ -1,6 +1,10 @@
 import numpy as np
+import os
+import pytest
 
+from pyrs.core.instrument_geometry import DENEXDetectorGeometry, HidraSetup
 from pyrs.core.workspaces import HidraWorkspace
+from pyrs.projectfile import HidraProjectFile, HidraProjectFileMode  # type: ignore
 
 
 class TestHidraWorkspace:
@@ -12,3 +16,75 @@ class TestHidraWorkspace:
         assert workspace.get_sample_log_units('vx') == ''
         workspace.set_sample_log('vx', subruns, vx, 'mm')
         assert workspace.get_sample_log_units('vx') == 'mm'
+
+    @pytest.mark.parametrize('sparse_counts', [False, True])
+    def test_lazy_loading(self, tmpdir, sparse_counts):
+        # project file with raw counts and reduced data of 6 sub runs
+        sub_runs = np.arange(1, 7)
+        counts = np.random.default_rng(12).poisson(1., (6, 256))
+        two_theta = np.linspace(80., 90., 20)
+        intensities = np.arange(120.).reshape((6, 20))
+        source = HidraWorkspace('source')
+        source.set_sub_runs(sub_runs)
+        source.set_sample_log('vx', sub_runs, np.linspace(0., 1., 6))
+        for sub_run in sub_runs:
+            source.set_raw_counts(sub_run, counts[sub_run - 1])
+        source.set_reduced_diffraction_data_block(sub_runs, None, two_theta, intensities, np.sqrt(intensities))
+
+        file_name = os.path.join(tmpdir, 'project_file.h5')
+        project = HidraProjectFile(file_name, HidraProjectFileMode.OVERWRITE)
+        source.save_experimental_data(project)
+        source.save_reduced_diffraction_data(project, sub_runs)
+        project.write_instrument_geometry(HidraSetup(DENEXDetectorGeometry(16, 16, 0.01, 0.01, 0.985, False)))
+        project.close()
+
+        project = HidraProjectFile(file_name, HidraProjectFileMode.READONLY)
+        workspace = HidraWorkspace('lazy', sparse_counts=sparse_counts)
+        workspace.load_hidra_project(project, load_raw_counts=True, load_reduced_diffraction=True, lazy=True,
+                                     max_resident_sub_runs=2)
+        assert len(workspace._resident_counts) == 0
+        assert workspace.reduction_masks == [None]
+        assert workspace.has_raw_data(4)
+
+        for sub_run in [3, 1, 3, 5, 6]:
+            np.testing.assert_equal(workspace.get_detector_counts(sub_run), counts[sub_run - 1])
+            _, vec_intensity, vec_variance = workspace.get_reduced_diffraction_data(sub_run)
+            np.testing.assert_equal(vec_intensity, intensities[sub_run - 1])
+            np.testing.assert_equal(vec_variance, np.sqrt(intensities[sub_run - 1]))
+        # only the most recently used sub runs are kept
+        assert list(workspace._resident_counts.keys()) == [5, 6]
+        assert len(workspace._resident_reduced_data) == 2
+
+        # counts set to the workspace replace the counts in file
+        workspace.set_raw_counts(2, np.zeros(256, dtype=counts.dtype))
+        assert workspace.get_detector_counts(2).sum() == 0
+
+        # the whole data set is loaded to be updated
+        workspace.set_reduced_diffraction_data(4, None, two_theta, np.zeros(20), np.ones(20))
+        _, intensity_matrix, _ = workspace.get_reduced_diffraction_data_set()
+        np.testing.assert_equal(intensity_matrix[4], intensities[4])
+        np.testing.assert_equal(intensity_matrix[3], np.zeros(20))
+        project.close()
+
+    def test_contiguous_counts(self, tmpdir):
+        sub_runs = np.arange(1, 5)
+        counts = np.random.default_rng(3).poisson(2., (4, 256))
+        source = HidraWorkspace('source')
+        source.set_sub_runs(sub_runs)
+        for sub_run in sub_runs:
+            source.set_raw_counts(sub_run, counts[sub_run - 1])
+
+        file_name = os.path.join(tmpdir, 'project_file.h5')
+        project = HidraProjectFile(file_name, HidraProjectFileMode.OVERWRITE)
+        source.save_experimental_data(project, contiguous_counts=True)
+        project.write_instrument_geometry(HidraSetup(DENEXDetectorGeometry(16, 16, 0.01, 0.01, 0.985, False)))
+        project.close()
+
+        project = HidraProjectFile(file_name, HidraProjectFileMode.READONLY)
+        workspace = HidraWorkspace('lazy')
+        workspace.load_hidra_project(project, load_raw_counts=True, load_reduced_diffraction=False, lazy=True)
+        np.testing.assert_equal(workspace.get_detector_counts(3), counts[2])
+        block = workspace.get_detector_counts_block([2, 3])
+        assert isinstance(block, np.memmap)
+        np.testing.assert_equal(block, counts[1:3])
+        project.close()
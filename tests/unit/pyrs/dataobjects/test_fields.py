@@ -965,6 +965,22 @@ class TestStrainField:
             assert stacked.point_list == orig.point_list
         '''
 
+    def test_stack_overlapping(self):
+        def strain_instance(x):
+            zeros = np.zeros(len(x))
+            return StrainField(peak_collection=PeakCollectionLite('strain', strain=zeros, strain_error=zeros + 1.),
+                               point_list=PointList([x, zeros, zeros]))
+
+        # the point of the second strain joins two points of the first strain into one cluster
+        with pytest.raises(RuntimeError) as exception_info:
+            strain_instance([5.0, 0.0, 0.012]).stack_with(strain_instance([0.006, 3.0]))
+        assert 'At lest one of the strains has overlapping sample points' in str(exception_info.value)
+
+        with pytest.raises(RuntimeError) as exception_info:
+            StrainField.stack_strains(strain_instance([7.0, 8.0]), strain_instance([2.0, 0.0, 0.012]),
+                                      strain_instance([0.006, 2.0]))
+        assert 'Strain number 2 has overlapping points' in str(exception_info.value)
+
     def test_create_strain_field_from_file_no_peaks(self, test_data_dir):
         # this project file doesn't have peaks in it
         file_path = os.path.join(test_data_dir, 'HB2B_1060_first3_subruns.h5')
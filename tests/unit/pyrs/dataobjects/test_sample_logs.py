@@ -229,6 +229,15 @@ class TestPointList:
         for cluster, comparison in zip(clusters, [[1, 4, 5], [2, 6], [3, 7], [0], [8]]):
             assert cluster == pytest.approx(comparison)
 
+    def test_cluster_labels(self):
+        # points chained by distances below resolution end up in the same cluster
+        xyz = [[2.0, 0.0, 0.008, 5.0, 0.016, 2.005],
+               [0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+               [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]]
+        labels = PointList(xyz).cluster_labels(resolution=DEFAULT_POINT_RESOLUTION)
+        np.testing.assert_equal(labels, [0, 1, 1, 2, 1, 0])
+        assert PointList(xyz).cluster(resolution=DEFAULT_POINT_RESOLUTION) == [[1, 2, 4], [0, 5], [3]]
+
     def test_has_overlapping_points(self):
         xyz = [[0.0, 1.0, 2.0],
                [0.0, 0.0, 0.0],
@@ -0,0 +1,186 @@
+import time
+import numpy as np
+from pyrs.peaks import FitEngineFactory as PeakFitEngineFactory  # type: ignore
+from pyrs.core.workspaces import HidraWorkspace
+from pyrs.core.peak_profile_utility import pseudo_voigt, Gaussian
+from pyrs.peaks.numpy_fit_peak import proximity_tree, warm_start_steps
+import pytest
+
+
+def generate_workspace(peak_profile_type, peak_centers, fwhm, intensity, background=(10., 0.1)):
+    """Generate HiDRAWorkspace with one peak in each sub run on a linear background
+
+    Parameters
+    ----------
+    peak_profile_type: str
+        Gaussian or PseudoVoigt
+    peak_centers: list
+        peak center of each sub run
+    fwhm: float
+        peak width
+    intensity: float
+        peak intensity
+    background: tuple
+        A0 and A1 of the background
+
+    Returns
+    -------
+    pyrs.core.workspaces.HidraWorkspace
+    """
+    vec_x = np.linspace(75., 85., 500, endpoint=False)
+
+    test_workspace = HidraWorkspace('test')
+    sub_runs = list(range(1, len(peak_centers) + 1))
+    test_workspace.set_sub_runs(sub_runs)
+    for sub_run, peak_center in zip(sub_runs, peak_centers):
+        if peak_profile_type == 'Gaussian':
+            sigma = Gaussian.cal_sigma(fwhm)
+            vec_y = intensity / (sigma * np.sqrt(2. * np.pi)) * np.exp(-0.5 * ((vec_x - peak_center) / sigma) ** 2)
+        else:
+            vec_y = pseudo_voigt(vec_x, intensity, fwhm, 0.3, peak_center)
+        vec_y += background[0] + background[1] * (vec_x - 75.)
+        test_workspace.set_reduced_diffraction_data(sub_run, mask_id=None, two_theta_array=vec_x,
+                                                    intensity_array=vec_y)
+
+    return test_workspace
+
+
+@pytest.mark.parametrize('peak_profile_type', ['Gaussian', 'PseudoVoigt'])
+@pytest.mark.parametrize('background_type', ['Linear', 'Quadratic'])
+def test_fit_peaks(peak_profile_type, background_type):
+    """Fit a peak of known parameters in 3 sub runs"""
+    peak_centers = [79.8, 80., 80.3]
+    workspace = generate_workspace(peak_profile_type, peak_centers, fwhm=0.6, intensity=20.)
+
+    fit_engine = PeakFitEngineFactory.getInstance(workspace, peak_function_name=peak_profile_type,
+                                                  background_function_name=background_type,
+                                                  wavelength=np.nan, engine_name='numpy')
+    fit_result = fit_engine.fit_peaks(peak_tag='peak', x_min=78., x_max=82.)
+
+    assert len(fit_result.peakcollections) == 1
+    peak_collection = fit_result.peakcollections[0]
+    np.testing.assert_equal(peak_collection.sub_runs, [1, 2, 3])
+
+    values, errors = peak_collection.get_effective_params()
+    np.testing.assert_allclose(values['Center'], peak_centers, atol=1.E-4)
+    np.testing.assert_allclose(values['FWHM'], 0.6, rtol=1.E-3)
+    np.testing.assert_allclose(values['Intensity'], 20., rtol=1.E-3)
+    np.testing.assert_allclose(values['A1'], 0.1, rtol=1.E-2)
+    assert np.all(errors['Center'] > 0.)
+    assert np.all(peak_collection.fitting_costs < 1.E-4)
+
+    # calculated and difference spectra
+    assert fit_result.fitted.getNumberHistograms() == 3
+    in_window = (fit_result.fitted.readX(1) >= 78.) & (fit_result.fitted.readX(1) <= 82.)
+    np.testing.assert_allclose(fit_result.difference.readY(1)[in_window], 0., atol=1.E-3)
+    np.testing.assert_equal(fit_result.fitted.readY(1)[~in_window], 0.)
+
+
+def test_fit_multiple_peaks():
+    """Fit 2 Gaussian peaks on a flat background"""
+    workspace = generate_workspace('Gaussian', [80.], fwhm=0.5, intensity=10., background=(5., 0.))
+    vec_x, vec_y, _ = workspace.get_reduced_diffraction_data_set()
+    sigma = Gaussian.cal_sigma(0.4)
+    vec_y = vec_y[0] + 4. / (sigma * np.sqrt(2. * np.pi)) * np.exp(-0.5 * ((vec_x[0] - 83.) / sigma) ** 2)
+    workspace.set_reduced_diffraction_data(1, mask_id=None, two_theta_array=vec_x[0], intensity_array=vec_y)
+
+    fit_engine = PeakFitEngineFactory.getInstance(workspace, peak_function_name='Gaussian',
+                                                  background_function_name='Flat',
+                                                  wavelength=np.nan, engine_name='numpy')
+    fit_result = fit_engine.fit_multiple_peaks(['left', 'right'], [78.5, 81.5], [81.5, 84.5])
+
+    assert [peaks.peak_tag for peaks in fit_result.peakcollections] == ['left', 'right']
+    for peaks, center, fwhm, intensity in zip(fit_result.peakcollections, [80., 83.], [0.5, 0.4], [10., 4.]):
+        values, _ = peaks.get_effective_params()
+        np.testing.assert_allclose(values['Center'], center, atol=1.E-4)
+        np.testing.assert_allclose(values['FWHM'], fwhm, rtol=1.E-3)
+        np.testing.assert_allclose(values['Intensity'], intensity, rtol=1.E-3)
+        np.testing.assert_allclose(values['A0'], 5., rtol=1.E-3)
+        np.testing.assert_equal(values['A1'], 0.)
+    assert fit_result.fitted.name() == 'left_fitted'
+
+    # peaks fitted concurrently are the same as the ones fitted one after another
+    serial_result = fit_engine.fit_multiple_peaks(['left', 'right'], [78.5, 81.5], [81.5, 84.5], max_workers=1)
+    for peaks, serial_peaks in zip(fit_result.peakcollections, serial_result.peakcollections):
+        assert peaks.peak_tag == serial_peaks.peak_tag
+        np.testing.assert_equal(peaks.get_native_params()[0], serial_peaks.get_native_params()[0])
+    np.testing.assert_equal(fit_result.fitted.extractY(), serial_result.fitted.extractY())
+    np.testing.assert_equal(fit_result.difference.extractY(), serial_result.difference.extractY())
+
+
+def test_proximity_tree():
+    """Points on a line in random order start from their neighbours on the line"""
+    positions = np.array([3., 0., 4., 1., 2.])
+    order, neighbours = proximity_tree(positions.reshape(-1, 1))
+    np.testing.assert_equal(order, [0, 2, 4, 3, 1])
+    np.testing.assert_equal(neighbours, [-1, 3, 0, 4, 0])
+
+    steps = warm_start_steps(order, neighbours)
+    np.testing.assert_equal([points for points, _ in steps], [[0], [2, 4], [3], [1]])
+    np.testing.assert_equal(steps[1][1], [0, 0])
+
+
+def test_proximity_tree_grid():
+    """A large mapping grid is ordered from the graph of nearest points in much less than a second"""
+    grid = np.stack(np.meshgrid(np.arange(120.), np.arange(100.)), axis=-1).reshape(-1, 2)
+    start = time.time()
+    order, neighbours = proximity_tree(grid)
+    steps = warm_start_steps(order, neighbours)
+    assert time.time() - start < 0.5
+
+    # every point but the first starts from an adjacent point fitted in an earlier step
+    assert order[0] == 0
+    np.testing.assert_equal(np.sort(order), np.arange(grid.shape[0]))
+    np.testing.assert_equal(np.flatnonzero(neighbours < 0), [0])
+    np.testing.assert_allclose(np.linalg.norm(grid[neighbours[1:]] - grid[1:], axis=1), 1.)
+    fitted = np.zeros(grid.shape[0], dtype=bool)
+    for points, point_neighbours in steps:
+        assert np.all(fitted[point_neighbours[point_neighbours >= 0]])
+        fitted[points] = True
+    assert np.all(fitted)
+
+    # scans far apart are not connected and both start without a neighbour
+    _, neighbours = proximity_tree(np.concatenate((grid, grid + 1000.)))
+    np.testing.assert_equal(np.flatnonzero(neighbours < 0), [0, grid.shape[0]])
+
+
+def test_warm_start():
+    """Narrow peaks drifting across a line scan are only found from the neighbours' results"""
+    positions = np.arange(-10, 11)
+    positions = positions[np.argsort(np.abs(positions), kind='stable')]  # scan from the middle
+    peak_centers = 80. + 0.05 * positions
+    workspace = generate_workspace('Gaussian', peak_centers, fwhm=0.2, intensity=2., background=(1., 0.))
+    sub_runs = workspace.get_sub_runs().raw_copy()
+    for name, values in (('vx', positions), ('vy', np.zeros(positions.size)), ('vz', np.zeros(positions.size))):
+        workspace.set_sample_log(name, sub_runs, values.astype(float), units='mm')
+
+    results = dict()
+    for warm_start in (False, True):
+        fit_engine = PeakFitEngineFactory.getInstance(workspace, peak_function_name='Gaussian',
+                                                      background_function_name='Flat', wavelength=np.nan,
+                                                      engine_name='numpy', warm_start=warm_start)
+        peaks = fit_engine.fit_peaks(peak_tag='peak', x_min=78.5, x_max=81.5).peakcollections[0]
+        results[warm_start] = peaks.get_effective_params()[0]['Center']
+
+    np.testing.assert_allclose(results[True], peak_centers, atol=1.E-4)
+    assert not np.allclose(results[False], peak_centers, atol=1.E-4)
+
+    with pytest.raises(RuntimeError):
+        PeakFitEngineFactory.getInstance(workspace, 'Gaussian', 'Flat', np.nan, warm_start=True)
+
+
+def test_peak_at_maximum():
+    """Narrow peaks away from the center of the fit window are found from the maximum of the data"""
+    peak_centers = 80. + 0.05 * np.arange(-10, 11)
+    workspace = generate_workspace('Gaussian', peak_centers, fwhm=0.2, intensity=2., background=(1., 0.))
+
+    fit_engine = PeakFitEngineFactory.getInstance(workspace, peak_function_name='Gaussian',
+                                                  background_function_name='Flat', wavelength=np.nan,
+                                                  engine_name='numpy', peak_at_maximum=True)
+    peaks = fit_engine.fit_peaks(peak_tag='peak', x_min=78.5, x_max=81.5).peakcollections[0]
+
+    np.testing.assert_allclose(peaks.get_effective_params()[0]['Center'], peak_centers, atol=1.E-4)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
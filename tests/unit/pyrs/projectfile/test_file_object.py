@@ -5,6 +5,7 @@ import pytest
 
 from pyrs.core.peak_profile_utility import PeakShape, BackgroundFunction
 from pyrs.dataobjects.constants import HidraConstants
+from pyrs.dataobjects.sparse_counts import SparseCounts
 from pyrs.peaks import PeakCollection  # type: ignore
 from pyrs.projectfile import HidraProjectFile, HidraProjectFileMode  # type: ignore
 
@@ -44,6 +45,114 @@ class TestHidraProjectFile:
         project.append_experiment_log('vy', np.array([0.3, 0.4, 0.5]), units='mm')
         assert group['vy'].attrs['units'] == 'mm'
 
+    @pytest.mark.parametrize('compression', [None, 'lzf', 'gzip'])
+    def test_raw_counts(self, tmpdir, compression):
+        file_name = os.path.join(tmpdir, 'project_file.hdf')
+        project = HidraProjectFile(file_name, HidraProjectFileMode.OVERWRITE)
+        counts = np.random.default_rng(938).poisson(2., 1024 ** 2)
+        counts[17] = 300
+        project.append_raw_counts(1, counts, compression=compression)
+        project.append_raw_counts(2, np.zeros(1024 ** 2, dtype=np.int64), compression=compression)
+        project.append_raw_counts(3, np.full(16, -1), compression=compression)
+        project.close()
+
+        project = HidraProjectFile(file_name, HidraProjectFileMode.READONLY)
+        for sub_run, expected in [(1, counts), (2, np.zeros(1024 ** 2, dtype=np.int64)), (3, np.full(16, -1))]:
+            read_counts = project.read_raw_counts(sub_run)
+            assert read_counts.dtype == expected.dtype
+            np.testing.assert_array_equal(read_counts, expected)
+
+        counts_group = project._project_h5[HidraConstants.RAW_DATA][HidraConstants.SUB_RUNS]
+        if compression is None:
+            assert counts_group['0001']['counts'].dtype == np.int64
+            assert 'compression' not in counts_group['0001']['counts'].attrs
+        else:
+            assert counts_group['0001']['counts'].dtype == np.uint16
+            assert counts_group['0002']['counts'].dtype == np.uint8
+            assert counts_group['0003']['counts'].dtype == np.int64  # negative counts are not narrowed
+            assert counts_group['0001']['counts'].attrs['compression'] == compression
+        project.close()
+
+    def test_sparse_raw_counts(self, tmpdir):
+        file_name = os.path.join(tmpdir, 'project_file.hdf')
+        project = HidraProjectFile(file_name, HidraProjectFileMode.OVERWRITE)
+        counts = np.zeros(1024 ** 2, dtype=np.int64)
+        counts[[5, 300, 7000]] = [1, 400, 2]
+        project.append_raw_counts(1, SparseCounts.from_dense(counts))
+        project.append_raw_counts(2, counts)
+        project.close()
+
+        project = HidraProjectFile(file_name, HidraProjectFileMode.READONLY)
+        for sub_run in [1, 2]:
+            np.testing.assert_array_equal(project.read_raw_counts(sub_run), counts)
+            sparse_counts = project.read_sparse_raw_counts(sub_run)
+            assert sparse_counts.num_pixels == counts.size
+            np.testing.assert_array_equal(sparse_counts.pixel_ids, [5, 300, 7000])
+            np.testing.assert_array_equal(sparse_counts.counts, [1, 400, 2])
+            assert sparse_counts.dtype == np.int64
+        project.close()
+
+        with pytest.raises(RuntimeError):
+            SparseCounts([3, 2], [1, 1], 10)  # pixel IDs are not sorted
+        with pytest.raises(RuntimeError):
+            SparseCounts([3, 10], [1, 1], 10)  # pixel ID out of range
+
+    def test_raw_counts_block(self, tmpdir):
+        file_name = os.path.join(tmpdir, 'project_file.hdf')
+        project = HidraProjectFile(file_name, HidraProjectFileMode.OVERWRITE)
+        counts = np.random.default_rng(5).poisson(3., (5, 4096))
+        project.write_raw_counts_block([2, 3, 4, 6, 7], counts)
+        assert project.has_raw_counts_block()
+        with pytest.raises(RuntimeError):
+            project.write_raw_counts_block([2, 3, 4, 6, 7], counts)
+        project.close()
+
+        project = HidraProjectFile(file_name, HidraProjectFileMode.READONLY)
+        np.testing.assert_array_equal(project.read_raw_counts(6), counts[3])
+        assert project.read_raw_counts(6).dtype == counts.dtype
+        # consecutive sub runs are mapped from the file with the narrowed type
+        block = project.read_raw_counts_block([3, 4, 6])
+        assert isinstance(block, np.memmap)
+        assert block.dtype == np.uint8
+        np.testing.assert_array_equal(block, counts[1:4])
+        np.testing.assert_array_equal(project.read_raw_counts_block([7, 2, 7]), counts[[4, 0, 4]])
+        np.testing.assert_array_equal(project.read_raw_counts_block(), counts)
+        with pytest.raises(RuntimeError):
+            project.read_raw_counts_block([5])
+        project.close()
+
+        # counts given by sub run are written one row at a time
+        project = HidraProjectFile(file_name, HidraProjectFileMode.READWRITE)
+        counts[2, 7] = 300
+        project.write_raw_counts_block([2, 3, 4, 6, 7], lambda sub_run: counts[[2, 3, 4, 6, 7].index(sub_run)],
+                                       overwrite=True)
+        project.close()
+
+        project = HidraProjectFile(file_name, HidraProjectFileMode.READONLY)
+        assert project.read_raw_counts_block().dtype == np.uint16
+        np.testing.assert_array_equal(project.read_raw_counts_block(), counts)
+        np.testing.assert_array_equal(project.read_raw_counts(4), counts[2])
+        project.close()
+
+    def test_read_diffraction_rows(self, tmpdir):
+        project = HidraProjectFile(os.path.join(tmpdir, 'project_file.hdf'), HidraProjectFileMode.OVERWRITE)
+        sub_runs = np.array([3, 4, 7, 9])
+        project.write_sub_runs(sub_runs)
+        intensities = np.arange(40.).reshape((4, 10))
+        project.write_reduced_diffraction_data_set(np.tile(np.linspace(80., 90., 10), (4, 1)),
+                                                   {None: intensities}, {None: np.sqrt(intensities)})
+
+        np.testing.assert_equal(project.read_diffraction_intensity_vector(None, 7), intensities[2])
+        np.testing.assert_equal(project.read_diffraction_variance_vector(None, 9), np.sqrt(intensities[3]))
+        np.testing.assert_equal(project.read_diffraction_intensity_vectors(None, [9, 3, 9]),
+                                intensities[[3, 0, 3]])
+        np.testing.assert_equal(project.read_diffraction_variance_vectors(None, [4, 7]),
+                                np.sqrt(intensities[[1, 2]]))
+        assert project.read_diffraction_intensity_vectors(None, []).shape == (0, 10)
+        with pytest.raises(ValueError):
+            project.read_diffraction_intensity_vector(None, 5)
+        project.close()
+
     def test_read_log_units(self, tmpdir):
         project = HidraProjectFile(os.path.join(tmpdir, 'project_file.hdf'), HidraProjectFileMode.OVERWRITE)
 
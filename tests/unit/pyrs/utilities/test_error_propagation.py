@@ -0,0 +1,41 @@
+import numpy as np
+import warnings
+import pytest
+from uncertainties import unumpy
+from pyrs.utilities.error_propagation import linear_combination, propagate_errors
+
+
+def test_linear_combination():
+    values = [np.array([1., 2., np.nan]), np.array([3., 4., 5.])]
+    errors = [np.array([0.1, 0.2, 0.3]), np.array([0.4, 0., np.nan])]
+    combination, combination_errors = linear_combination([2., -0.5], values, errors)
+
+    expected = 2. * unumpy.uarray(values[0], errors[0]) - 0.5 * unumpy.uarray(values[1], errors[1])
+    np.testing.assert_allclose(combination, unumpy.nominal_values(expected), equal_nan=True)
+    np.testing.assert_allclose(combination_errors, unumpy.std_devs(expected), equal_nan=True)
+
+    with pytest.raises(RuntimeError):
+        linear_combination([1.], values, errors)
+
+
+def test_propagate_errors_correlated():
+    """x * y / z where y and z are the same variable for the first element"""
+    x, y, z = np.array([2., 3.]), np.array([5., 5.]), np.array([5., 4.])
+    x_error, y_error, z_error = np.array([0.1, 0.2]), np.array([0.3, 0.3]), np.array([0.3, 0.5])
+    errors = propagate_errors([y / z, x / z, -x * y / z**2], [x_error, y_error, z_error],
+                              {(1, 2): np.array([1., 0.])})
+
+    x_u, z_u = unumpy.uarray(x, x_error), unumpy.uarray(z, z_error)
+    expected = x_u * np.array([z_u[0], unumpy.uarray(y, y_error)[1]]) / z_u
+    np.testing.assert_allclose(errors, unumpy.std_devs(expected))
+    np.testing.assert_allclose(errors[0], x_error[0])
+
+    # exact variables do not contribute even with non-finite derivatives, without warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert propagate_errors([np.inf, 2.], [0., 0.5]) == 1.
+        np.testing.assert_equal(propagate_errors([np.array([np.inf, 1.])], [np.array([0., 0.5])]), [0., 0.5])
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])